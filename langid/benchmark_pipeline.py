@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import MENTION, clean_text, \
+    load_sentence_tokenizer, predict_ft, predict_li, predict_li_vectorized, \
+    preprocess_caption, remove_emoji, split_sentence
+from hashtag_segmentation import load_word_frequencies, segment_hashtag
+import argparse
+import datetime
+import emoji
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+"""
+This script benchmarks each stage of the language identification pipeline on
+a synthetic corpus of captions, in order to show where the time goes inside
+detect_ft() and detect_li() and to track regressions across versions.
+
+The synthetic captions are assembled from the captions in the dummy dataset,
+which contain emoji and text in several languages. Captions are joined into
+multilingual captions and decorated with hashtags, mentions and URLs at
+configurable rates.
+
+The following stages are timed separately, each using the output of the
+previous stage as input:
+
+    emoji:        removing emoji, see remove_emoji()
+    regex:        removing mentions
+    token_filter: removing hashtags, non-words and URLs and simplifying
+                  punctuation
+    punkt:        splitting the captions into sentences
+    prediction:   predicting the language of the sentences
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 benchmark_pipeline.py -n 100000 -p 'rm_all' -m 'fasttext' \
+        -o benchmark.json
+
+Returns:
+    A JSON document with the throughput, duration and peak memory of each
+    stage, which is written to the output file or printed.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to the captions used for generating the corpus
+ap.add_argument("-i", "--input", required=False,
+                default='../utils/dummydata.pkl',
+                help="Path to the pandas DataFrame with the captions used for "
+                     "generating the corpus. The captions are expected to be "
+                     "found in a column named 'text'. Defaults to the dummy "
+                     "dataset.")
+
+# Define the size of the corpus
+ap.add_argument("-n", "--size", required=False, type=int, default=10000,
+                help="Number of captions in the synthetic corpus, e.g. from "
+                     "10000 to 10000000. Defaults to 10000.")
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=False, default='rm_all',
+                help="Preprocessing strategy: valid values include "
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'. Defaults "
+                     "to 'rm_all'.")
+
+# Define the language identification model
+ap.add_argument("-m", "--model", required=False, default='fasttext',
+                help="Language identification model: valid values include "
+                     "'fasttext', 'langid', 'langid_batch', which scores "
+                     "batches of sentences using the vectorized langid.py "
+                     "engine, and 'none', which skips the prediction stage. "
+                     "Defaults to 'fasttext'.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=False,
+                help="Path to the output JSON file. If not defined, the "
+                     "results are printed.")
+
+# Define the rates at which the captions are decorated
+ap.add_argument("-ht", "--hashtags", required=False, type=float, default=0.5,
+                help="Share of captions with hashtags. Defaults to 0.5.")
+ap.add_argument("-mn", "--mentions", required=False, type=float, default=0.2,
+                help="Share of captions with mentions. Defaults to 0.2.")
+ap.add_argument("-u", "--urls", required=False, type=float, default=0.05,
+                help="Share of captions with URLs. Defaults to 0.05.")
+ap.add_argument("-mx", "--mix", required=False, type=float, default=0.2,
+                help="Share of captions that combine sentences from several "
+                     "captions, which may be in different languages. "
+                     "Defaults to 0.2.")
+
+# Define the random seed
+ap.add_argument("-s", "--seed", required=False, type=int, default=42,
+                help="Seed for generating the corpus. Defaults to 42.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt parameters saved using train_punkt.py.")
+
+# Define the path to word frequencies for segmenting hashtags
+ap.add_argument("-hs", "--hashtag_segmentation", required=False,
+                help="Path to word frequencies saved using "
+                     "train_word_frequencies.py. If set, the 'rm_trail' "
+                     "preprocessing strategy splits the remaining hashtags "
+                     "into words and keeps captions consisting only of "
+                     "hashtags.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Assign arguments to variables
+prep = args['preprocessing']
+
+# Set up the random number generator
+rng = random.Random(args['seed'])
+
+# Load the captions used for generating the corpus
+input_df = pd.read_pickle(args['input'])
+source = [c for c in input_df['text'] if isinstance(c, str) and c != 'None']
+
+# Collect a vocabulary for hashtags and a list of emoji from the captions
+words = sorted(set(w for c in source for w in c.split() if w.isalpha()))
+emojis = sorted(emoji.UNICODE_EMOJI)
+
+
+def generate_caption():
+    """Generates a synthetic caption.
+
+    Returns:
+        A string containing the caption.
+    """
+    # Draw a caption and possibly join it with parts of other captions, which
+    # are separated by full stops to create sentence boundaries
+    parts = [rng.choice(source)]
+    while rng.random() < args['mix'] and len(parts) < 4:
+        parts.append(rng.choice(source))
+    caption = '. '.join(parts)
+
+    # Add mentions to the beginning of the caption
+    if rng.random() < args['mentions']:
+        caption = ' '.join('@user{}'.format(rng.randrange(100000))
+                           for _ in range(rng.randint(1, 3))) + ' ' + caption
+
+    # Add a URL to the end of the caption
+    if rng.random() < args['urls']:
+        caption += ' https://example.com/p/{}'.format(rng.randrange(10 ** 8))
+
+    # Add emoji to the end of the caption
+    if rng.random() < 0.5:
+        caption += ' ' + ''.join(rng.choice(emojis)
+                                 for _ in range(rng.randint(1, 3)))
+
+    # Add a hashtag inside the caption and hashtags trailing the caption
+    if rng.random() < args['hashtags']:
+        tokens = caption.split(' ')
+        tokens.insert(rng.randrange(len(tokens) + 1), '#' + rng.choice(words))
+        caption = ' '.join(tokens) + ' ' + ' '.join(
+            '#' + rng.choice(words) for _ in range(rng.randint(0, 8)))
+
+    # Return the caption
+    return caption
+
+
+def run_stage(name, function, inputs, unit='captions'):
+    """Times a stage of the pipeline and measures its peak memory use.
+
+    The stage is run twice: first for timing and then under tracemalloc for
+    measuring the peak memory allocated by Python, as tracing slows down the
+    execution.
+
+    Args:
+        name: The name of the stage.
+        function: A function that takes the inputs and returns the outputs.
+        inputs: A list of inputs to the stage.
+        unit: The unit of the inputs used for reporting throughput.
+
+    Returns:
+        A tuple consisting of the outputs of the stage and a dictionary with
+        the results.
+    """
+    # Inform the user
+    print('[INFO] Running stage {} ...'.format(name), file=sys.stderr)
+
+    # Time the stage
+    start = time.perf_counter()
+    outputs = function(inputs)
+    elapsed = time.perf_counter() - start
+
+    # Measure the peak memory allocated by Python during the stage
+    tracemalloc.start()
+    function(inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Return the outputs and the results
+    return outputs, {'unit': unit,
+                     'items': len(inputs),
+                     'seconds': elapsed,
+                     'items_per_sec': len(inputs) / max(elapsed, 1e-9),
+                     'peak_alloc_mb': peak / 2 ** 20,
+                     'max_rss_mb': resource.getrusage(
+                         resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def git_revision():
+    """Returns the current git revision of the repository, or None."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode()\
+            .strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Generate the corpus
+print('[INFO] Generating {} captions ...'.format(args['size']),
+      file=sys.stderr)
+captions = [generate_caption() for _ in range(args['size'])]
+
+# Set up hashtag segmentation, if requested
+if args['hashtag_segmentation'] is not None:
+    load_word_frequencies(args['hashtag_segmentation'])
+
+# Set up the sentence tokenizer and load the model, so that neither is timed
+load_sentence_tokenizer(args['sentence_params'])
+predict = {'fasttext': predict_ft, 'langid': predict_li,
+           'langid_batch': predict_li_vectorized}.get(args['model'])
+if predict is not None:
+    predict([])
+
+# Set up a dictionary for the results of each stage
+stages = {}
+
+# Run the preprocessing stages
+texts = captions
+if prep != 'no_preprocessing':
+    texts, stages['emoji'] = run_stage(
+        'emoji', lambda x: [remove_emoji(c) for c in x], texts)
+    texts, stages['regex'] = run_stage(
+        'regex', lambda x: [MENTION.sub('', c) for c in x], texts)
+texts, stages['token_filter'] = run_stage(
+    'token_filter', lambda x: [clean_text(c, prep) for c in x], texts)
+
+# Check that the stages produce the same output as the preprocessing function
+# for a sample of captions
+for c, t in zip(captions[:1000], texts):
+    assert preprocess_caption(c, prep) == t, c
+
+# Run the sentence splitter
+sentences, stages['punkt'] = run_stage(
+    'punkt', lambda x: [s for c in x for s in split_sentence(c)], texts)
+
+# Run the model
+if predict is not None:
+    _, stages['prediction'] = run_stage('prediction', predict, sentences,
+                                        unit='sentences')
+
+# Collect the results and metadata
+results = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+           'revision': git_revision(),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'captions': args['size'],
+           'sentences': len(sentences),
+           'preprocessing': prep,
+           'model': args['model'],
+           'seed': args['seed'],
+           'rates': {k: args[k] for k in ['hashtags', 'mentions', 'urls',
+                                          'mix']},
+           'stages': stages,
+           'hashtag_cache': segment_hashtag.cache_info()._asdict()
+           if args['hashtag_segmentation'] is not None else None,
+           'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+           / 1024}
+
+# Write the results to the output file or print them
+if args['output'] is not None:
+    with open(args['output'], 'w') as f:
+        json.dump(results, f, indent=2)
+else:
+    print(json.dumps(results, indent=2))
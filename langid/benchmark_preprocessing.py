@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import preprocess_caption, \
+    preprocess_caption_reference
+import argparse
+import pandas as pd
+import time
+
+"""
+This script benchmarks the caption preprocessing function against its original
+implementation and checks that both produce identical output.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 benchmark_preprocessing.py -i ../utils/dummydata.pkl
+
+Returns:
+    Prints the throughput of both implementations for each preprocessing
+    strategy in captions per second.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define the number of repetitions
+ap.add_argument("-r", "--repeat", required=False, type=int, default=3,
+                help="Number of times each benchmark is repeated. The fastest "
+                     "run is reported.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Load the input DataFrame and drop missing captions
+input_df = pd.read_pickle(args['input'])
+captions = [c for c in input_df[inputcol] if c is not None and c != 'None']
+
+
+def benchmark(function, mode):
+    """Times a preprocessing function over all captions.
+
+    Args:
+        function: The preprocessing function to benchmark.
+        mode: The preprocessing strategy passed to the function.
+
+    Returns:
+        A tuple consisting of the preprocessed captions and the time taken by
+        the fastest run in seconds.
+    """
+    # Set up a list for the durations of each run
+    durations = []
+
+    # Repeat the benchmark
+    for _ in range(args['repeat']):
+        start = time.perf_counter()
+        output = [function(c, mode) for c in captions]
+        durations.append(time.perf_counter() - start)
+
+    # Return the output and the fastest run
+    return output, min(durations)
+
+
+# Loop over the preprocessing strategies
+for mode in ['no_preprocessing', 'rm_all', 'rm_trail']:
+
+    # Benchmark both implementations
+    reference, ref_time = benchmark(preprocess_caption_reference, mode)
+    compiled, comp_time = benchmark(preprocess_caption, mode)
+
+    # Count the captions for which the output differs
+    mismatches = sum(r != c for r, c in zip(reference, compiled))
+
+    # Print the results
+    print('[INFO] {}: reference {:.0f} captions/sec, compiled {:.0f} '
+          'captions/sec, speedup {:.1f}x, {} mismatches'
+          .format(mode, len(captions) / ref_time, len(captions) / comp_time,
+                  ref_time / comp_time, mismatches))
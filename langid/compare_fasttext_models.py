@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import FT_COMPRESSED_MODEL_PATH, FT_MODEL_PATH, \
+    get_ft_model, load_sentence_tokenizer, predict_ft, prepare_captions, \
+    set_ft_model_path
+from parallel_detection import memory_usage
+from collections import Counter
+import argparse
+import json
+import multiprocessing
+import os
+import pandas as pd
+import sys
+import time
+
+"""
+This script compares fastText language identification models, such as the
+full model lid.176.bin and the compressed model lid.176.ftz, on the same set of
+captions, in order to choose a model e.g. for worker nodes with little memory.
+
+The captions are preprocessed and split into sentences once, after which each
+model is loaded in a separate process, so that the memory taken up by one
+model does not affect the measurements for the next. For each model, the
+script reports the size of the model file, the time taken to load the model,
+the resident memory taken up by the model and the number of sentences
+classified per second. The predictions of each model are compared against the
+first model, both overall and for each language predicted by the first model.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 compare_fasttext_models.py -i input.pkl -p 'rm_all' \
+        -m models/lid.176.bin models/lid.176.ftz -o comparison.json
+
+Returns:
+    A JSON document with the measurements for each model and the agreement
+    between the models, which is written to the output file or printed.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=False,
+                default='../utils/dummydata.pkl',
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'. Defaults to the dummy dataset.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define the models to compare
+ap.add_argument("-m", "--models", required=False, nargs='+',
+                default=[FT_MODEL_PATH, FT_COMPRESSED_MODEL_PATH],
+                help="Paths to the fastText models to compare. The "
+                     "predictions of the other models are compared against "
+                     "the first model. Defaults to {} and {}."
+                     .format(FT_MODEL_PATH, FT_COMPRESSED_MODEL_PATH))
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=False, default='rm_all',
+                help="Preprocessing strategy: valid values include "
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'. Defaults "
+                     "to 'rm_all'.")
+
+# Define the sample size
+ap.add_argument("-n", "--sample_size", required=False, type=int,
+                help="Number of texts sampled from the input. If not defined, "
+                     "all texts are used.")
+
+# Define batch size for fastText
+ap.add_argument("-b", "--batch_size", required=False, type=int, default=10000,
+                help="Pass the sentences to fastText in batches of this size. "
+                     "Defaults to 10000.")
+
+# Define the minimum number of sentences for reporting a language
+ap.add_argument("-ms", "--min_sentences", required=False, type=int,
+                default=10,
+                help="Report the agreement for languages predicted for at "
+                     "least this many sentences by the first model. Defaults "
+                     "to 10.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt sentence tokenizer parameters trained "
+                     "using train_punkt.py. If not set, the default "
+                     "parameters are used.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=False,
+                help="Path to the output JSON file. If not defined, the "
+                     "results are printed.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+
+def evaluate_model(path):
+    """Loads a fastText model and classifies the sentences.
+
+    This function is run in a separate process for each model.
+
+    Args:
+        path: Path to the fastText model.
+
+    Returns:
+        A tuple consisting of a dictionary with the measurements and a list of
+        the predicted languages.
+    """
+    # Measure the memory use before loading the model
+    before = memory_usage()
+
+    # Load the model
+    start = time.perf_counter()
+    set_ft_model_path(path)
+    get_ft_model()
+    load_time = time.perf_counter() - start
+
+    # Measure the memory use after loading the model
+    after = memory_usage()
+
+    # Classify the sentences
+    start = time.perf_counter()
+    languages, _ = predict_ft(sentences, batch_size=args['batch_size'])
+    elapsed = time.perf_counter() - start
+
+    # Return the measurements and the predicted languages
+    return {'path': path,
+            'file_size_mb': os.path.getsize(path) / 2 ** 20,
+            'load_seconds': load_time,
+            'model_rss_mb': after['rss'] - before['rss']
+            if after is not None else None,
+            'rss_mb': memory_usage()['rss'] if after is not None else None,
+            'predict_seconds': elapsed,
+            'sentences_per_sec': len(sentences) / max(elapsed, 1e-9)}, \
+        languages
+
+
+def compare(reference, languages):
+    """Compares the languages predicted by a model against a reference model.
+
+    Args:
+        reference: A list of languages predicted by the reference model.
+        languages: A list of languages predicted by the compared model.
+
+    Returns:
+        A dictionary with the share of sentences on which the models agree,
+        overall and for each language predicted by the reference model for
+        at least the minimum number of sentences.
+    """
+    # Count the sentences and agreements for each reference language
+    totals = Counter(reference)
+    agree = Counter(ref_lang for ref_lang, lang in zip(reference, languages)
+                    if ref_lang == lang)
+
+    # Return the overall agreement and the agreement for each language, from
+    # the most to the least frequent
+    return {'agreement': sum(agree.values()) / max(len(reference), 1),
+            'languages': {lang: {'sentences': n,
+                                 'agreement': agree[lang] / n}
+                          for lang, n in totals.most_common()
+                          if n >= args['min_sentences']}}
+
+
+# Check that the models exist
+for model in args['models']:
+    if not os.path.exists(model):
+        ap.error("fastText model not found at {}".format(model))
+
+# Load the input DataFrame and drop missing texts
+input_df = pd.read_pickle(args['input'])
+texts = input_df.loc[input_df[inputcol].notnull() &
+                     (input_df[inputcol] != 'None'), inputcol]
+
+# Draw a sample of texts, if requested
+if args['sample_size'] is not None and len(texts) > args['sample_size']:
+    texts = texts.sample(n=args['sample_size'], random_state=42)
+
+# Preprocess the texts and split them into sentences once for all models
+load_sentence_tokenizer(args['sentence_params'])
+sentences, _ = prepare_captions(texts, args['preprocessing'])
+
+# Set up lists for the measurements and predictions of each model
+results, predictions = [], []
+
+# Loop over the models
+for model in args['models']:
+
+    # Inform the user
+    print('[INFO] Evaluating {} on {} sentences ...'.format(
+        model, len(sentences)), file=sys.stderr)
+
+    # Load the model and classify the sentences in a separate process, which
+    # is forked so that it inherits the sentences
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        result, languages = pool.apply(evaluate_model, (model,))
+
+    # Store the measurements and predictions
+    results.append(result)
+    predictions.append(languages)
+
+# Compare the predictions of the other models against the first model
+for result, languages in zip(results[1:], predictions[1:]):
+    result.update(compare(predictions[0], languages))
+
+    # Inform the user
+    print('[INFO] {} agrees with {} on {:.1%} of sentences'.format(
+        result['path'], results[0]['path'], result['agreement']),
+        file=sys.stderr)
+
+# Collect the results and metadata
+output = {'input': args['input'],
+          'captions': len(texts),
+          'sentences': len(sentences),
+          'preprocessing': args['preprocessing'],
+          'batch_size': args['batch_size'],
+          'models': results}
+
+# Write the results to the output file or print them
+if args['output'] is not None:
+    with open(args['output'], 'w') as f:
+        json.dump(output, f, indent=2)
+else:
+    print(json.dumps(output, indent=2))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import read_table
+import argparse
+
+"""
+This script converts the output of run_fasttext.py, run_langid.py or
+run_both.py streamed in chunks using the argument -cz/--chunksize into a
+pickled pandas DataFrame, which can be read by the scripts in ../plots,
+../stats and ../topics.
+
+The streamed output stores the predictions as strings in CSV files, as lists
+of lists in JSON lines and as lists of structs in Parquet files. This script
+converts them back into lists of (language, probability, character length)
+tuples, as found in the pickled output of the scripts.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 convert_output.py -i output.parquet -o output.pkl
+
+    To convert the output of run_both.py, which contains predictions from
+    both models and flags for their agreement, run:
+
+    python3 convert_output.py -i output.parquet -o output.pkl \
+        -pc langid_ft langid_li -fc langid_agree
+
+Returns:
+    A pickled pandas DataFrame.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the output streamed in Parquet (.parquet), JSON "
+                     "lines (.jsonl) or CSV (.csv) format.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=True,
+                help="Path to the pickled pandas DataFrame.")
+
+# Define the columns holding predictions
+ap.add_argument("-pc", "--prediction_columns", required=False, nargs='+',
+                default=['langid'],
+                help="The names of the columns holding predictions. Defaults "
+                     "to 'langid'.")
+
+# Define the columns holding flags
+ap.add_argument("-fc", "--flag_columns", required=False, nargs='+',
+                default=[],
+                help="The names of the columns holding a flag for each "
+                     "sentence, e.g. 'langid_agree' or 'langid_rescored' "
+                     "written by run_both.py.")
+
+# Define the number of rows read at a time
+ap.add_argument("-cz", "--chunksize", required=False, type=int,
+                default=100000,
+                help="Number of rows read at a time. Defaults to 100000.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Read the streamed output and convert the predictions
+output_df = read_table(args['input'], args['prediction_columns'],
+                       args['flag_columns'], args['chunksize'])
+
+# Save DataFrame to disk
+output_df.to_pickle(args['output'])
+
+# Print status
+print('[INFO] Converted {} rows'.format(len(output_df)))
+print('[INFO] ... Done!')
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains functions for splitting the words concatenated in hashtags,
+e.g. '#helsinkibynight' into '#helsinki by night', using dynamic programming
+over the frequencies of words counted in a sample of captions. Segmentation is
+set up for the 'rm_trail' preprocessing strategy by loading the frequencies
+using load_word_frequencies().
+"""
+
+from collections import Counter
+from functools import lru_cache
+import math
+import pickle
+import re
+
+# The costs of words used for segmenting hashtags are set when word
+# frequencies are loaded, see load_word_frequencies(). Until then, hashtags
+# are not segmented.
+word_costs = None
+unknown_cost = None
+
+# Compile the regular expression for runs of letters once
+LETTERS = re.compile(r'[^\W\d_]+')
+
+# Define the maximum length of words and of runs of letters in hashtags
+# considered when segmenting hashtags, and the number of segmented hashtags
+# kept in memory, see segment_hashtag()
+MAX_WORD_LENGTH = 20
+MAX_HASHTAG_LENGTH = 100
+HASHTAG_CACHE_SIZE = 2 ** 17
+
+
+def count_words(texts):
+    """Counts the words in texts, e.g. captions from which emoji, mentions,
+    hashtags and URLs have been removed using the 'rm_all' preprocessing
+    strategy.
+
+    Args:
+        texts: An iterable of strings containing UTF-8 encoded text.
+
+    Returns:
+        A Counter mapping each lowercased word to its number of occurrences.
+    """
+    # Set up a counter for the words
+    counts = Counter()
+
+    # Loop over the texts, counting the runs of letters
+    for text in texts:
+        counts.update(LETTERS.findall(text.lower()))
+
+    # Return the counts
+    return counts
+
+
+def train_word_frequencies(texts, output, min_count=2):
+    """Counts the frequencies of words in a sample of texts and saves them to
+    disk for segmenting hashtags, see count_words() and segment_hashtag().
+
+    Args:
+        texts: An iterable of strings containing UTF-8 encoded text.
+        output: Path to the file to which the frequencies are saved.
+        min_count: The minimum number of occurrences of a word. Rarer words
+                   are dropped, as they are often typos or concatenated words.
+
+    Returns:
+        A dictionary mapping each word to its number of occurrences.
+    """
+    # Count the words and drop rare words
+    frequencies = {word: count for word, count in count_words(texts).items()
+                   if count >= min_count}
+
+    # Save the frequencies to disk
+    with open(output, 'wb') as f:
+        pickle.dump(frequencies, f)
+
+    # Return the frequencies
+    return frequencies
+
+
+def load_word_frequencies(path):
+    """Sets up hashtag segmentation in the current process using word
+    frequencies saved by train_word_frequencies().
+
+    Once the frequencies have been loaded, the 'rm_trail' preprocessing
+    strategy splits the remaining hashtags into words, e.g. '#helsinkibynight'
+    becomes 'helsinki by night', and keeps captions that consist only of
+    hashtags instead of removing all of them.
+
+    Args:
+        path: Path to the file containing the word frequencies.
+
+    Returns:
+        A dictionary mapping each word to its number of occurrences.
+    """
+    global word_costs, unknown_cost
+
+    # Load the frequencies
+    with open(path, 'rb') as f:
+        frequencies = pickle.load(f)
+
+    # Convert the frequencies into costs, i.e. the negative logarithm of the
+    # probability of each word. Unknown words are assigned a probability that
+    # decreases with their length.
+    total = sum(frequencies.values())
+    word_costs = {word: math.log(total / count)
+                  for word, count in frequencies.items()}
+    unknown_cost = (math.log(total / 10), math.log(10))
+
+    # Clear the cache of segmented hashtags, which depend on the frequencies
+    segment_hashtag.cache_clear()
+
+    # Return the frequencies
+    return frequencies
+
+
+def segment_word(word):
+    """Splits a run of letters into the most probable sequence of words using
+    dynamic programming over unigram frequencies.
+
+    Args:
+        word: A string consisting of letters.
+
+    Returns:
+        A string containing the words separated by spaces, or the original
+        string if the sequence contains no known words.
+    """
+    # Lowercase the string for looking up the words, keeping the original
+    # case in the output
+    lowered = word.lower()
+    n = len(lowered)
+
+    # Leave strings that cannot be split, or whose length changes when
+    # lowercased, unchanged
+    if n < 2 or n > MAX_HASHTAG_LENGTH or len(word) != n:
+        return word
+
+    # Set up lists for the lowest cost of the prefixes of the string and the
+    # start of the last word in the best segmentation of each prefix
+    costs, starts = [0.0] + [math.inf] * n, [0] * (n + 1)
+
+    # Loop over the ends of the prefixes and find the best last word
+    for end in range(1, n + 1):
+        for start in range(max(0, end - MAX_WORD_LENGTH), end):
+            cost = costs[start] + word_costs.get(
+                lowered[start:end],
+                unknown_cost[0] + unknown_cost[1] * (end - start))
+            if cost < costs[end]:
+                costs[end], starts[end] = cost, start
+
+    # Follow the starts of the words backwards from the end of the string
+    words, end = [], n
+    while end > 0:
+        words.append(word[starts[end]:end])
+        end = starts[end]
+    words.reverse()
+
+    # Return the words, unless none of them is known
+    if not any(w.lower() in word_costs for w in words):
+        return word
+    return ' '.join(words)
+
+
+@lru_cache(maxsize=HASHTAG_CACHE_SIZE)
+def segment_hashtag(token):
+    """Splits the words concatenated in a hashtag, e.g. '#helsinkibynight'
+    becomes '#helsinki by night'.
+
+    The results are memoized, as the same hashtags occur in many captions. The
+    cache is bounded and the least recently used hashtags are evicted first.
+
+    Args:
+        token: A string containing a hashtag.
+
+    Returns:
+        A string containing the hashtag with its words separated by spaces.
+    """
+    return LETTERS.sub(lambda m: segment_word(m.group()), token)
+
+
+def segmentation_loaded():
+    """Checks whether hashtags are segmented in the current process.
+
+    Returns:
+        True if word frequencies have been loaded using
+        load_word_frequencies(), otherwise False.
+    """
+    return word_costs is not None
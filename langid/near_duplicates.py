@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains functions for grouping near-duplicate texts, e.g. templated
+captions posted by spam accounts, into clusters using MinHash signatures over
+character shingles and locality-sensitive hashing, so that only one text in
+each cluster needs to be classified.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Define the largest 32-bit value for hashing shingles into MinHash
+# signatures
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(texts, size=5):
+    """Hashes the overlapping character shingles of texts.
+
+    The texts are lowercased and their whitespace is normalized before
+    hashing. Texts shorter than the shingle size are padded, so that each text
+    has at least one shingle.
+
+    Args:
+        texts: A list of strings.
+        size: The number of characters in a shingle.
+
+    Returns:
+        A tuple consisting of a NumPy array with a 32-bit hash for each
+        shingle of all texts and a NumPy array with the number of shingles in
+        each text.
+    """
+    # Normalize the texts and pad short texts
+    texts = [' '.join(t.lower().split()).ljust(size, '\x00') for t in texts]
+
+    # Convert all texts into a single array of code points
+    code_points = np.frombuffer(''.join(texts).encode('utf-32-le'),
+                                dtype='<u4').astype(np.uint64)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+
+    # Get the position of the first character of each shingle, excluding
+    # shingles that would span two texts
+    counts = lengths - size + 1
+    starts = np.repeat(np.cumsum(lengths) - lengths, counts) + \
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Calculate a polynomial rolling hash over the characters of each shingle,
+    # letting the 64-bit integers wrap around
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for i in range(size):
+        hashes = hashes * np.uint64(1000003) + code_points[starts + i]
+
+    # Fold the hashes into 32 bits and return them with the number of
+    # shingles in each text
+    return (hashes ^ (hashes >> np.uint64(32))) & MAX_HASH, counts
+
+
+def minhash_signatures(texts, num_perm=64, shingle_size=5, seed=1):
+    """Calculates MinHash signatures over the character shingles of texts.
+
+    The share of positions at which the signatures of two texts agree
+    estimates the Jaccard similarity of their sets of shingles.
+
+    Args:
+        texts: A list of strings.
+        num_perm: The number of random permutations, i.e. the length of the
+                  signatures.
+        shingle_size: The number of characters in a shingle.
+        seed: The seed for drawing the random permutations.
+
+    Returns:
+        A NumPy array of shape (len(texts), num_perm).
+    """
+    # Hash the shingles of all texts at once
+    hashes, counts = shingle_hashes(texts, shingle_size)
+    offsets = np.cumsum(counts) - counts
+
+    # Draw the parameters of the random permutations, which use the
+    # multiply-add-shift scheme: the upper 32 bits of a * x + b, where a is
+    # odd, and the arithmetic wraps around at 64 bits
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64) | \
+        np.uint64(1)
+    b = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    # Permute the hashes and take the minimum within each text
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for i in range(num_perm):
+        permuted = (a[i] * hashes + b[i]) >> np.uint64(32)
+        signatures[:, i] = np.minimum.reduceat(permuted, offsets)
+
+    # Return the signatures
+    return signatures
+
+
+def near_duplicate_clusters(captions, threshold=0.8, num_perm=64, bands=16,
+                            shingle_size=5):
+    """Groups near-duplicate captions, e.g. templated captions posted by spam
+    accounts, into clusters.
+
+    Exact duplicates are grouped first. Candidate pairs of the remaining
+    captions are found in roughly linear time by splitting the MinHash
+    signatures into bands and hashing each band: captions whose band hashes
+    match in at least one band become candidates. Candidates are added to a
+    cluster if their estimated Jaccard similarity to the first caption in the
+    bucket is at least the threshold.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        threshold: The minimum estimated Jaccard similarity of the character
+                   shingles of near-duplicates. The value must be in range
+                   [0..1], e.g. 0.8.
+        num_perm: The length of the MinHash signatures.
+        bands: The number of bands, which must divide num_perm. More bands
+               find more candidates with a lower similarity.
+        shingle_size: The number of characters in a shingle.
+
+    Returns:
+        A NumPy array giving for each caption the position of the
+        representative of its cluster, which is the first caption in the
+        cluster. Captions without text form clusters of their own.
+    """
+    # Set up a forest of clusters, in which each caption points towards the
+    # representative of its cluster
+    captions = list(captions)
+    parent = np.arange(len(captions))
+
+    # Group exact duplicates first, so that only the first occurrence of each
+    # caption with text is hashed
+    first = {}
+    for i, caption in enumerate(captions):
+        if isinstance(caption, str) and caption != 'None':
+            parent[i] = first.setdefault(caption, i)
+    valid = np.fromiter(first.values(), dtype=np.int64, count=len(first))
+
+    # Calculate the signatures of the unique captions
+    signatures = minhash_signatures([captions[i] for i in valid], num_perm,
+                                    shingle_size)
+
+    def find(i):
+        # Follow the pointers to the representative, compressing the path
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    # Loop over the bands
+    rows = num_perm // bands
+    for band in range(bands):
+
+        # Combine the values of the signatures in the band into a single hash
+        keys = np.zeros(len(valid), dtype=np.uint64)
+        for value in signatures[:, band * rows:(band + 1) * rows].T:
+            keys = keys * np.uint64(0x100000001b3) ^ value
+
+        # Sort the captions by their hash, keeping the original order within
+        # each bucket, and get the first caption in each bucket
+        order = np.argsort(keys, kind='stable')
+        first = np.flatnonzero(np.r_[True, keys[order][1:] !=
+                                     keys[order][:-1]])
+        leaders = order[np.repeat(first, np.diff(np.r_[first, len(order)]))]
+
+        # Estimate the similarity of each caption to the first caption in its
+        # bucket and merge the clusters of near-duplicates
+        candidates = np.flatnonzero(leaders != order)
+        similar = (signatures[order[candidates]] ==
+                   signatures[leaders[candidates]]).mean(axis=1) >= threshold
+        for i, j in zip(valid[order[candidates[similar]]],
+                        valid[leaders[candidates[similar]]]):
+            i, j = find(i), find(j)
+            if i != j:
+                parent[max(i, j)] = min(i, j)
+
+    # Return the representative of each caption
+    return np.array([find(i) for i in range(len(captions))], dtype=np.int64)
+
+
+def classify_representatives(texts, classify, clusters):
+    """Classifies only the representative of each cluster of near-duplicate
+    texts and copies its predictions to the other members of the cluster.
+
+    Args:
+        texts: A pandas Series containing the texts to process.
+        classify: A function that takes a pandas Series of texts and returns a
+                  dictionary mapping the names of output columns to pandas
+                  Series with a prediction for each text.
+        clusters: A NumPy array returned by near_duplicate_clusters(), which
+                  gives the position of the representative of each text.
+
+    Returns:
+        A dictionary mapping the names of output columns to pandas Series with
+        a prediction for each text.
+    """
+    # Classify the representatives
+    representative = clusters == np.arange(len(texts))
+    predictions = classify(texts[representative])
+
+    # Get the position of the representative of each text among the
+    # representatives
+    rank = np.cumsum(representative) - 1
+
+    # Return the predictions of the representatives for all texts
+    return {col: pd.Series(preds.values[rank[clusters]], index=texts.index)
+            for col, preds in predictions.items()}
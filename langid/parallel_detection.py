@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains functions for identifying the language of texts using a
+pool of worker processes, and for measuring the memory used by the workers.
+The processes are forked, so that they inherit the models loaded by the
+calling process.
+"""
+
+from supporting_functions import detect_ft_batch, detect_li_batch, \
+    get_ft_model, get_li_arrays, get_li_model, predict_li_vectorized, \
+    splitter_calls
+from functools import partial
+import multiprocessing
+import os
+
+# Prediction cache used by worker processes, see init_li_worker() and
+# init_ft_worker()
+worker_cache = None
+
+# Memory use of the fastText worker processes, see detect_ft_parallel()
+worker_memory = {}
+
+
+def memory_usage():
+    """Measures the memory used by the current process.
+
+    The proportional set size (PSS) divides the memory shared between
+    processes, such as a model inherited from the parent process, evenly
+    between the processes sharing it. Summing the PSS over processes thus
+    gives their actual memory use, unlike summing the resident set size (RSS).
+
+    Returns:
+        A dictionary with the RSS, PSS, shared and private memory of the
+        process in megabytes, or None if the values are not available. The
+        values are read from /proc and thus only available on Linux.
+    """
+    # Set up a dictionary for the values
+    usage = {}
+
+    # Attempt to read the summary of memory mappings
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                field, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    usage[field] = int(value.split()[0]) / 1024
+
+    # Return None if the file is not available
+    except OSError:
+        return None
+
+    # Return the values of interest
+    return {'rss': usage['Rss'], 'pss': usage['Pss'],
+            'shared': usage['Shared_Clean'] + usage['Shared_Dirty'],
+            'private': usage['Private_Clean'] + usage['Private_Dirty']}
+
+
+def memory_report():
+    """Summarizes the memory use of the main process and the fastText worker
+    processes started by detect_ft_parallel().
+
+    Returns:
+        A string with the total RSS and PSS of all processes and the memory
+        shared by the workers, or None if the values are not available.
+    """
+    # Measure the memory use of the main process
+    usage = memory_usage()
+    if usage is None:
+        return None
+
+    # Add the memory use of the workers, as measured after their last chunk
+    workers = list(worker_memory.values())
+    rss = usage['rss'] + sum(w['rss'] for w in workers)
+    pss = usage['pss'] + sum(w['pss'] for w in workers)
+    shared = sum(w['shared'] for w in workers) / max(len(workers), 1)
+
+    # Return summary
+    return ('main process and {} workers: total RSS {:.0f} MB, total PSS '
+            '{:.0f} MB, {:.0f} MB shared per worker'
+            .format(len(workers), rss, pss, shared))
+
+
+def init_ft_worker(cache=None):
+    """Sets up a worker process for fastText.
+
+    The model is not loaded here, as the worker inherits the model loaded by
+    the parent process in detect_ft_parallel(). The memory pages of the model
+    are shared with the parent until either process writes to them.
+
+    Args:
+        cache: An optional PredictionCache, which the worker connects to.
+    """
+    global worker_cache
+
+    # Open a connection to the cache for this process
+    if cache is not None:
+        cache.connect()
+
+    # Store the cache for use in detect_ft_chunk()
+    worker_cache = cache
+
+
+def detect_ft_chunk(chunk):
+    """Identifies the language of a chunk of texts in a worker process.
+
+    Args:
+        chunk: A tuple consisting of a list of captions, the preprocessing
+               strategy and a dictionary of keyword arguments, which are
+               passed to detect_ft_batch().
+
+    Returns:
+        A tuple consisting of a list with a prediction for each caption in the
+        chunk, the number of cache hits and misses in the chunk, the process
+        identifier of the worker, its memory use returned by memory_usage()
+        and the calls to the sentence tokenizer in the chunk.
+    """
+    # Reset the cache and sentence tokenizer counters, as they are reported
+    # for each chunk
+    if worker_cache is not None:
+        worker_cache.hits, worker_cache.misses = 0, 0
+    splitter_calls.clear()
+
+    # Classify the captions
+    captions, preprocessing, options = chunk
+    predictions = detect_ft_batch(captions, preprocessing, cache=worker_cache,
+                                  **options)
+
+    # Get the cache counters
+    if worker_cache is not None:
+        hits, misses = worker_cache.hits, worker_cache.misses
+    else:
+        hits, misses = 0, 0
+
+    # Return the predictions, cache counters, memory use and sentence
+    # tokenizer counters
+    return predictions, hits, misses, os.getpid(), memory_usage(), \
+        dict(splitter_calls)
+
+
+def detect_ft_parallel(captions, preprocessing, workers, chunksize=None,
+                       cache=None, **options):
+    """Identifies the language of multiple texts using a pool of processes
+    running fastText.
+
+    The model is loaded once in the calling process before the workers are
+    forked, so that all workers share the memory taken up by the model. The
+    memory use of the workers can be printed using memory_report().
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        workers: An integer defining the number of worker processes.
+        chunksize: An integer defining the number of captions sent to a worker
+                   at once. If None, the captions are split into four chunks
+                   per worker.
+        cache: An optional PredictionCache returned by open_cache(). Each
+               worker opens its own connection to the cache.
+        **options: Keyword arguments passed to detect_ft_batch(), e.g.
+                   batch_size, script_threshold, min_chars and
+                   caption_level.
+
+    Returns:
+        A list with a prediction for each caption in the format returned by
+        detect_ft(), in the same order as the input.
+    """
+    # Load the model before forking the workers
+    get_ft_model()
+
+    # Convert the captions into a list for slicing
+    captions = list(captions)
+
+    # Determine the chunk size
+    if chunksize is None:
+        chunksize = max(1, -(-len(captions) // (workers * 4)))
+
+    # Split the captions into chunks
+    chunks = [(captions[i:i + chunksize], preprocessing, options)
+              for i in range(0, len(captions), chunksize)]
+
+    # Classify the chunks in a pool of worker processes. The processes are
+    # forked, so that they inherit the model loaded above.
+    # Pool.map() returns the results in the same order as the input.
+    with multiprocessing.get_context('fork').Pool(
+            workers, initializer=init_ft_worker, initargs=(cache,)) as pool:
+        results = pool.map(detect_ft_chunk, chunks)
+
+    # Add the cache hits and misses in the workers to the counters
+    if cache is not None:
+        cache.hits += sum(r[1] for r in results)
+        cache.misses += sum(r[2] for r in results)
+        cache.count()
+
+    # Store the memory use of each worker after its last chunk
+    worker_memory.clear()
+    worker_memory.update((r[3], r[4]) for r in results if r[4] is not None)
+
+    # Add the calls to the sentence tokenizer in the workers to the counters
+    for r in results:
+        splitter_calls.update(r[5])
+
+    # Flatten the results for each chunk into a single list
+    return [prediction for result in results for prediction in result[0]]
+
+
+def init_li_worker(cache=None):
+    """Loads the langid.py model in a worker process.
+
+    Args:
+        cache: An optional PredictionCache, which the worker connects to.
+    """
+    global worker_cache
+
+    # Load the model once for each worker process, unless the process has
+    # inherited a loaded model
+    get_li_model()
+
+    # Open a connection to the cache for this process
+    if cache is not None:
+        cache.connect()
+
+    # Store the cache for use in detect_li_chunk()
+    worker_cache = cache
+
+
+def detect_li_chunk(chunk):
+    """Identifies the language of a chunk of texts in a worker process.
+
+    Args:
+        chunk: A tuple consisting of a list of captions, the preprocessing
+               strategy and a dictionary of keyword arguments, which are
+               passed to detect_li_batch().
+
+    Returns:
+        A tuple consisting of a list with a prediction for each caption in the
+        chunk, the number of cache hits and misses in the chunk and the calls
+        to the sentence tokenizer in the chunk.
+    """
+    # Reset the cache and sentence tokenizer counters, as they are reported
+    # for each chunk
+    if worker_cache is not None:
+        worker_cache.hits, worker_cache.misses = 0, 0
+    splitter_calls.clear()
+
+    # Classify the captions
+    captions, preprocessing, options = chunk
+    predictions = detect_li_batch(captions, preprocessing, cache=worker_cache,
+                                  **options)
+
+    # Return the predictions, cache counters and sentence tokenizer counters
+    if worker_cache is not None:
+        return predictions, worker_cache.hits, worker_cache.misses, \
+            dict(splitter_calls)
+
+    return predictions, 0, 0, dict(splitter_calls)
+
+
+def detect_li_parallel(captions, preprocessing, workers, chunksize=None,
+                       cache=None, **options):
+    """Identifies the language of multiple texts using a pool of processes
+    running langid.py.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        workers: An integer defining the number of worker processes.
+        chunksize: An integer defining the number of captions sent to a worker
+                   at once. If None, the captions are split into four chunks
+                   per worker.
+        cache: An optional PredictionCache returned by open_cache(). Each
+               worker opens its own connection to the cache.
+        **options: Keyword arguments passed to detect_li_batch(), e.g.
+                   script_threshold, min_chars, batch_size and
+                   caption_level.
+
+    Returns:
+        A list with a prediction for each caption in the format returned by
+        detect_li(), in the same order as the input.
+    """
+    # Convert the captions into a list for slicing
+    captions = list(captions)
+
+    # Determine the chunk size
+    if chunksize is None:
+        chunksize = max(1, -(-len(captions) // (workers * 4)))
+
+    # Split the captions into chunks
+    chunks = [(captions[i:i + chunksize], preprocessing, options)
+              for i in range(0, len(captions), chunksize)]
+
+    # Classify the chunks in a pool of worker processes. The processes are
+    # forked, so that the worker processes do not re-run the calling script.
+    # Pool.map() returns the results in the same order as the input.
+    with multiprocessing.get_context('fork').Pool(
+            workers, initializer=init_li_worker, initargs=(cache,)) as pool:
+        results = pool.map(detect_li_chunk, chunks)
+
+    # Add the cache hits and misses in the workers to the counters
+    if cache is not None:
+        cache.hits += sum(r[1] for r in results)
+        cache.misses += sum(r[2] for r in results)
+        cache.count()
+
+    # Add the calls to the sentence tokenizer in the workers to the counters
+    for r in results:
+        splitter_calls.update(r[3])
+
+    # Flatten the results for each chunk into a single list
+    return [prediction for result in results for prediction in result[0]]
+
+
+def predict_li_parallel(sentences, workers, batch_size=1000, chunksize=None):
+    """Predicts the language of sentences using a pool of processes running
+    the vectorized langid.py engine, see predict_li_vectorized().
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        workers: An integer defining the number of worker processes. If 1 or
+                 less, the sentences are classified in the current process.
+        batch_size: An integer defining the number of sentences scored at
+                    once using matrix operations.
+        chunksize: An integer defining the number of sentences sent to a
+                   worker at once. If None, the sentences are split into four
+                   chunks per worker.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities.
+    """
+    # Avoid loading the model if there is nothing to classify
+    if len(sentences) == 0:
+        return [], []
+
+    # Set up the function for scoring the sentences in batches
+    predict = partial(predict_li_vectorized, batch_size=batch_size)
+
+    # Classify the sentences in the current process if there is nothing to
+    # spread over several processes
+    if workers is None or workers <= 1 or len(sentences) == 1:
+        return predict(sentences)
+
+    # Determine the chunk size
+    if chunksize is None:
+        chunksize = max(1, -(-len(sentences) // (workers * 4)))
+
+    # Convert the model into arrays before forking, so that the worker
+    # processes inherit them instead of converting the model again
+    get_li_arrays()
+
+    # Classify the chunks in a pool of worker processes. Pool.map() returns
+    # the results in the same order as the input.
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        results = pool.map(predict, [sentences[i:i + chunksize]
+                                     for i in range(0, len(sentences),
+                                                    chunksize)])
+
+    # Flatten the results for each chunk into two lists
+    return ([lang for r in results for lang in r[0]],
+            [prob for r in results for prob in r[1]])
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains a compact, columnar representation for the sentence-level
+predictions made by the language identification scripts.
+
+By default, the predictions for each text are stored in a list of tuples
+consisting of an ISO-639 code, its probability and the length of the sentence
+in characters. For large datasets, these Python objects take up hundreds of
+bytes per sentence and must be unpacked one by one. PredictionArrays stores the
+same information in flat NumPy arrays instead:
+
+    offsets:       int64, the predictions for row i are found between
+                   offsets[i] and offsets[i + 1]
+    codes:         int16, the language of each sentence as a code pointing to
+                   the array of categories
+    categories:    str, the ISO-639 codes of the languages
+    probabilities: float32, the probability of each prediction
+    char_lens:     int16, the length of each sentence in characters
+    missing:       bool, marks rows without a text, for which the list format
+                   contains None instead of a list
+
+Note that the probabilities are stored at single precision, which means that
+converting the predictions back into lists does not restore the exact values
+of the original probabilities.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class PredictionArrays(object):
+    """Sentence-level predictions for a sequence of rows stored in flat arrays.
+
+    Slicing the object with a contiguous range of rows, e.g. arrays[100:200],
+    returns a new PredictionArrays that shares the memory of the original one.
+
+    Args:
+        offsets: An integer array of length n + 1 for n rows.
+        codes: An integer array with a language code for each sentence.
+        categories: An array of ISO-639 codes referred to by the codes.
+        probabilities: A float array with a probability for each sentence.
+        char_lens: An integer array with a length for each sentence.
+        missing: A boolean array marking rows without a text.
+    """
+
+    # Define the names of the arrays stored for each column
+    fields = ['offsets', 'codes', 'categories', 'probabilities', 'char_lens',
+              'missing']
+
+    def __init__(self, offsets, codes, categories, probabilities, char_lens,
+                 missing):
+
+        # Assign arguments to attributes
+        self.offsets = offsets
+        self.codes = codes
+        self.categories = categories
+        self.probabilities = probabilities
+        self.char_lens = char_lens
+        self.missing = missing
+
+    @classmethod
+    def from_lists(cls, predictions):
+        """Converts predictions from the list format into arrays.
+
+        Args:
+            predictions: An iterable with a prediction for each row in the
+                         format returned by detect_ft() or detect_li().
+
+        Returns:
+            A PredictionArrays object.
+        """
+        # Set up lists for the number of sentences in each row, missing rows
+        # and the contents of the predictions
+        counts, missing = [], []
+        languages, probabilities, char_lens = [], [], []
+
+        # Loop over the rows and collect the contents of their predictions
+        for p in predictions:
+            missing.append(p is None)
+            counts.append(len(p) if p else 0)
+
+            for lang, prob, char_len in p or ():
+                languages.append(lang)
+                probabilities.append(prob)
+                char_lens.append(char_len)
+
+        # Calculate the offsets of each row
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # Map the languages to codes
+        categories, codes = np.unique(np.array(languages, dtype=str),
+                                      return_inverse=True)
+
+        # Check that the sentence lengths fit in the array
+        char_lens = np.array(char_lens, dtype=np.int64)
+        if len(char_lens) and char_lens.max() > np.iinfo(np.int16).max:
+            raise ValueError('Sentences longer than {} characters cannot be '
+                             'stored'.format(np.iinfo(np.int16).max))
+
+        # Return the arrays
+        return cls(offsets, codes.astype(np.int16), categories,
+                   np.array(probabilities, dtype=np.float32),
+                   char_lens.astype(np.int16), np.array(missing, dtype=bool))
+
+    def to_lists(self):
+        """Converts the predictions back into the list format.
+
+        Returns:
+            A list with a prediction for each row in the format returned by
+            detect_ft() or detect_li().
+        """
+        # Convert the contents of the predictions into Python objects
+        languages = self.categories[self.codes].tolist()
+        probabilities = self.probabilities.tolist()
+        char_lens = self.char_lens.tolist()
+
+        # Set up a list for the predictions
+        predictions = []
+
+        # Loop over the rows and collect their predictions
+        for start, stop, missing in zip(self.offsets[:-1].tolist(),
+                                        self.offsets[1:].tolist(),
+                                        self.missing.tolist()):
+            if missing:
+                predictions.append(None)
+            else:
+                predictions.append(list(zip(languages[start:stop],
+                                            probabilities[start:stop],
+                                            char_lens[start:stop])))
+
+        # Return the predictions
+        return predictions
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """Joins predictions for consecutive sets of rows, e.g. chunks.
+
+        Args:
+            arrays: A list of PredictionArrays objects.
+
+        Returns:
+            A PredictionArrays object with the rows of all objects.
+        """
+        # Combine the categories of all objects
+        categories = np.unique(np.concatenate([a.categories for a in arrays]))
+
+        # Shift the offsets of each object to follow the previous ones
+        offsets, end = [np.zeros(1, dtype=np.int64)], 0
+        for a in arrays:
+            offsets.append(a.offsets[1:] - a.offsets[0] + end)
+            end += a.offsets[-1] - a.offsets[0]
+
+        # Return the combined arrays, mapping the codes to the new categories
+        return cls(np.concatenate(offsets),
+                   np.concatenate([np.searchsorted(categories, a.categories)
+                                   [a.codes[a.offsets[0]:a.offsets[-1]]]
+                                   for a in arrays]).astype(np.int16),
+                   categories,
+                   np.concatenate([a.probabilities[a.offsets[0]:a.offsets[-1]]
+                                   for a in arrays]),
+                   np.concatenate([a.char_lens[a.offsets[0]:a.offsets[-1]]
+                                   for a in arrays]),
+                   np.concatenate([a.missing for a in arrays]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        """Returns the predictions for a single row in the list format, or
+        the predictions for a range of rows as a PredictionArrays object.
+
+        Ranges of rows share the memory of the original object, apart from
+        ranges with a step, which are copied using take().
+        """
+        # Return a single row in the list format
+        if not isinstance(key, slice):
+            return self.take([range(len(self))[key]]).to_lists()[0]
+
+        # Copy rows selected using a step
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            return self.take(np.arange(start, stop, step))
+
+        # Return a view to the range of rows; the arrays for the sentences
+        # are shared, as the offsets still point to the right positions
+        stop = max(start, stop)
+        return PredictionArrays(self.offsets[start:stop + 1], self.codes,
+                                self.categories, self.probabilities,
+                                self.char_lens, self.missing[start:stop])
+
+    def counts(self):
+        """Returns an array with the number of sentences in each row."""
+        return np.diff(self.offsets)
+
+    def sentence_index(self, rows=None):
+        """Finds the positions of the sentences belonging to a set of rows.
+
+        Args:
+            rows: An optional array of row positions. Defaults to all rows.
+
+        Returns:
+            A tuple of two integer arrays, the first giving the row of each
+            sentence and the second giving the position of each sentence in
+            the arrays codes, probabilities and char_lens.
+        """
+        # Use all rows by default
+        if rows is None:
+            rows = np.arange(len(self))
+
+        # Get the first sentence and the number of sentences for each row
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - starts
+
+        # Repeat the rows for each of their sentences and count up from the
+        # first sentence of each row
+        repeated = np.repeat(rows, counts)
+        position = (np.arange(counts.sum())
+                    + np.repeat(starts - (np.cumsum(counts) - counts),
+                                counts))
+
+        # Return the indices
+        return repeated, position
+
+    def take(self, rows):
+        """Selects a set of rows, copying their predictions.
+
+        Args:
+            rows: An array of row positions.
+
+        Returns:
+            A PredictionArrays object with the selected rows.
+        """
+        # Find the sentences of the rows
+        rows = np.asarray(rows, dtype=np.int64)
+        _, position = self.sentence_index(rows)
+
+        # Calculate the new offsets
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(self.offsets[rows + 1] - self.offsets[rows], out=offsets[1:])
+
+        # Return the selected rows
+        return PredictionArrays(offsets, self.codes[position], self.categories,
+                                self.probabilities[position],
+                                self.char_lens[position], self.missing[rows])
+
+    def to_frame(self):
+        """Returns the predictions as a pandas DataFrame with one row for each
+        sentence.
+
+        Returns:
+            A pandas DataFrame with the columns 'row' (position of the row the
+            sentence belongs to), 'language' (categorical), 'probability' and
+            'char_len'.
+        """
+        # Get the rows of the sentences
+        rows, position = self.sentence_index()
+
+        # Return the DataFrame
+        return pd.DataFrame({
+            'row': rows,
+            'language': pd.Categorical.from_codes(self.codes[position],
+                                                  self.categories),
+            'probability': self.probabilities[position],
+            'char_len': self.char_lens[position]})
+
+    def monolingual(self, language):
+        """Checks which rows contain sentences only in a given language.
+
+        Args:
+            language: An ISO-639 code.
+
+        Returns:
+            A boolean array, which is True for rows with at least one sentence,
+            all of which are predicted to be in the given language.
+        """
+        # Count the sentences in the language before the start of each row
+        matches = np.zeros(len(self.codes) + 1, dtype=np.int64)
+        code = np.searchsorted(self.categories, language)
+        if code < len(self.categories) and self.categories[code] == language:
+            np.cumsum(self.codes == code, out=matches[1:])
+
+        # Compare the number of matching sentences to all sentences in a row
+        found = matches[self.offsets[1:]] - matches[self.offsets[:-1]]
+        return (found > 0) & (found == self.counts())
+
+
+def save_arrays(path, columns, keys=None):
+    """Saves the predictions for one or more columns to a NumPy .npz file.
+
+    Args:
+        path: Path to the output file.
+        columns: A dictionary mapping column names to PredictionArrays objects,
+                 all of which describe the same rows.
+        keys: An optional array of identifiers for the rows, which can be used
+              for matching the rows with a DataFrame. The identifiers are
+              stored as strings, e.g. photo_id.astype(str).
+    """
+    # Collect the arrays of each column, compacting views to ranges of rows
+    contents = {}
+    for name, arrays in columns.items():
+        if arrays.offsets[0] != 0:
+            arrays = arrays.take(np.arange(len(arrays)))
+        for field in PredictionArrays.fields:
+            contents[name + '.' + field] = getattr(arrays, field)
+
+    # Add the identifiers of the rows as text, which avoids pickling objects
+    # and lets readers match them regardless of the dtype of the column
+    if keys is not None:
+        contents['keys'] = np.asarray(keys).astype(str)
+
+    # Save the arrays without compression, which keeps loading fast
+    np.savez(path, **contents)
+
+
+def load_arrays(path):
+    """Loads predictions saved using save_arrays().
+
+    Args:
+        path: Path to the .npz file.
+
+    Returns:
+        A tuple consisting of a dictionary that maps column names to
+        PredictionArrays objects and an array of identifiers for the rows, or
+        None if the identifiers were not saved.
+    """
+    # Load the file
+    with np.load(path) as contents:
+
+        # Get the names of the columns
+        names = sorted(set(k.rsplit('.', 1)[0] for k in contents.files
+                           if k != 'keys'))
+
+        # Collect the arrays for each column
+        columns = {name: PredictionArrays(
+            *[contents[name + '.' + field]
+              for field in PredictionArrays.fields]) for name in names}
+
+        # Get the identifiers of the rows
+        keys = contents['keys'] if 'keys' in contents.files else None
+
+    # Return the predictions and the identifiers
+    return columns, keys
+
+
+def load_prediction_arrays(path, column='langid'):
+    """Loads the predictions of a single column saved using save_arrays(),
+    e.g. for the scripts in ../plots, ../stats and ../topics.
+
+    Args:
+        path: Path to the .npz file containing the predictions.
+        column: The name of the column whose predictions are loaded.
+
+    Returns:
+        A tuple consisting of a PredictionArrays object and an array of
+        identifiers for the rows.
+    """
+    # Load the arrays for the requested column and the row identifiers
+    with np.load(path) as contents:
+        arrays = PredictionArrays(*[contents[column + '.' + field]
+                                    for field in PredictionArrays.fields])
+        keys = contents['keys']
+
+    # Return the predictions and the identifiers
+    return arrays, keys
+
+
+def match_rows(arrays, keys, identifiers):
+    """Selects the predictions for the rows of a DataFrame, e.g. using the
+    column 'photo_id'.
+
+    Args:
+        arrays: A PredictionArrays object.
+        keys: An array of identifiers for the rows of the arrays, as returned
+              by load_prediction_arrays().
+        identifiers: An iterable of identifiers to look up, which are
+                     compared to the keys as strings.
+
+    Returns:
+        A PredictionArrays object with a row for each identifier.
+
+    Raises:
+        KeyError: If predictions are not found for some identifiers.
+    """
+    # Find the position of each identifier among the rows of the arrays
+    rows = pd.Index(keys).get_indexer(np.asarray(identifiers).astype(str))
+
+    # Check that predictions were found for all identifiers
+    if (rows < 0).any():
+        raise KeyError("{} rows not found in the predictions"
+                       .format((rows < 0).sum()))
+
+    # Return the predictions of the matching rows
+    return arrays.take(rows)
+
+
+def extract_sentences(arrays, keys, input_df, key='photo_id', columns=()):
+    """Extracts the predictions for the rows of a DataFrame into a new
+    DataFrame with one row for each sentence.
+
+    Args:
+        arrays: A PredictionArrays object.
+        keys: An array of identifiers for the rows of the arrays, as returned
+              by load_prediction_arrays().
+        input_df: A pandas DataFrame.
+        key: The name of the column of input_df matched with the keys.
+        columns: The names of columns of input_df, whose values are repeated
+                 for each sentence of the row.
+
+    Returns:
+        A pandas DataFrame with the columns 'char_len', 'language' and
+        'probability', followed by the requested columns.
+    """
+    # Select the predictions for the rows and get their sentences
+    sentences = match_rows(arrays, keys, input_df[key]).to_frame()
+    rows = sentences['row'].values
+
+    # Return the predictions and the values of the requested columns
+    return pd.DataFrame(dict(
+        [('char_len', sentences['char_len'].values.astype(float)),
+         ('language', sentences['language'].values.astype(str)),
+         ('probability', sentences['probability'].values.astype(float))] +
+        [(col, input_df[col].values[rows]) for col in columns]))
+
+
+class ArrayWriter(object):
+    """Collects predictions from one or more DataFrames, e.g. the chunks of a
+    large input, and saves them to disk using save_arrays() once closed.
+
+    Args:
+        path: Path to the output .npz file.
+        key: The name of the column used for identifying the rows. If the
+             column is not found, the index of the DataFrame is used.
+    """
+
+    def __init__(self, path, key='photo_id'):
+
+        # Assign arguments to attributes
+        self.path = path
+        self.key = key
+
+        # Set up lists for the predictions of each column and row identifiers
+        self.columns = {}
+        self.keys = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, df, columns=('langid',)):
+        """Converts the predictions in a DataFrame into arrays.
+
+        Args:
+            df: A pandas DataFrame with predictions in the list format.
+            columns: The names of the columns containing predictions.
+        """
+        # Convert the predictions in each column
+        for col in columns:
+            self.columns.setdefault(col, []).append(
+                PredictionArrays.from_lists(df[col]))
+
+        # Store the identifiers of the rows
+        self.keys.append(np.asarray(df[self.key] if self.key in df.columns
+                                    else df.index))
+
+    def close(self):
+        """Joins the collected predictions and saves them to disk."""
+        save_arrays(self.path,
+                    {col: PredictionArrays.concatenate(arrays)
+                     for col, arrays in self.columns.items()},
+                    np.concatenate(self.keys) if self.keys else None)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains a persistent cache for sentence-level predictions made by
+language identification models. The cache is stored in an SQLite database and
+the predictions are keyed by the model backend, a hash of the model, the
+preprocessing strategy and the text of the sentence.
+"""
+
+import hashlib
+import sqlite3
+
+
+def hash_file(path):
+    """Calculates the SHA-1 hash of a file.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        A string containing the hexadecimal digest of the file contents.
+    """
+    # Initialize the hash
+    digest = hashlib.sha1()
+
+    # Read the file in blocks of 1 MB to avoid loading it into memory at once
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    # Return the digest
+    return digest.hexdigest()
+
+
+def hash_string(string):
+    """Calculates the SHA-1 hash of a string.
+
+    Args:
+        string: A string or bytes, e.g. a serialized model.
+
+    Returns:
+        A string containing the hexadecimal digest of the string.
+    """
+    # Encode strings into bytes before hashing
+    if isinstance(string, str):
+        string = string.encode('utf-8')
+
+    # Return the digest
+    return hashlib.sha1(string).hexdigest()
+
+
+class PredictionCache(object):
+    """A persistent, size-bounded cache for sentence-level predictions.
+
+    When the number of cached predictions exceeds the defined maximum, the
+    least recently used predictions are evicted. The cache keeps count of
+    hits and misses, which can be printed using report().
+
+    Args:
+        path: Path to the SQLite database. The database is created if it does
+              not exist.
+        backend: A string identifying the language identification model, e.g.
+                 'fasttext' or 'langid'.
+        model: A string identifying the version of the model, e.g. a hash of
+               the model file returned by hash_file().
+        preprocessing: A string indicating the preprocessing strategy applied
+                       to the sentences.
+        max_entries: The maximum number of predictions kept in the cache.
+    """
+
+    # Define the maximum number of variables in a single SQLite query
+    max_variables = 500
+
+    def __init__(self, path, backend, model, preprocessing,
+                 max_entries=10000000):
+
+        # Assign arguments to attributes
+        self.path = path
+        self.key = (backend, model, preprocessing)
+        self.max_entries = max_entries
+
+        # Set up counters for cache hits and misses
+        self.hits = 0
+        self.misses = 0
+
+        # Open the database
+        self.connect()
+
+    def connect(self):
+        """Opens the connection to the database and creates the table for
+        predictions if it does not exist.
+
+        Call this method again in processes forked from the one that created
+        the cache, as SQLite connections cannot be shared between processes.
+        """
+        # Open the connection; use write-ahead logging so that several
+        # processes can read the cache while another one is writing to it
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+
+        # Create the table for predictions and an index for finding the least
+        # recently used predictions
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'backend TEXT, model TEXT, preprocessing TEXT, sentence TEXT, '
+                'language TEXT, probability REAL, last_used INTEGER, '
+                'PRIMARY KEY (backend, model, preprocessing, sentence)) '
+                'WITHOUT ROWID')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS predictions_last_used '
+                'ON predictions (last_used)')
+
+        # Get the number of cached predictions and the current value of the
+        # clock used for tracking when each prediction was last used
+        self.size, clock = self.connection.execute(
+            'SELECT COUNT(*), MAX(last_used) FROM predictions').fetchone()
+        self.clock = clock or 0
+
+    def tick(self, n):
+        """Advances the clock used for tracking the use of predictions.
+
+        Args:
+            n: The number of ticks.
+
+        Returns:
+            A range of n consecutive time stamps.
+        """
+        start = self.clock + 1
+        self.clock += n
+        return range(start, start + n)
+
+    def lookup(self, sentences):
+        """Retrieves cached predictions for sentences.
+
+        Args:
+            sentences: A list of unique sentences.
+
+        Returns:
+            A dictionary mapping the sentences found in the cache to a tuple
+            consisting of an ISO-639 code and its probability.
+        """
+        # Set up a dictionary for the cached predictions
+        found = {}
+
+        # Query the database in chunks to stay below the limit for variables
+        for i in range(0, len(sentences), self.max_variables):
+            chunk = sentences[i:i + self.max_variables]
+            rows = self.connection.execute(
+                'SELECT sentence, language, probability FROM predictions '
+                'WHERE backend = ? AND model = ? AND preprocessing = ? '
+                'AND sentence IN ({})'.format(', '.join('?' * len(chunk))),
+                self.key + tuple(chunk))
+            found.update((s, (language, p)) for s, language, p in rows)
+
+        # Mark the predictions found in the cache as recently used
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE predictions SET last_used = ? WHERE backend = ? AND '
+                'model = ? AND preprocessing = ? AND sentence = ?',
+                ((t,) + self.key + (s,)
+                 for t, s in zip(self.tick(len(found)), found)))
+
+        # Update counters
+        self.hits += len(found)
+        self.misses += len(sentences) - len(found)
+
+        # Return the cached predictions
+        return found
+
+    def store(self, sentences, languages, probabilities):
+        """Adds predictions to the cache, evicting the least recently used
+        predictions if the cache grows too large.
+
+        Args:
+            sentences: A list of unique sentences not found in the cache.
+            languages: A list of ISO-639 codes, one for each sentence.
+            probabilities: A list of probabilities, one for each sentence.
+        """
+        # Insert the predictions into the database
+        with self.connection:
+            cursor = self.connection.executemany(
+                'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, '
+                '?)', (self.key + (s, language, float(p), t)
+                       for s, language, p, t in
+                       zip(sentences, languages, probabilities,
+                           self.tick(len(sentences)))))
+            self.size += cursor.rowcount
+
+        # Evict predictions if the cache is full
+        if self.size > self.max_entries:
+            self.evict(self.size - self.max_entries)
+
+    def evict(self, n):
+        """Removes the least recently used predictions from the cache.
+
+        Args:
+            n: The number of predictions to remove.
+        """
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM predictions WHERE last_used <= (SELECT last_used '
+                'FROM predictions ORDER BY last_used LIMIT 1 OFFSET ?)',
+                (n - 1,))
+
+        # Update the number of cached predictions
+        self.count()
+
+    def count(self):
+        """Updates the number of cached predictions from the database, e.g.
+        after other processes have added predictions to the cache.
+
+        Returns:
+            The number of cached predictions.
+        """
+        self.size = self.connection.execute(
+            'SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+        return self.size
+
+    def close(self):
+        """Closes the connection to the database."""
+        self.connection.close()
+
+    def report(self):
+        """Summarizes the use of the cache.
+
+        Returns:
+            A string with the number of hits and misses and the hit rate.
+        """
+        # Calculate hit rate
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+
+        # Return summary
+        return ('{} hits, {} misses, hit rate {:.1%}, {} cached predictions'
+                .format(self.hits, self.misses, rate, self.size))
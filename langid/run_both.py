@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import ChunkWriter, count_sentences, \
+    detect_cascade_batch, detect_dual_batch, load_sentence_tokenizer, \
+    open_cache, read_chunks, set_ft_model_path, set_sentence_splitter, \
+    splitter_report
+from near_duplicates import classify_representatives, near_duplicate_clusters
+from hashtag_segmentation import load_word_frequencies
+from prediction_arrays import ArrayWriter
+import argparse
+import numpy as np
+import pandas as pd
+import time
+
+"""
+This script runs both fastText and langid language identification models on
+texts stored in a pandas DataFrame, in order to cross-check their predictions.
+The texts are preprocessed and split into sentences only once, after which the
+same sentences are passed to both models.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 run_both.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000
+
+    To stream large inputs in chunks of 100000 rows, keeping memory use
+    bounded, run:
+
+    python3 run_both.py -i input.parquet -o output.parquet -p 'rm_all' \
+        -b 100000 -cz 100000
+
+    To run fastText on all sentences and re-score only the sentences with a
+    fastText probability below 0.4 using langid, spread over 8 processes, run:
+
+    python3 run_both.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -cc 0.4 -w 8
+
+Returns:
+    A pandas DataFrame with fastText predictions in a column named 'langid_ft',
+    langid predictions in a column named 'langid_li' and a column named
+    'langid_agree', which contains a list of booleans indicating whether the
+    models agree on the language of each sentence. Sentences assigned a
+    language based on their script (-st) or recorded as undetermined (-mc)
+    are marked None, as they are not classified by the models.
+    In cascade mode, the final predictions are stored in a column named
+    'langid', the fastText predictions in 'langid_ft' and a list of booleans
+    indicating whether each sentence was re-scored using langid in
+    'langid_rescored'. For re-scored sentences, 'langid' contains the
+    prediction of langid and 'langid_ft' that of fastText.
+    In streaming mode, the output is written in the format of the output file,
+    which may be Parquet, JSON lines or CSV.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=True,
+                help="Path to the output file.")
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=True,
+                help="Selected preprocessing strategy: valid values include "
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define batch size for fastText
+ap.add_argument("-b", "--batch_size", required=False, type=int,
+                help="Pass the sentences to fastText in batches of this size. "
+                     "If not defined, all sentences are passed at once.")
+
+# Define the path to the fastText model
+ap.add_argument("-fm", "--ft_model", required=False,
+                help="Path to the fastText model, e.g. models/lid.176.ftz for "
+                     "the compressed model, which takes up less memory. "
+                     "Defaults to models/lid.176.bin.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt sentence tokenizer parameters trained "
+                     "using train_punkt.py. If not set, the default "
+                     "parameters are used.")
+
+# Define the sentence splitter
+ap.add_argument("-ss", "--sentence_splitter", required=False,
+                choices=['punkt', 'regex'],
+                help="Sentence splitter: 'punkt' for NLTK's Punkt tokenizer "
+                     "or 'regex' for a splitter that breaks sentences at "
+                     "terminal punctuation, emoji and line breaks. The regex "
+                     "splitter is not always faster and splits captions at "
+                     "emoji, which Punkt does not; compare both on your data "
+                     "using sentence_splitter_report.py. Defaults to "
+                     "'punkt'.")
+
+# Define the path to word frequencies for segmenting hashtags
+ap.add_argument("-hs", "--hashtag_segmentation", required=False,
+                help="Path to word frequencies saved using "
+                     "train_word_frequencies.py. If set, the 'rm_trail' "
+                     "preprocessing strategy splits the remaining hashtags "
+                     "into words and keeps captions consisting only of "
+                     "hashtags.")
+
+# Define the path to the prediction cache
+ap.add_argument("-ca", "--cache", required=False,
+                help="Path to an SQLite database used for caching the "
+                     "predictions of both models between runs. The database "
+                     "is created if it does not exist.")
+
+# Define the maximum size of the prediction cache
+ap.add_argument("-cs", "--cache_size", required=False, type=int,
+                default=10000000,
+                help="Maximum number of predictions kept in the cache. The "
+                     "least recently used predictions are evicted first. "
+                     "Defaults to 10000000.")
+
+# Define the number of rows read at a time for streaming input and output
+ap.add_argument("-cz", "--chunksize", required=False, type=int,
+                help="Stream the input in chunks of this many rows and append "
+                     "each chunk to the output once it has been processed. "
+                     "Requires input and output in Parquet (.parquet), JSON "
+                     "lines (.jsonl) or CSV (.csv) format. The scripts in "
+                     "../plots and ../stats cannot read this output "
+                     "directly: use -ar/--arrays or convert the output into "
+                     "a pickle using convert_output.py.")
+
+# Define the threshold for assigning languages based on scripts
+ap.add_argument("-st", "--script_threshold", required=False, type=float,
+                help="Assign sentences in which this share of letters "
+                     "belongs to a script used by a single language, e.g. "
+                     "Thai, Georgian or Greek, directly to that language "
+                     "without calling the models. The value must be in range "
+                     "[0..1], e.g. 0.9.")
+
+# Define the minimum length of sentences passed to the model
+ap.add_argument("-mc", "--min_chars", required=False, type=int,
+                help="Record sentences shorter than this number of characters "
+                     "as undetermined ('und') with probability 0.0 without "
+                     "calling the models. Use the same value as the character "
+                     "threshold -ct of the scripts in ../plots and ../stats, "
+                     "which drop these sentences anyway.")
+
+# Define the threshold for classifying captions without splitting them
+ap.add_argument("-cl", "--caption_level", required=False, type=int,
+                help="Classify captions without a possible sentence boundary, "
+                     "and captions shorter than this number of characters, as "
+                     "a whole without splitting them into sentences. Use 0 to "
+                     "skip splitting only for captions without a possible "
+                     "boundary, which gives the same sentences as splitting "
+                     "every caption.")
+
+# Define the path to predictions saved in columnar format
+ap.add_argument("-ar", "--arrays", required=False,
+                help="Also save the predictions of both models as flat NumPy "
+                     "arrays to this .npz file, keyed by the column "
+                     "'photo_id' (or the index of the input, if the column is "
+                     "missing). See prediction_arrays.py.")
+
+# Define the similarity threshold for grouping near-duplicate texts
+ap.add_argument("-dd", "--dedupe", required=False, type=float,
+                help="Group texts whose character 5-grams have at least this "
+                     "estimated Jaccard similarity into clusters using "
+                     "MinHash LSH and classify only the first text in each "
+                     "cluster. The predictions of the first text are copied "
+                     "to the other texts and the position of the first text "
+                     "is saved into a column named 'cluster_id'. In "
+                     "streaming mode, texts are only grouped within a chunk. "
+                     "The value must be in range [0..1], e.g. 0.8.")
+
+# Define the threshold for re-scoring sentences using langid
+ap.add_argument("-cc", "--cascade", required=False, type=float,
+                help="Run fastText on all sentences and re-score only the "
+                     "sentences whose fastText probability is below this "
+                     "threshold using langid, e.g. 0.4 for the threshold -ft "
+                     "of the scripts in ../plots. The value must be in range "
+                     "[0..1].")
+
+# Define the number of worker processes for re-scoring
+ap.add_argument("-w", "--workers", required=False, type=int,
+                help="Number of processes used for re-scoring sentences "
+                     "using langid in cascade mode.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check that the arguments are compatible
+if args['workers'] is not None and args['cascade'] is None:
+    ap.error("-w/--workers requires -cc/--cascade")
+
+# Assign arguments to variables
+prep = args['preprocessing']
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Select the fastText model, if requested
+if args['ft_model'] is not None:
+    set_ft_model_path(args['ft_model'])
+
+# Select the sentence splitter, if requested
+if args['sentence_splitter'] is not None:
+    set_sentence_splitter(args['sentence_splitter'])
+
+# Set up the sentence tokenizer shared by all captions
+load_sentence_tokenizer(args['sentence_params'])
+
+# Set up hashtag segmentation, if requested
+if args['hashtag_segmentation'] is not None:
+    load_word_frequencies(args['hashtag_segmentation'])
+
+# Open the prediction caches, if requested. The predictions of both models are
+# stored in the same database.
+if args['cache'] is not None:
+    ft_cache = open_cache(args['cache'], 'fasttext', prep, args['cache_size'])
+    li_cache = open_cache(args['cache'], 'langid', prep, args['cache_size'])
+else:
+    ft_cache, li_cache = None, None
+
+
+def classify(texts):
+    """Identifies the language of texts using both models.
+
+    Args:
+        texts: A pandas Series containing the texts to process.
+
+    Returns:
+        A dictionary mapping the names of output columns to pandas Series with
+        an entry for each text.
+    """
+    # Re-score uncertain fastText predictions using langid, if requested
+    if args['cascade'] is not None:
+        final, ft, rescored = detect_cascade_batch(
+            texts, prep, args['cascade'], args['batch_size'], ft_cache,
+            li_cache, args['workers'], args['script_threshold'],
+            args['min_chars'], args['caption_level'])
+
+        # Return the predictions using the index of the input
+        return {'langid': pd.Series(final, index=texts.index),
+                'langid_ft': pd.Series(ft, index=texts.index),
+                'langid_rescored': pd.Series(rescored, index=texts.index)}
+
+    # Perform language identification
+    ft, li, agree = detect_dual_batch(texts, prep, args['batch_size'],
+                                      ft_cache, li_cache,
+                                      args['script_threshold'],
+                                      args['min_chars'],
+                                      args['caption_level'])
+
+    # Return the predictions and agreement using the index of the input
+    return {'langid_ft': pd.Series(ft, index=texts.index),
+            'langid_li': pd.Series(li, index=texts.index),
+            'langid_agree': pd.Series(agree, index=texts.index)}
+
+
+# Set up variables for timing language identification and counting the
+# classified sentences and the sentences on which the models agree, or the
+# sentences re-scored using langid and those whose language changed
+elapsed, n_sentences, n_compared, n_agree = 0, 0, 0, 0
+n_rescored, n_changed = 0, 0
+
+# Define the output columns holding predictions and flags
+if args['cascade'] is not None:
+    columns, flags = ['langid', 'langid_ft'], ['langid_rescored']
+else:
+    columns, flags = ['langid_ft', 'langid_li'], ['langid_agree']
+
+# Set up counters for numbering clusters of near-duplicates across chunks and
+# for counting the clusters
+n_rows, n_clusters = 0, 0
+
+# Collect the predictions in columnar format, if requested
+arrays = ArrayWriter(args['arrays']) if args['arrays'] is not None else None
+
+
+def add_predictions(df):
+    """Classifies the texts in a DataFrame and adds the results as columns.
+
+    Args:
+        df: A pandas DataFrame.
+    """
+    global elapsed, n_sentences, n_compared, n_agree, n_rescored, \
+        n_changed, n_rows, n_clusters
+
+    # Perform language identification, classifying only the first text in
+    # each cluster of near-duplicates, if requested
+    start = time.time()
+    if args['dedupe'] is not None:
+        clusters = near_duplicate_clusters(df[inputcol], args['dedupe'])
+        df['cluster_id'] = clusters + n_rows
+        n_rows += len(df)
+        n_clusters += len(np.unique(clusters))
+        results = classify_representatives(df[inputcol], classify, clusters)
+    else:
+        results = classify(df[inputcol])
+    elapsed += time.time() - start
+
+    # Add the results to the DataFrame
+    for col, values in results.items():
+        df[col] = values
+
+    # Count the classified sentences
+    n_sentences += count_sentences(results['langid_ft'])
+
+    # Count the re-scored sentences and those whose language changed
+    if args['cascade'] is not None:
+        n_rescored += sum(sum(r) for r in results['langid_rescored'] if r)
+        for final, ft in zip(results['langid'], results['langid_ft']):
+            n_changed += sum(f[0] != c[0] for f, c in zip(final or (),
+                                                          ft or ()))
+
+    # Otherwise count the sentences classified by both models and the
+    # sentences with agreement
+    else:
+        for agree in results['langid_agree']:
+            compared = [a for a in agree or () if a is not None]
+            n_compared += len(compared)
+            n_agree += sum(compared)
+
+
+# Check if the input should be streamed in chunks
+if args['chunksize'] is not None:
+
+    # Open the output file, to which each chunk is appended
+    with ChunkWriter(args['output']) as writer:
+
+        # Loop over the chunks of the input file, perform language
+        # identification and append the chunk to the output
+        for chunk in read_chunks(args['input'], args['chunksize']):
+            add_predictions(chunk)
+            writer.write(chunk, columns=columns, flags=flags)
+
+            # Convert the predictions into arrays
+            if arrays is not None:
+                arrays.write(chunk, columns=columns)
+
+else:
+    # Load the input DataFrame and perform language identification
+    input_df = pd.read_pickle(args['input'])
+    add_predictions(input_df)
+
+    # Save DataFrame to disk
+    input_df.to_pickle(args['output'])
+
+    # Convert the predictions into arrays
+    if arrays is not None:
+        arrays.write(input_df, columns=columns)
+
+# Save the predictions in columnar format
+if arrays is not None:
+    arrays.close()
+
+# Report throughput and the re-scored sentences in cascade mode
+if args['cascade'] is not None:
+    print('[INFO] Classified {} sentences in {:.1f} seconds ({:.0f} '
+          'sentences/sec)'.format(n_sentences, elapsed,
+                                  n_sentences / max(elapsed, 1e-9)))
+    print('[INFO] Re-scored {} sentences ({:.1%}) using langid, which '
+          'changed the language of {} sentences'
+          .format(n_rescored, n_rescored / max(n_sentences, 1), n_changed))
+
+# Otherwise report throughput and agreement
+else:
+    print('[INFO] Classified {} sentences using both models in {:.1f} '
+          'seconds ({:.0f} sentences/sec)'
+          .format(n_sentences, elapsed, n_sentences / max(elapsed, 1e-9)))
+    print('[INFO] The models agree on {} of {} sentences classified by both '
+          'models ({:.1%})'
+          .format(n_agree, n_compared, n_agree / max(n_compared, 1)))
+
+# Report the number of clusters of near-duplicates
+if args['dedupe'] is not None:
+    print('[INFO] Classified {} clusters of near-duplicates for {} rows'
+          .format(n_clusters, n_rows))
+
+# Report the calls to the sentence tokenizer saved
+if args['caption_level'] is not None:
+    print('[INFO] Sentence splitting: {}'.format(splitter_report()))
+
+# Report the use of the caches
+if ft_cache is not None:
+    print('[INFO] Prediction cache (fastText): {}'.format(ft_cache.report()))
+    print('[INFO] Prediction cache (langid): {}'.format(li_cache.report()))
+    ft_cache.close()
+    li_cache.close()
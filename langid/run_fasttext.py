@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 
-from supporting_functions import detect_ft
+from supporting_functions import PREPROCESSING_STRATEGIES, ChunkWriter, \
+    count_sentences, detect_ft, detect_ft_batch, detect_ft_strategies, \
+    load_sentence_tokenizer, open_cache, read_chunks, set_ft_model_path, \
+    set_sentence_splitter, splitter_report, update_predictions
+from near_duplicates import classify_representatives, near_duplicate_clusters
+from hashtag_segmentation import load_word_frequencies
+from parallel_detection import detect_ft_parallel, memory_report
+from prediction_arrays import ArrayWriter
+from service_client import ServiceClient
 import argparse
+import numpy as np
 import pandas as pd
+import time
 
 """
 This script runs fastText language identification model on texts stored in a
@@ -13,8 +23,84 @@ Usage:
     
     python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all'
 
+    To preprocess all captions first and pass their sentences to fastText in
+    batches of 100000 sentences, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000
+
+    To use the compressed model, which takes up less memory, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -fm models/lid.176.ftz
+
+    To spread the work over 8 processes, which share a single copy of the
+    model, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 10000 \
+        -w 8
+
+    To send the texts to a service started using run_service.py, which keeps
+    the model in memory between runs, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' \
+        -sv /tmp/langid.sock
+
+    To stream large inputs in chunks of 100000 rows, keeping memory use
+    bounded, run:
+
+    python3 run_fasttext.py -i input.parquet -o output.parquet -p 'rm_all' \
+        -b 100000 -cz 100000
+
+    To compare the preprocessing strategies, apply all of them in a single run,
+    which shares the preprocessing steps common to the strategies and passes
+    the sentences of all strategies to fastText together:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'all' -b 100000
+
+    To update the output of a previous run with new posts, classifying only
+    the posts that are new or whose text has changed, run:
+
+    python3 run_fasttext.py -i new.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -u previous.pkl
+
+    To skip sentences shorter than 10 characters, which are dropped by the
+    scripts in ../plots and ../stats using -ct 10, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -mc 10
+
+    To classify only one caption in each cluster of near-duplicate captions,
+    e.g. templated captions posted by spam accounts, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -dd 0.8
+
+    To split sentences at terminal punctuation, emoji and line breaks using a
+    regular expression instead of the Punkt tokenizer, after comparing their
+    speed and boundaries using sentence_splitter_report.py, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' -b 100000 \
+        -ss regex
+
+    To split concatenated hashtags into words using word frequencies saved
+    by train_word_frequencies.py, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_trail' \
+        -b 100000 -hs word_frequencies.pkl
+
+    To also save the predictions in a compact, columnar format that can be
+    passed to the scripts in ../plots, ../stats and ../topics, run:
+
+    python3 run_fasttext.py -i input.pkl -o output.pkl -p 'rm_all' \
+        -ar output.npz
+
 Returns:
     A pandas DataFrame with fastText predictions in a column named 'langid'.
+    If all preprocessing strategies are applied, the predictions are stored in
+    the columns 'langid_no_preprocessing', 'langid_rm_all' and
+    'langid_rm_trail'.
+    In streaming mode, the output is written in the format of the output file,
+    which may be Parquet, JSON lines or CSV.
 """
 
 # Set up the argument parser
@@ -33,29 +119,372 @@ ap.add_argument("-o", "--output", required=True,
 # Define the preprocessing strategy
 ap.add_argument("-p", "--preprocessing", required=True,
                 help="Selected preprocessing strategy: valid values include "
-                     "'no_preprocessing', 'rm_all' and 'rm_trail'.")
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'. Use 'all' "
+                     "to apply all three strategies in a single run.")
 
 # Define input column manually
 ap.add_argument("-c", "--column", required=False,
                 help="The name of the column containing the texts to process.")
 
+# Define batch size for batched language identification
+ap.add_argument("-b", "--batch_size", required=False, type=int,
+                help="Preprocess all texts first and pass their sentences to "
+                     "fastText in batches of this size instead of processing "
+                     "the texts one by one.")
+
+# Define the path to the fastText model
+ap.add_argument("-fm", "--ft_model", required=False,
+                help="Path to the fastText model, e.g. models/lid.176.ftz for "
+                     "the compressed model, which takes up less memory. "
+                     "Defaults to models/lid.176.bin.")
+
+# Define the number of worker processes
+ap.add_argument("-w", "--workers", required=False, type=int,
+                help="Number of processes used for language identification. "
+                     "The model is loaded once and shared by the processes, "
+                     "which classify chunks of texts in parallel. Cannot be "
+                     "combined with -p 'all'.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt sentence tokenizer parameters trained "
+                     "using train_punkt.py. If not set, the default "
+                     "parameters are used.")
+
+# Define the sentence splitter
+ap.add_argument("-ss", "--sentence_splitter", required=False,
+                choices=['punkt', 'regex'],
+                help="Sentence splitter: 'punkt' for NLTK's Punkt tokenizer "
+                     "or 'regex' for a splitter that breaks sentences at "
+                     "terminal punctuation, emoji and line breaks. The regex "
+                     "splitter is not always faster and splits captions at "
+                     "emoji, which Punkt does not; compare both on your data "
+                     "using sentence_splitter_report.py. Defaults to "
+                     "'punkt'.")
+
+# Define the path to word frequencies for segmenting hashtags
+ap.add_argument("-hs", "--hashtag_segmentation", required=False,
+                help="Path to word frequencies saved using "
+                     "train_word_frequencies.py. If set, the 'rm_trail' "
+                     "preprocessing strategy splits the remaining hashtags "
+                     "into words and keeps captions consisting only of "
+                     "hashtags.")
+
+# Define the path to the prediction cache
+ap.add_argument("-ca", "--cache", required=False,
+                help="Path to an SQLite database for caching predictions "
+                     "between runs. The database is created if it does not "
+                     "exist.")
+
+# Define the maximum size of the prediction cache
+ap.add_argument("-cs", "--cache_size", required=False, type=int,
+                default=10000000,
+                help="Maximum number of predictions kept in the cache. The "
+                     "least recently used predictions are evicted first. "
+                     "Defaults to 10000000.")
+
+# Define the number of rows read at a time for streaming input and output
+ap.add_argument("-cz", "--chunksize", required=False, type=int,
+                help="Stream the input in chunks of this many rows and append "
+                     "each chunk to the output once it has been processed. "
+                     "Requires input and output in Parquet (.parquet), JSON "
+                     "lines (.jsonl) or CSV (.csv) format. The scripts in "
+                     "../plots and ../stats cannot read this output "
+                     "directly: use -ar/--arrays or convert the output into "
+                     "a pickle using convert_output.py.")
+
+# Define the threshold for assigning languages based on scripts
+ap.add_argument("-st", "--script_threshold", required=False, type=float,
+                help="Assign sentences in which this share of letters "
+                     "belongs to a script used by a single language, e.g. "
+                     "Thai, Georgian or Greek, directly to that language "
+                     "without calling fastText. The value must be in range "
+                     "[0..1], e.g. 0.9.")
+
+# Define the minimum length of sentences passed to the model
+ap.add_argument("-mc", "--min_chars", required=False, type=int,
+                help="Record sentences shorter than this number of characters "
+                     "as undetermined ('und') with probability 0.0 without "
+                     "calling fastText. Use the same value as the character "
+                     "threshold -ct of the scripts in ../plots and ../stats, "
+                     "which drop these sentences anyway.")
+
+# Define the threshold for classifying captions without splitting them
+ap.add_argument("-cl", "--caption_level", required=False, type=int,
+                help="Classify captions without a possible sentence boundary, "
+                     "and captions shorter than this number of characters, as "
+                     "a whole without splitting them into sentences. Use 0 to "
+                     "skip splitting only for captions without a possible "
+                     "boundary, which gives the same sentences as splitting "
+                     "every caption.")
+
+# Define the path to predictions saved in columnar format
+ap.add_argument("-ar", "--arrays", required=False,
+                help="Also save the predictions as flat NumPy arrays to this "
+                     ".npz file, keyed by the column 'photo_id' (or the index "
+                     "of the input, if the column is missing). See "
+                     "prediction_arrays.py.")
+
+# Define the similarity threshold for grouping near-duplicate texts
+ap.add_argument("-dd", "--dedupe", required=False, type=float,
+                help="Group texts whose character 5-grams have at least this "
+                     "estimated Jaccard similarity, e.g. templated captions "
+                     "posted by spam accounts, into clusters using MinHash "
+                     "LSH and classify only the first text in each cluster. "
+                     "The predictions of the first text are copied to the "
+                     "other texts and the position of the first text is "
+                     "saved into a column named 'cluster_id'. In streaming "
+                     "mode, texts are only grouped within a chunk. The value "
+                     "must be in range [0..1], e.g. 0.8.")
+
+# Define the path to the output of a previous run for incremental updates
+ap.add_argument("-u", "--update", required=False,
+                help="Path to the output of a previous run. Only the rows "
+                     "whose photo_id is not found in the previous output or "
+                     "whose text has changed are classified. The output "
+                     "contains the rows of both. If the previous output has "
+                     "no column langid_hash, all rows of the input are "
+                     "classified.")
+
+# Define the address of a running language identification service
+ap.add_argument("-sv", "--service", required=False,
+                help="Send the texts to a service started using "
+                     "run_service.py at this address instead of loading the "
+                     "model, e.g. /tmp/langid.sock or localhost:8765.")
+
 # Parse arguments
 args = vars(ap.parse_args())
 
 # Assign arguments to variables
 prep = args['preprocessing']
 
+# Check that the arguments are compatible
+if args['workers'] is not None and prep == 'all':
+    ap.error("-w/--workers cannot be combined with -p 'all'")
+
+if args['update'] is not None and args['chunksize'] is not None:
+    ap.error("-u/--update cannot be combined with -cz/--chunksize")
+
+if args['dedupe'] is not None and args['update'] is not None:
+    ap.error("-dd/--dedupe cannot be combined with -u/--update")
+
+if args['service'] is not None and (prep == 'all' or any(
+        args[k] is not None for k in ['workers', 'cache', 'ft_model',
+                                      'batch_size', 'sentence_params',
+                                      'hashtag_segmentation',
+                                      'script_threshold', 'min_chars',
+                                      'caption_level', 'sentence_splitter'])):
+    ap.error("-sv/--service cannot be combined with -p 'all', -w/--workers, "
+             "-ca/--cache, -fm/--ft_model, -b/--batch_size, "
+             "-sp/--sentence_params, -hs/--hashtag_segmentation, "
+             "-st/--script_threshold, -mc/--min_chars, -cl/--caption_level or "
+             "-ss/--sentence_splitter, which are applied by the service")
+
 # Check if DataFrame input column has been set manually
 if args['column'] is not None:
     inputcol = args['column']
 else:
     inputcol = 'text'
 
-# Load the input DataFrame
-input_df = pd.read_pickle(args['input'])
+# Select the fastText model, if requested
+if args['ft_model'] is not None:
+    set_ft_model_path(args['ft_model'])
+
+# Select the sentence splitter, if requested
+if args['sentence_splitter'] is not None:
+    set_sentence_splitter(args['sentence_splitter'])
+
+# Set up the sentence tokenizer shared by all captions
+load_sentence_tokenizer(args['sentence_params'])
+
+# Set up hashtag segmentation, if requested
+if args['hashtag_segmentation'] is not None:
+    load_word_frequencies(args['hashtag_segmentation'])
+
+# Open the prediction cache, if requested
+if args['cache'] is not None:
+    cache = open_cache(args['cache'], 'fasttext', prep, args['cache_size'])
+else:
+    cache = None
+
+# Connect to the language identification service, if requested
+if args['service'] is not None:
+    client = ServiceClient(args['service'])
+else:
+    client = None
+
+
+def classify(texts):
+    """Identifies the language of texts using the selected options.
+
+    Args:
+        texts: A pandas Series containing the texts to process.
+
+    Returns:
+        A dictionary mapping the names of output columns to pandas Series with
+        a prediction for each text.
+    """
+    # Apply all preprocessing strategies at once, if requested
+    if prep == 'all':
+        predictions = detect_ft_strategies(texts, PREPROCESSING_STRATEGIES,
+                                           args['batch_size'], cache,
+                                           args['script_threshold'],
+                                           args['min_chars'],
+                                           args['caption_level'])
+
+        # Return the predictions for each strategy in a separate column
+        return {'langid_' + mode: pd.Series(p, index=texts.index)
+                for mode, p in predictions.items()}
+
+    # Perform language identification using the service, a pool of
+    # processes, in batches or one text at a time
+    if client is not None:
+        predictions = client.detect(texts, 'fasttext', prep)
+    elif args['workers'] is not None and args['workers'] > 1:
+        predictions = detect_ft_parallel(
+            texts, prep, args['workers'], cache=cache,
+            batch_size=args['batch_size'],
+            script_threshold=args['script_threshold'],
+            min_chars=args['min_chars'],
+            caption_level=args['caption_level'])
+    elif args['batch_size'] is not None:
+        predictions = detect_ft_batch(texts, prep, args['batch_size'], cache,
+                                      args['script_threshold'],
+                                      args['min_chars'], args['caption_level'])
+    else:
+        predictions = [detect_ft(x, prep, cache, args['script_threshold'],
+                                 args['min_chars'], args['caption_level'])
+                       for x in texts]
+
+    # Return the predictions using the index of the input
+    return {'langid': pd.Series(predictions, index=texts.index)}
+
+
+# Set up counters for numbering clusters of near-duplicates across chunks and
+# for counting the clusters
+n_rows, n_clusters = 0, 0
+
+
+def classify_frame(df):
+    """Identifies the language of the texts in a DataFrame, classifying only
+    one text in each cluster of near-duplicates, if requested.
+
+    Args:
+        df: A pandas DataFrame. If near-duplicates are grouped, the position
+            of the first text in the cluster of each row is added to the
+            column 'cluster_id'.
+
+    Returns:
+        The output of classify() for the texts in the DataFrame.
+    """
+    global n_rows, n_clusters
+
+    # Classify all texts if near-duplicates are not grouped
+    if args['dedupe'] is None:
+        return classify(df[inputcol])
+
+    # Group the texts into clusters of near-duplicates
+    clusters = near_duplicate_clusters(df[inputcol], args['dedupe'])
+    df['cluster_id'] = clusters + n_rows
+    n_rows += len(df)
+    n_clusters += len(np.unique(clusters))
+
+    # Classify the first text in each cluster
+    return classify_representatives(df[inputcol], classify, clusters)
+
+
+# Set up variables for timing language identification and counting the
+# classified sentences
+elapsed, n_sentences = 0, 0
+
+# Collect the predictions in columnar format, if requested
+arrays = ArrayWriter(args['arrays']) if args['arrays'] is not None else None
+
+# Check if the input should be streamed in chunks
+if args['chunksize'] is not None:
+
+    # Open the output file, to which each chunk is appended
+    with ChunkWriter(args['output']) as writer:
+
+        # Loop over the chunks of the input file
+        for chunk in read_chunks(args['input'], args['chunksize']):
+
+            # Perform language identification
+            start = time.time()
+            predictions = classify_frame(chunk)
+            elapsed += time.time() - start
+
+            # Add the predictions to the chunk and count the classified
+            # sentences
+            for col, preds in predictions.items():
+                chunk[col] = preds
+                n_sentences += count_sentences(preds)
+
+            # Append the chunk to output
+            writer.write(chunk, columns=list(predictions))
+
+            # Convert the predictions into arrays
+            if arrays is not None:
+                arrays.write(chunk, columns=list(predictions))
+
+else:
+    # Load the input DataFrame
+    input_df = pd.read_pickle(args['input'])
+
+    # Perform language identification, either for all rows or only for the
+    # rows that are new or have changed since the previous run
+    start = time.time()
+    if args['update'] is not None:
+        input_df, predictions = update_predictions(
+            input_df, pd.read_pickle(args['update']), inputcol, prep, classify)
+    else:
+        predictions = classify_frame(input_df)
+        for col, preds in predictions.items():
+            input_df[col] = preds
+    elapsed += time.time() - start
+
+    # Count the classified sentences
+    for preds in predictions.values():
+        n_sentences += count_sentences(preds)
+
+    # Report the number of classified rows in incremental mode
+    if args['update'] is not None:
+        print('[INFO] Classified {} new or changed rows, output has {} rows'
+              .format(len(next(iter(predictions.values()))), len(input_df)))
+
+    # Save DataFrame to disk
+    input_df.to_pickle(args['output'])
+
+    # Convert the predictions into arrays
+    if arrays is not None:
+        arrays.write(input_df, columns=list(predictions))
+
+# Save the predictions in columnar format
+if arrays is not None:
+    arrays.close()
+
+# Report throughput
+print('[INFO] Classified {} sentences in {:.1f} seconds ({:.0f} sentences/sec)'
+      .format(n_sentences, elapsed, n_sentences / max(elapsed, 1e-9)))
+
+# Report the number of clusters of near-duplicates
+if args['dedupe'] is not None:
+    print('[INFO] Classified {} clusters of near-duplicates for {} rows'
+          .format(n_clusters, n_rows))
+
+# Report the calls to the sentence tokenizer saved
+if args['caption_level'] is not None:
+    print('[INFO] Sentence splitting: {}'.format(splitter_report()))
+
+# Report the memory use of the worker processes
+if args['workers'] is not None and args['workers'] > 1:
+    print('[INFO] Memory use: {}'.format(memory_report()))
 
-# Perform language identification
-input_df['langid'] = input_df[inputcol].apply(lambda x: detect_ft(x, prep))
+# Close the connection to the service
+if client is not None:
+    client.close()
 
-# Save DataFrame to disk
-input_df.to_pickle(args['output'])
+# Report the use of the cache
+if cache is not None:
+    print('[INFO] Prediction cache: {}'.format(cache.report()))
+    cache.close()
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import PREPROCESSING_STRATEGIES, detect_ft_batch, \
+    detect_li_batch, get_ft_model, get_li_model, load_sentence_tokenizer, \
+    set_ft_model_path, set_sentence_splitter, splitter_calls
+from hashtag_segmentation import load_word_frequencies
+from service_client import parse_address
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import argparse
+import asyncio
+import json
+import numpy as np
+import os
+import signal
+import socket
+import time
+
+"""
+This script starts a local language identification service, which keeps the
+models in memory and classifies texts sent by clients. Requests arriving at
+the same time are gathered into micro-batches: a batch is classified once it
+holds the maximum number of captions or once the oldest request in the batch
+has waited for the maximum latency, whichever comes first.
+
+Clients, such as run_fasttext.py and run_langid.py with the argument
+-sv/--service, connect to the service using ServiceClient defined in
+service_client.py. Each request and response is a JSON document on a single
+line. Requests contain either the keys 'captions', 'backend' and
+'preprocessing', or the key 'stats', which returns the latency percentiles and
+throughput counters of the service.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 run_service.py -a /tmp/langid.sock -m 'fasttext'
+
+    To listen on a TCP port on localhost instead, run:
+
+    python3 run_service.py -a localhost:8765 -m 'fasttext'
+
+Returns:
+    Runs until interrupted, printing statistics at regular intervals.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the address of the service
+ap.add_argument("-a", "--address", required=True,
+                help="Path to a Unix socket, e.g. /tmp/langid.sock, or a host "
+                     "and port, e.g. localhost:8765.")
+
+# Define the models kept in memory
+ap.add_argument("-m", "--models", required=False, nargs='+',
+                default=['fasttext'], choices=['fasttext', 'langid'],
+                help="Language identification models loaded at start: valid "
+                     "values include 'fasttext' and 'langid'. Defaults to "
+                     "'fasttext'.")
+
+# Define the path to the fastText model
+ap.add_argument("-fm", "--ft_model", required=False,
+                help="Path to the fastText model, e.g. models/lid.176.ftz for "
+                     "the compressed model, which takes up less memory. "
+                     "Defaults to models/lid.176.bin.")
+
+# Define the maximum size of a micro-batch
+ap.add_argument("-b", "--max_batch", required=False, type=int, default=5000,
+                help="Maximum number of captions in a micro-batch. Defaults "
+                     "to 5000.")
+
+# Define the maximum latency added by batching
+ap.add_argument("-l", "--max_latency", required=False, type=float,
+                default=10,
+                help="Maximum time in milliseconds that a request waits for "
+                     "other requests to join its batch. Defaults to 10.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt sentence tokenizer parameters trained "
+                     "using train_punkt.py. If not set, the default "
+                     "parameters are used.")
+
+# Define the sentence splitter
+ap.add_argument("-ss", "--sentence_splitter", required=False,
+                choices=['punkt', 'regex'],
+                help="Sentence splitter: 'punkt' for NLTK's Punkt tokenizer "
+                     "or 'regex' for a splitter that breaks sentences at "
+                     "terminal punctuation, emoji and line breaks. The regex "
+                     "splitter is not always faster and splits captions at "
+                     "emoji, which Punkt does not; compare both on your data "
+                     "using sentence_splitter_report.py. Defaults to "
+                     "'punkt'.")
+
+# Define the path to word frequencies for segmenting hashtags
+ap.add_argument("-hs", "--hashtag_segmentation", required=False,
+                help="Path to word frequencies saved using "
+                     "train_word_frequencies.py. If set, the 'rm_trail' "
+                     "preprocessing strategy splits the remaining hashtags "
+                     "into words and keeps captions consisting only of "
+                     "hashtags.")
+
+# Define the threshold for assigning languages based on scripts
+ap.add_argument("-st", "--script_threshold", required=False, type=float,
+                help="Assign sentences in which this share of letters "
+                     "belongs to a script used by a single language directly "
+                     "to that language without calling the model. The value "
+                     "must be in range [0..1], e.g. 0.9.")
+
+# Define the minimum length of sentences passed to the models
+ap.add_argument("-mc", "--min_chars", required=False, type=int,
+                help="Record sentences shorter than this number of characters "
+                     "as undetermined ('und') with probability 0.0 without "
+                     "calling the model.")
+
+# Define the threshold for classifying captions without splitting them
+ap.add_argument("-cl", "--caption_level", required=False, type=int,
+                help="Classify captions without a possible sentence boundary, "
+                     "and captions shorter than this number of characters, as "
+                     "a whole without splitting them into sentences. Use 0 to "
+                     "skip splitting only for captions without a possible "
+                     "boundary, which gives the same sentences as splitting "
+                     "every caption.")
+
+# Define the interval for printing statistics
+ap.add_argument("-r", "--report", required=False, type=float, default=60,
+                help="Interval in seconds for printing statistics. Defaults "
+                     "to 60.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Define the functions for each model
+DETECT = {'fasttext': detect_ft_batch, 'langid': detect_li_batch}
+
+
+class Statistics(object):
+    """Keeps track of latencies and throughput.
+
+    Args:
+        window: The number of most recent requests used for calculating
+                latency percentiles.
+    """
+
+    def __init__(self, window=10000):
+
+        # Set up the counters
+        self.started = time.time()
+        self.requests = 0
+        self.captions = 0
+        self.sentences = 0
+        self.batches = 0
+        self.busy = 0
+
+        # Set up a bounded queue for the latencies of recent requests
+        self.latencies = deque(maxlen=window)
+
+    def summary(self):
+        """Summarizes the statistics.
+
+        Returns:
+            A dictionary with the counters, throughput and latency percentiles
+            in milliseconds.
+        """
+        # Calculate the uptime
+        uptime = time.time() - self.started
+
+        # Calculate the latency percentiles
+        if self.latencies:
+            p50, p90, p99 = np.percentile(self.latencies, [50, 90, 99]) * 1000
+        else:
+            p50 = p90 = p99 = None
+
+        # Return the summary
+        return {'uptime': uptime,
+                'requests': self.requests,
+                'captions': self.captions,
+                'sentences': self.sentences,
+                'batches': self.batches,
+                'mean_batch_size': self.captions / max(self.batches, 1),
+                'captions_per_sec': self.captions / max(uptime, 1e-9),
+                'busy_share': self.busy / max(uptime, 1e-9),
+                'captions_split': splitter_calls['split'],
+                'captions_whole': splitter_calls['skipped'],
+                'latency_ms': {'p50': p50, 'p90': p90, 'p99': p99}}
+
+
+class MicroBatcher(object):
+    """Gathers requests for a model and preprocessing strategy into batches.
+
+    Args:
+        backend: The language identification model.
+        preprocessing: The preprocessing strategy.
+        executor: The executor in which the batches are classified.
+        stats: A Statistics object.
+    """
+
+    def __init__(self, backend, preprocessing, executor, stats):
+
+        # Assign arguments to attributes
+        self.backend = backend
+        self.preprocessing = preprocessing
+        self.executor = executor
+        self.stats = stats
+
+        # Set up a queue for pending requests and start processing them
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def submit(self, captions):
+        """Adds captions to the next batch and waits for their predictions.
+
+        Args:
+            captions: A list of captions.
+
+        Returns:
+            A list with a prediction for each caption.
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((captions, future))
+        return await future
+
+    async def run(self):
+        """Collects requests into batches and classifies them."""
+        loop = asyncio.get_event_loop()
+
+        while True:
+
+            # Wait for the first request of the batch
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + args['max_latency'] / 1000
+
+            # Add requests until the batch is full or the deadline has passed
+            while size < args['max_batch']:
+                getter = asyncio.ensure_future(self.queue.get())
+                done, _ = await asyncio.wait(
+                    [getter], timeout=max(deadline - loop.time(), 0))
+
+                # Stop waiting at the deadline, unless a request arrived
+                # while cancelling
+                if not done:
+                    getter.cancel()
+                    try:
+                        await getter
+                    except asyncio.CancelledError:
+                        break
+                item = getter.result()
+                batch.append(item)
+                size += len(item[0])
+
+            # Classify the captions of all requests in the batch at once,
+            # without blocking the event loop
+            captions = [c for item in batch for c in item[0]]
+            start = time.time()
+            try:
+                predictions = await loop.run_in_executor(
+                    self.executor, lambda: DETECT[self.backend](
+                        captions, self.preprocessing,
+                        script_threshold=args['script_threshold'],
+                        min_chars=args['min_chars'],
+                        caption_level=args['caption_level']))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Update the counters
+            self.stats.busy += time.time() - start
+            self.stats.batches += 1
+            self.stats.captions += len(captions)
+            self.stats.sentences += sum(len(p) for p in predictions if p)
+
+            # Return the predictions for each request
+            i = 0
+            for request, future in batch:
+                if not future.done():
+                    future.set_result(predictions[i:i + len(request)])
+                i += len(request)
+
+
+async def handle(reader, writer, batchers, executor, stats):
+    """Handles the requests sent over a connection.
+
+    Args:
+        reader: An asyncio StreamReader for the connection.
+        writer: An asyncio StreamWriter for the connection.
+        batchers: A dictionary of MicroBatcher objects keyed by the model and
+                  preprocessing strategy.
+        executor: The executor in which the batches are classified.
+        stats: A Statistics object.
+    """
+    # Loop over the requests, one per line
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        start = time.time()
+
+        # Parse the request and get the predictions or statistics
+        try:
+            request = json.loads(line.decode('utf-8'))
+
+            if 'stats' in request:
+                response = {'stats': stats.summary()}
+
+            else:
+                # Check that the model is available
+                key = (request['backend'], request['preprocessing'])
+                if key[0] not in args['models']:
+                    raise ValueError('model {} not loaded'.format(key[0]))
+
+                # Check that the preprocessing strategy is known
+                if key[1] not in PREPROCESSING_STRATEGIES:
+                    raise ValueError('unknown preprocessing strategy {}'
+                                     .format(key[1]))
+
+                # Set up a batcher for new combinations of model and
+                # preprocessing strategy
+                if key not in batchers:
+                    batchers[key] = MicroBatcher(key[0], key[1], executor,
+                                                 stats)
+
+                # Wait for the predictions
+                response = {'predictions': await batchers[key].submit(
+                    request['captions'])}
+
+                # Record the latency of the request
+                stats.requests += 1
+                stats.latencies.append(time.time() - start)
+
+        # Report errors to the client
+        except Exception as e:
+            response = {'error': '{}: {}'.format(type(e).__name__, e)}
+
+        # Send the response, converting NumPy numbers into floats
+        writer.write(json.dumps(response, default=float).encode('utf-8')
+                     + b'\n')
+        await writer.drain()
+
+    # Close the connection
+    writer.close()
+
+
+async def report(stats):
+    """Prints statistics at regular intervals.
+
+    Args:
+        stats: A Statistics object.
+    """
+    while True:
+        await asyncio.sleep(args['report'])
+        print('[INFO] {}'.format(json.dumps(stats.summary(), default=float)),
+              flush=True)
+
+
+async def serve():
+    """Starts the service and runs until interrupted."""
+    # Set up the statistics, batchers and a single thread for classifying
+    # the batches, as the models are not shared between threads
+    stats, batchers = Statistics(), {}
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    # Define the handler for connections
+    def connect(reader, writer):
+        return handle(reader, writer, batchers, executor, stats)
+
+    # Start the server on a Unix socket or on a TCP port. Allow long lines,
+    # as a request may contain thousands of captions.
+    family, address = parse_address(args['address'])
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            os.remove(address)
+        server = await asyncio.start_unix_server(connect, address,
+                                                 limit=2 ** 28)
+    else:
+        server = await asyncio.start_server(connect, *address, limit=2 ** 28)
+
+    # Print statistics at regular intervals
+    asyncio.ensure_future(report(stats))
+
+    # Stop the service when interrupted or terminated
+    stop = asyncio.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        asyncio.get_event_loop().add_signal_handler(signum, stop.set)
+
+    # Inform the user and serve until stopped
+    print('[INFO] Listening on {}'.format(args['address']), flush=True)
+    async with server:
+        await stop.wait()
+
+
+# Select the fastText model, if requested
+if args['ft_model'] is not None:
+    set_ft_model_path(args['ft_model'])
+
+# Set up hashtag segmentation, if requested
+if args['hashtag_segmentation'] is not None:
+    load_word_frequencies(args['hashtag_segmentation'])
+
+# Select the sentence splitter, if requested
+if args['sentence_splitter'] is not None:
+    set_sentence_splitter(args['sentence_splitter'])
+
+# Set up the sentence tokenizer and load the models before accepting requests
+load_sentence_tokenizer(args['sentence_params'])
+for model in args['models']:
+    {'fasttext': get_ft_model, 'langid': get_li_model}[model]()
+
+# Run the service until interrupted
+asyncio.run(serve())
+
+# Remove the Unix socket
+if parse_address(args['address'])[0] == socket.AF_UNIX and \
+        os.path.exists(args['address']):
+    os.remove(args['address'])
+
+# Print status
+print('[INFO] ... Done!')
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import detect_scripts, predict_ft, predict_li, \
+    prepare_captions
+from collections import Counter
+import argparse
+import pandas as pd
+import time
+
+"""
+This script compares languages assigned to sentences based on their script
+against the predictions of a full language identification model, in order to
+quantify the speed/accuracy trade-off of the option -st/--script_threshold in
+run_fasttext.py and run_langid.py.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 script_cascade_report.py -i input.pkl -p 'rm_all' -m 'fasttext'
+
+Returns:
+    Prints the share of sentences assigned based on their script, their
+    agreement with the model for each language and the time taken by both
+    approaches.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=True,
+                help="Selected preprocessing strategy: valid values include "
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'.")
+
+# Define the language identification model
+ap.add_argument("-m", "--model", required=True,
+                help="Language identification model used for comparison: "
+                     "valid values include 'fasttext' and 'langid'.")
+
+# Define the threshold for assigning languages based on scripts
+ap.add_argument("-st", "--script_threshold", required=False, type=float,
+                default=0.9,
+                help="Minimum share of letters in a script used by a single "
+                     "language. Defaults to 0.9.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Select the function for making predictions
+predict = predict_ft if args['model'] == 'fasttext' else predict_li
+
+# Load the input DataFrame, preprocess the texts and get their sentences
+input_df = pd.read_pickle(args['input'])
+sentences, _ = prepare_captions(input_df[inputcol], args['preprocessing'])
+
+# Load the model before timing by passing it an empty list
+predict([])
+
+# Assign languages based on scripts
+start = time.time()
+script_langs, _ = detect_scripts(sentences, args['script_threshold'])
+script_time = time.time() - start
+
+# Make predictions for all sentences using the model
+start = time.time()
+model_langs, _ = predict(sentences)
+model_time = time.time() - start
+
+# Make predictions for the sentences left over by the cascade
+remaining = [s for s, lang in zip(sentences, script_langs) if lang is None]
+start = time.time()
+predict(remaining)
+cascade_time = script_time + time.time() - start
+
+# Count the sentences assigned based on scripts and their agreement with the
+# model for each language
+assigned = Counter(lang for lang in script_langs if lang is not None)
+agreed = Counter(s for s, m in zip(script_langs, model_langs)
+                 if s is not None and s == m)
+disagreed = Counter((s, m) for s, m in zip(script_langs, model_langs)
+                    if s is not None and s != m)
+
+# Print the results
+n_assigned = sum(assigned.values())
+print('[INFO] {} of {} sentences ({:.1%}) assigned based on script'
+      .format(n_assigned, len(sentences),
+              n_assigned / max(len(sentences), 1)))
+print('[INFO] Agreement with {}: {:.2%}'
+      .format(args['model'], sum(agreed.values()) / max(n_assigned, 1)))
+
+# Print agreement for each language
+for lang, n in assigned.most_common():
+    print('[INFO]   {}: {} sentences, {:.2%} agreement'
+          .format(lang, n, agreed[lang] / n))
+
+# Print the most common disagreements
+for (script_lang, model_lang), n in disagreed.most_common(10):
+    print('[INFO]   script {} vs. {} {}: {} sentences'
+          .format(script_lang, args['model'], model_lang, n))
+
+# Print timing
+print('[INFO] Full model: {:.1f} seconds, cascade: {:.1f} seconds '
+      '({:.1f} seconds for scripts), speedup {:.2f}x'
+      .format(model_time, cascade_time, script_time,
+              model_time / max(cascade_time, 1e-9)))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import FAST_SENTENCE_BOUNDARY, \
+    load_sentence_tokenizer, preprocess_caption, split_sentence, \
+    split_sentence_regex
+from collections import Counter
+import argparse
+import pandas as pd
+import time
+
+"""
+This script compares the regular expression sentence splitter against the
+Punkt tokenizer, in order to decide whether the option -ss/--sentence_splitter
+of run_fasttext.py and run_langid.py can be set to 'regex' for a given
+dataset.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 sentence_splitter_report.py -i input.pkl -p 'no_preprocessing'
+
+Returns:
+    Prints the throughput of both splitters, the share of captions split
+    identically, and the precision and recall of the boundaries found by the
+    regular expression with respect to those found by Punkt.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=True,
+                help="Selected preprocessing strategy: valid values include "
+                     "'no_preprocessing', 'rm_all' and 'rm_trail'.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define the path to trained Punkt parameters
+ap.add_argument("-sp", "--sentence_params", required=False,
+                help="Path to Punkt sentence tokenizer parameters trained "
+                     "using train_punkt.py. If not set, the default "
+                     "parameters are used.")
+
+# Define the number of repetitions
+ap.add_argument("-r", "--repeat", required=False, type=int, default=3,
+                help="Number of times each benchmark is repeated. The fastest "
+                     "run is reported.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Load the input DataFrame, drop missing captions and preprocess the rest
+input_df = pd.read_pickle(args['input'])
+captions = [preprocess_caption(c, args['preprocessing'])
+            for c in input_df[inputcol]
+            if isinstance(c, str) and c != 'None']
+captions = [c for c in captions if c]
+
+# Set up the Punkt tokenizer
+load_sentence_tokenizer(args['sentence_params'])
+
+
+def benchmark(function):
+    """Times a sentence splitter over all captions.
+
+    Args:
+        function: The sentence splitter to benchmark.
+
+    Returns:
+        A tuple consisting of the sentences of each caption and the time taken
+        by the fastest run in seconds.
+    """
+    # Set up a list for the durations of each run
+    durations = []
+
+    # Repeat the benchmark
+    for _ in range(args['repeat']):
+        start = time.perf_counter()
+        output = [function(c) for c in captions]
+        durations.append(time.perf_counter() - start)
+
+    # Return the output and the fastest run
+    return output, min(durations)
+
+
+def boundaries(caption, sentences):
+    """Finds the positions at which a caption has been split into sentences.
+
+    Args:
+        caption: A string containing the caption.
+        sentences: A list of the sentences of the caption.
+
+    Returns:
+        A set containing the position of the end of each sentence except the
+        last one.
+    """
+    # Locate the sentences in the caption one after another
+    ends, position = set(), 0
+    for sentence in sentences:
+        position = caption.find(sentence, position) + len(sentence)
+        ends.add(position)
+
+    # Drop the end of the last sentence
+    ends.discard(position)
+    return ends
+
+
+def boundary_type(caption, position):
+    """Determines the kind of regular expression boundary at a position.
+
+    Args:
+        caption: A string containing the caption.
+        position: The position of the end of a sentence.
+
+    Returns:
+        A string indicating the kind of boundary.
+    """
+    # Check for line breaks, then terminal punctuation, otherwise emoji
+    if '\n' in FAST_SENTENCE_BOUNDARY.match(caption, position).group():
+        return 'line break'
+    return 'punctuation' if caption[position - 1] in '.?!…。！？' else 'emoji'
+
+
+# Benchmark both splitters
+punkt, punkt_time = benchmark(split_sentence)
+regex, regex_time = benchmark(split_sentence_regex)
+
+# Set up counters for identically split captions, for the boundaries found
+# by both splitters and by the regular expression only, by kind, and for the
+# boundaries found by Punkt only
+identical, shared, extra, missed = 0, Counter(), Counter(), 0
+
+# Compare the boundaries of each caption
+for caption, p, r in zip(captions, punkt, regex):
+    identical += p == r
+    p_ends, r_ends = boundaries(caption, p), boundaries(caption, r)
+    shared.update(boundary_type(caption, e) for e in r_ends & p_ends)
+    extra.update(boundary_type(caption, e) for e in r_ends - p_ends)
+    missed += len(p_ends - r_ends)
+
+# Print the results
+n_shared, n_extra = sum(shared.values()), sum(extra.values())
+print('[INFO] {} captions: Punkt {:.0f} captions/sec, regex {:.0f} '
+      'captions/sec, speedup {:.1f}x'
+      .format(len(captions), len(captions) / max(punkt_time, 1e-9),
+              len(captions) / max(regex_time, 1e-9),
+              punkt_time / max(regex_time, 1e-9)))
+print('[INFO] Punkt {} sentences, regex {} sentences, {:.2%} of captions '
+      'split identically'
+      .format(sum(map(len, punkt)), sum(map(len, regex)),
+              identical / max(len(captions), 1)))
+print('[INFO] Boundaries: {} shared, {} only Punkt, {} only regex, '
+      'precision {:.2%}, recall {:.2%}'
+      .format(n_shared, missed, n_extra,
+              n_shared / max(n_shared + n_extra, 1),
+              n_shared / max(n_shared + missed, 1)))
+
+# Print the boundaries found by each kind of boundary
+for kind in ['punctuation', 'line break', 'emoji']:
+    print('[INFO]   {}: {} shared, {} only regex'
+          .format(kind, shared[kind], extra[kind]))
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+This file contains a client for the language identification service started
+using run_service.py. The client and the service exchange JSON documents, one
+per line, over a Unix socket or a TCP connection to localhost.
+"""
+
+import json
+import socket
+
+
+def parse_address(address):
+    """Parses the address of the service.
+
+    Args:
+        address: Either a path to a Unix socket, e.g. '/tmp/langid.sock', or a
+                 host and port separated by a colon, e.g. 'localhost:8765'.
+
+    Returns:
+        A tuple consisting of the socket family and the address in the format
+        expected by the socket module.
+    """
+    # Treat addresses ending with a port number as TCP addresses
+    host, _, port = address.rpartition(':')
+    if host and '/' not in address and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+
+    # Otherwise use a Unix socket
+    return socket.AF_UNIX, address
+
+
+class ServiceClient(object):
+    """A client for the language identification service.
+
+    Args:
+        address: The address of the service, see parse_address().
+        request_size: The maximum number of captions sent in a single request.
+                      Larger inputs are split into several requests, so that
+                      the service can interleave them with requests from
+                      other clients.
+    """
+
+    def __init__(self, address, request_size=1000):
+
+        # Assign arguments to attributes
+        self.address = address
+        self.request_size = request_size
+
+        # Connect to the service
+        family, sockaddr = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(sockaddr)
+        self.stream = self.socket.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, message):
+        """Sends a request to the service and waits for the response.
+
+        Args:
+            message: A dictionary containing the request.
+
+        Returns:
+            A dictionary containing the response.
+        """
+        # Send the request
+        self.stream.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.stream.flush()
+
+        # Read the response
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError('Connection to the service at {} was closed'
+                                  .format(self.address))
+        response = json.loads(line.decode('utf-8'))
+
+        # Raise errors reported by the service
+        if 'error' in response:
+            raise RuntimeError('Service error: {}'.format(response['error']))
+
+        # Return the response
+        return response
+
+    def detect(self, captions, backend, preprocessing):
+        """Identifies the language of texts using the service.
+
+        Args:
+            captions: An iterable of strings containing UTF-8 encoded text.
+            backend: The language identification model: valid values include
+                     'fasttext' and 'langid'.
+            preprocessing: A string indicating the selected preprocessing
+                           strategy.
+
+        Returns:
+            A list with a prediction for each caption in the format returned by
+            detect_ft() or detect_li().
+        """
+        # Replace missing values, which cannot be encoded in JSON, with None
+        captions = [c if isinstance(c, str) else None for c in captions]
+
+        # Set up a list for the predictions
+        predictions = []
+
+        # Send the captions in chunks
+        for i in range(0, len(captions), self.request_size):
+            response = self.request({
+                'captions': captions[i:i + self.request_size],
+                'backend': backend,
+                'preprocessing': preprocessing})
+
+            # Convert the predictions back into tuples
+            predictions.extend(
+                None if p is None else [tuple(s) for s in p]
+                for p in response['predictions'])
+
+        # Return the predictions
+        return predictions
+
+    def stats(self):
+        """Retrieves the latency percentiles and throughput counters of the
+        service.
+
+        Returns:
+            A dictionary of statistics.
+        """
+        return self.request({'stats': True})['stats']
+
+    def close(self):
+        """Closes the connection to the service."""
+        self.stream.close()
+        self.socket.close()
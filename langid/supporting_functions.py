@@ -4,31 +4,449 @@
 This file contains supporting functions for automatic language identification.
 """
 
-from langid.langid import LanguageIdentifier, model
-from nltk.tokenize.punkt import PunktSentenceTokenizer
+from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktTrainer
+from collections import Counter
+from functools import partial
 from urllib.parse import urlparse
+import ast
 import emoji
-from pyfasttext import FastText
+from hashtag_segmentation import segment_hashtag, segmentation_loaded
+from prediction_cache import PredictionCache, hash_file, hash_string
+import glob
+import json
+import numpy as np
+import os
+import pandas as pd
+import pickle
 import re
 
-# Attempt to load the fastText language identification model
-try:
-    ft_model = FastText('models/lid.176.bin')
+# Define the path to the default fastText language identification model and
+# to the compressed model, which takes up less memory at a small cost in
+# accuracy
+FT_MODEL_PATH = 'models/lid.176.bin'
+FT_COMPRESSED_MODEL_PATH = 'models/lid.176.ftz'
 
-# Catch the error thrown by a missing model and provide additional instructions
-except ValueError:
-    exit("fastText language identification model not found! "
-         "Run ../utils/get_fasttext_modells -al.py to download the model."
-         )
+# The fastText model loaded by get_ft_model(), see set_ft_model_path()
+ft_model_path = FT_MODEL_PATH
 
-# Attempt to load langid.py model
-li_model = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+# The language identification models are loaded on first use, so that only
+# the model actually used takes up time and memory, see get_ft_model() and
+# get_li_model()
+ft_model = None
+li_model = None
+
+# The parameters of the langid.py model are converted into NumPy arrays for
+# batched prediction on first use, see get_li_arrays()
+li_arrays = None
+
+# The Punkt sentence tokenizer is initialized on first use, see
+# load_sentence_tokenizer()
+sentence_tokenizer = None
+
+# The sentence splitter used by split_sentence(), see set_sentence_splitter()
+sentence_splitter = 'punkt'
+
+# Number of captions split into sentences and classified as a whole, see
+# split_caption()
+splitter_calls = Counter()
+
+
+def set_ft_model_path(path):
+    """Selects the fastText model loaded by get_ft_model(), e.g. the compressed
+    model models/lid.176.ftz or any other model file. A model already loaded
+    in the current process is discarded.
+
+    Args:
+        path: Path to the fastText model file.
+    """
+    global ft_model, ft_model_path
+
+    # Set the path and discard the loaded model
+    ft_model_path = path
+    ft_model = None
+
+
+def get_ft_model():
+    """Loads the fastText language identification model on first use.
+
+    Returns:
+        The fastText model, which is shared by all functions in the process.
+    """
+    global ft_model
+
+    # Load the model if this has not been done yet
+    if ft_model is None:
+        from pyfasttext import FastText
+
+        # Attempt to load the fastText language identification model
+        try:
+            ft_model = FastText(ft_model_path)
+
+        # Catch the error thrown by a missing model and provide additional
+        # instructions
+        except ValueError:
+            exit("fastText language identification model not found at {}! "
+                 "Run ../utils/get_fasttext_model.py to download the model."
+                 .format(ft_model_path))
+
+    # Return the model
+    return ft_model
+
+
+def get_li_model():
+    """Loads the langid.py language identification model on first use.
+
+    Returns:
+        The langid.py model, which is shared by all functions in the process.
+    """
+    global li_model
+
+    # Load the model if this has not been done yet
+    if li_model is None:
+        from langid.langid import LanguageIdentifier, model
+
+        # Load langid.py model with normalized probabilities
+        li_model = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+
+    # Return the model
+    return li_model
+
+
+# Compile the regular expressions used for preprocessing once
+EMOJI_SHORTCODE = re.compile(r':(?<=:)([a-zA-Z0-9_\-&\'’]*)(?=:):')
+MENTION = re.compile(r'@\S+ *')
+HASHTAG = re.compile(r'#\S+ *')
+WORD_TOKEN = re.compile(r'(?<!\S)\S*\w\S*')
+HASH = re.compile(r'g*#')
+REPEATED_PUNCTUATION = re.compile(r'[?.!,_]+(?=[?.!,_])')
+
+# A possible sentence boundary for the Punkt tokenizer: a full stop, question
+# mark or exclamation mark that is followed by something other than further
+# such marks and whitespace at the end of the text
+SENTENCE_BOUNDARY = re.compile(r'[.?!](?![.?!]*\s*\Z)')
+
+
+def build_trie_pattern(strings):
+    """Compiles a regular expression that matches the longest of the given
+    strings at each position, like an alternation of the strings sorted by
+    length, but organizes the strings into a trie so that each character in
+    the text is only compared to the characters that may follow the current
+    prefix.
+
+    Args:
+        strings: An iterable of non-empty strings.
+
+    Returns:
+        A compiled regular expression.
+    """
+    # Build the trie, marking the end of each string with an empty key
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def to_pattern(node):
+        """Converts a node of the trie into a regular expression."""
+        # Collect characters that end a string without continuing it into a
+        # character class and convert the other branches recursively
+        leaves = [c for c, n in node.items() if c and list(n) == ['']]
+        branches = [re.escape(c) + to_pattern(n) for c, n in sorted(
+            node.items()) if c and list(n) != ['']]
+        if leaves:
+            branches.append(char_class(leaves))
+
+        # Join the branches; if a string may end here, make them optional, so
+        # that longer strings are tried first
+        pattern = '(?:' + '|'.join(branches) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    # Compile the pattern, starting with a lookahead for the first characters
+    # of the strings, which quickly skips the positions where no string starts
+    return re.compile('(?=' + char_class(trie) + ')' + to_pattern(trie))
+
+
+def char_class(chars):
+    """Builds a character class for a regular expression, collapsing runs of
+    consecutive characters into ranges. Ranges are much faster to match than
+    long lists of characters outside the Basic Multilingual Plane.
+
+    Args:
+        chars: An iterable of characters.
+
+    Returns:
+        A string containing the character class.
+    """
+    # Collect the runs of consecutive code points
+    runs = []
+    for code in sorted(set(ord(c) for c in chars)):
+        if runs and runs[-1][1] == code - 1:
+            runs[-1][1] = code
+        else:
+            runs.append([code, code])
+
+    # Return the character class
+    return '[' + ''.join(re.escape(chr(a)) if a == b else
+                         re.escape(chr(a)) + '-' + re.escape(chr(b))
+                         for a, b in runs) + ']'
+
+
+# Compile a pattern for removing emoji directly, without converting them into
+# shortcodes using emoji.demojize() and removing the shortcodes. The pattern
+# matches the same emoji as emoji.demojize(), including ZWJ sequences.
+EMOJI = build_trie_pattern(set(emoji.unicode_codes.EMOJI_UNICODE.values()))
+
+# Emoji whose shortcodes contain characters not matched by EMOJI_SHORTCODE,
+# e.g. ':Côte_d’Ivoire:', are left in the text as shortcodes. Captions with
+# these emoji, or with colons that may interact with the shortcodes, must be
+# preprocessed using emoji.demojize() to produce identical results.
+EMOJI_FALLBACK = build_trie_pattern(
+    [':'] + [e for e, code in emoji.UNICODE_EMOJI.items()
+             if not EMOJI_SHORTCODE.fullmatch(code)])
+
+# A sentence boundary for the regular expression sentence splitter, see
+# split_sentence_regex(): whitespace following terminal punctuation or the
+# last character of an emoji, or any whitespace containing a line break. The
+# emoji are matched by their last character, which is never an ASCII
+# character, so that the lookbehind has a fixed width. The lookahead for
+# whitespace rejects most positions before the large character class of the
+# lookbehind is tried.
+FAST_SENTENCE_BOUNDARY = re.compile(
+    r'(?=\s)(?:(?<=' + char_class('.?!…。！？' + ''.join(
+        e[-1] for e in emoji.unicode_codes.EMOJI_UNICODE.values())) +
+    r')\s+|\s*\n\s*)')
+
+# The characters that may precede a boundary in ASCII text. Emoji and the
+# other terminal punctuation are never ASCII, so ASCII captions without these
+# characters consist of a single sentence, see split_sentence_regex().
+ASCII_SENTENCE_BOUNDARY = re.compile(r'[.?!\n]')
+
+# Define the available sentence splitters, see set_sentence_splitter()
+SENTENCE_SPLITTERS = ['punkt', 'regex']
+
+# Define Unicode blocks for scripts that are used almost exclusively for
+# writing a single language, and blocks for characters that do not belong to
+# any script, such as digits, punctuation, symbols and emoji. The start of the
+# block is inclusive and the end exclusive. Characters outside these blocks
+# are counted as letters of other scripts, e.g. Latin, Cyrillic or Han.
+SCRIPT_BLOCKS = [(0x0370, 0x0400, 'el'),  # Greek and Coptic
+                 (0x1F00, 0x2000, 'el'),  # Greek Extended
+                 (0x0530, 0x0590, 'hy'),  # Armenian
+                 (0x0590, 0x0600, 'he'),  # Hebrew
+                 (0x0E00, 0x0E80, 'th'),  # Thai
+                 (0x10A0, 0x1100, 'ka'),  # Georgian
+                 (0x1100, 0x1200, 'ko'),  # Hangul Jamo
+                 (0x3130, 0x3190, 'ko'),  # Hangul Compatibility Jamo
+                 (0xAC00, 0xD7B0, 'ko'),  # Hangul Syllables
+                 (0x3040, 0x30A0, 'ja'),  # Hiragana
+                 (0x30A0, 0x3100, 'ja'),  # Katakana
+                 (0x0000, 0x0041, None),  # ASCII digits and punctuation
+                 (0x005B, 0x0061, None),  # ASCII punctuation
+                 (0x007B, 0x00C0, None),  # Latin-1 punctuation and symbols
+                 (0x0300, 0x0370, None),  # Combining diacritical marks
+                 (0x2000, 0x2C00, None),  # Punctuation, symbols and arrows
+                 (0x3000, 0x3040, None),  # CJK symbols and punctuation
+                 (0xFE00, 0xFE10, None),  # Variation selectors
+                 (0xFF01, 0xFF21, None),  # Fullwidth digits and punctuation
+                 (0x1F000, 0x1FB00, None),  # Emoji and pictographs
+                 (0xE0000, 0xE0080, None)]  # Tags used in flag emoji
+
+# Define the languages identified using scripts
+SCRIPT_LANGUAGES = sorted(set(b[2] for b in SCRIPT_BLOCKS if b[2] is not None))
+
+
+def build_script_table(blocks):
+    """Builds a lookup table for mapping code points to scripts.
+
+    Args:
+        blocks: A list of (start, end, language) tuples, where language is
+                None for characters that do not belong to any script.
+
+    Returns:
+        A tuple of two NumPy arrays. The first array contains the code points
+        at which each interval of the table begins; the second contains the
+        category of each interval: 0 for letters of other scripts, 1 for
+        characters without a script and 2 + n for the nth language in
+        SCRIPT_LANGUAGES.
+    """
+    # Get the boundaries of all blocks, beginning from the first code point
+    edges = sorted(set([0] + [b[0] for b in blocks] + [b[1] for b in blocks]))
+
+    # Assign each interval between the boundaries to a category
+    categories = np.zeros(len(edges), dtype=np.int64)
+    for start, end, language in blocks:
+        category = 1 if language is None \
+            else 2 + SCRIPT_LANGUAGES.index(language)
+        categories[edges.index(start):edges.index(end)] = category
+
+    # Return the lookup table
+    return np.array(edges, dtype=np.uint32), categories
+
+
+# Build the lookup table for scripts once
+SCRIPT_EDGES, SCRIPT_CATEGORIES = build_script_table(SCRIPT_BLOCKS)
+
+
+# Define the preprocessing strategies
+PREPROCESSING_STRATEGIES = ['no_preprocessing', 'rm_all', 'rm_trail']
 
 
 # Define the preprocessing function
 def preprocess_caption(row, mode):
     """Applies the selected preprocessing steps to the text.
 
+    This function produces the same output as preprocess_caption_reference(),
+    but uses precompiled patterns and tokenizes the text in a single pass
+    instead of filtering the tokens in several list comprehensions.
+
+     Args:
+         row: A UTF-8 string.
+         mode: A string indicating the selected preprocessing strategy.
+               Valid values include: 'no_preprocessing' (no preprocessing),
+               'rm_all' (remove all hashtags) and 'rm_trail' (remove trailing
+               hashtags).
+
+     Returns:
+         A string containing the preprocessed text.
+    """
+    # Check if preprocessing has been requested.
+    if mode != 'no_preprocessing':
+
+        # Remove emoji and mentions
+        row = remove_emoji_and_mentions(row)
+
+    # Apply the remaining steps of the selected strategy
+    return clean_text(row, mode)
+
+
+def preprocess_caption_strategies(row, modes=PREPROCESSING_STRATEGIES):
+    """Applies several preprocessing strategies to the text, sharing the steps
+    common to the strategies.
+
+     Args:
+         row: A UTF-8 string.
+         modes: A list of preprocessing strategies, see preprocess_caption().
+
+     Returns:
+         A dictionary mapping each strategy to the preprocessed text, which is
+         identical to the output of preprocess_caption().
+    """
+    # Remove emoji and mentions once for all strategies that require it
+    if any(mode != 'no_preprocessing' for mode in modes):
+        cleaned = remove_emoji_and_mentions(row)
+
+    # Apply the remaining steps of each strategy and return the results
+    return {mode: clean_text(row if mode == 'no_preprocessing' else cleaned,
+                             mode)
+            for mode in modes}
+
+
+def remove_emoji_and_mentions(row):
+    """Removes emoji and mentions from the text. These are the first steps of
+    the preprocessing strategies 'rm_all' and 'rm_trail'.
+
+     Args:
+         row: A UTF-8 string.
+
+     Returns:
+         A string without emoji and mentions.
+    """
+    # Remove all emoji and mentions (@) in the caption
+    return MENTION.sub('', remove_emoji(row))
+
+
+def remove_emoji(row):
+    """Removes emoji from the text.
+
+    The emoji are removed directly using a precompiled pattern, unless the text
+    contains colons or emoji with unusual shortcodes, which require converting
+    the emoji into shortcodes and removing the shortcodes, see EMOJI_FALLBACK.
+    Both ways produce identical results.
+
+     Args:
+         row: A UTF-8 string.
+
+     Returns:
+         A string without emoji.
+    """
+    # Check if the text must be processed using emoji.demojize()
+    if EMOJI_FALLBACK.search(row):
+
+        # Convert unicode emoji to shortcode emoji and remove single emojis
+        # and their groups
+        return EMOJI_SHORTCODE.sub('', emoji.demojize(row))
+
+    # Otherwise remove the emoji directly
+    return EMOJI.sub('', row)
+
+
+def clean_text(row, mode):
+    """Applies the steps of a preprocessing strategy that follow the removal of
+    emoji and mentions, see preprocess_caption().
+
+     Args:
+         row: A UTF-8 string, from which emoji and mentions have been removed
+              unless mode is 'no_preprocessing'.
+         mode: A string indicating the selected preprocessing strategy.
+
+     Returns:
+         A string containing the preprocessed text.
+    """
+    # Check if preprocessing has been requested.
+    if mode != 'no_preprocessing':
+
+        # If mode is 'rm_all', remove all hashtags (#) in the caption
+        if mode == 'rm_all':
+            row = HASHTAG.sub('', row)
+
+        # Split the string into a list of tokens, keeping only tokens that
+        # contain at least one word character. This removes non-words such
+        # as smileys etc. :-)
+        row = WORD_TOKEN.findall(row)
+
+        # Check the list of items for URLs and remove them. A URL scheme is
+        # always followed by a colon, so only parse the tokens if the text
+        # contains one.
+        if any(':' in word for word in row):
+            row = [word for word in row if not urlparse(word).scheme]
+
+        # If mode is 'rm_trail', remove hashtags trailing the text, e.g.
+        # "This is the caption and here are #my #hashtags". If hashtags are
+        # segmented, keep captions that consist only of hashtags.
+        if mode == 'rm_trail' and (not segmentation_loaded() or not all(
+                word.startswith('#') for word in row)):
+            while len(row) != 0 and row[-1].startswith('#'):
+                row.pop()
+
+        # If mode is 'rm_trail', split the remaining hashtags into words, if
+        # word frequencies have been loaded
+        if mode == 'rm_trail' and segmentation_loaded():
+            row = [segment_hashtag(word) if '#' in word else word
+                   for word in row]
+
+        # Reconstruct the row
+        row = ' '.join(row)
+
+        # If mode is 'rm_trail', drop hashes from any remaining hashtags
+        if mode == 'rm_trail':
+            row = HASH.sub('', row)
+
+    # Simplify punctuation, removing sequences of exclamation and question
+    # marks, commas and full stops, saving only the final character
+    row = REPEATED_PUNCTUATION.sub('', row)
+
+    # Return the preprocessed row
+    return row
+
+
+# Define the original preprocessing function
+def preprocess_caption_reference(row, mode):
+    """Applies the selected preprocessing steps to the text.
+
+    This is the original, unoptimized implementation of preprocess_caption(),
+    which is kept for verifying and benchmarking the compiled version.
+
      Args:
          row: A UTF-8 string.
          mode: A string indicating the selected preprocessing strategy.
@@ -64,7 +482,7 @@ def preprocess_caption(row, mode):
         row = row.split()
 
         # Remove all non-words such as smileys etc. :-)
-        row = [word for word in row if re.sub('\W', '', word)]
+        row = [word for word in row if re.sub(r'\W', '', word)]
 
         # Check the list of items for URLs and remove them
         row = [word for word in row if not urlparse(word).scheme]
@@ -93,8 +511,120 @@ def preprocess_caption(row, mode):
     return row
 
 
+def load_sentence_tokenizer(params=None):
+    """Sets up the Punkt sentence tokenizer shared by all functions in the
+    current process.
+
+    Args:
+        params: Path to a file containing Punkt parameters saved by
+                train_sentence_tokenizer(). If None, the tokenizer uses the
+                default parameters.
+
+    Returns:
+        The shared PunktSentenceTokenizer.
+    """
+    global sentence_tokenizer
+
+    # Check if trained parameters have been provided
+    if params is not None:
+
+        # Load the parameters and initialize the tokenizer using them
+        with open(params, 'rb') as f:
+            sentence_tokenizer = PunktSentenceTokenizer(pickle.load(f))
+
+    else:
+        # Initialize the tokenizer with default parameters
+        sentence_tokenizer = PunktSentenceTokenizer()
+
+    # Return the tokenizer
+    return sentence_tokenizer
+
+
+def train_sentence_tokenizer(captions, output):
+    """Trains Punkt parameters on a sample of captions and saves them to disk.
+
+    The captions should be preprocessed using the same strategy as the texts
+    that will be split, so that the parameters reflect e.g. the emoji and
+    abbreviations that remain in the text.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        output: Path to the file to which the parameters are saved.
+
+    Returns:
+        The trained PunktParameters.
+    """
+    # Initialize the trainer
+    trainer = PunktTrainer()
+
+    # Loop over the captions and collect statistics without finalizing
+    for caption in captions:
+        trainer.train(caption, finalize=False)
+
+    # Determine the abbreviations, collocations and sentence starters
+    trainer.finalize_training()
+    params = trainer.get_params()
+
+    # Save the parameters to disk
+    with open(output, 'wb') as f:
+        pickle.dump(params, f)
+
+    # Return the parameters
+    return params
+
+
+def set_sentence_splitter(name):
+    """Selects the sentence splitter used by split_sentence() in the current
+    process and in worker processes started afterwards.
+
+    Args:
+        name: A string indicating the sentence splitter. Valid values include
+              'punkt' (NLTK's Punkt tokenizer) and 'regex' (a single regular
+              expression, see split_sentence_regex()).
+    """
+    global sentence_splitter
+
+    # Check that the splitter exists
+    if name not in SENTENCE_SPLITTERS:
+        raise ValueError('Unknown sentence splitter: {}'.format(name))
+
+    # Store the selected splitter
+    sentence_splitter = name
+
+
+def split_sentence_regex(caption):
+    """Splits a caption into sentences using a single precompiled pattern.
+
+    The caption is split at whitespace following a full stop, question mark,
+    exclamation mark, ellipsis or emoji, and at line breaks. Unlike Punkt,
+    the pattern does not recognize abbreviations and splits captions into
+    the segments delimited by emoji. Whether it is faster than Punkt depends
+    on the data, see sentence_splitter_report.py.
+
+    Args:
+        caption: A string containing UTF-8 encoded text.
+
+    Returns:
+        A list of tokens (sentences).
+    """
+    # Remove surrounding whitespace
+    caption = caption.strip()
+
+    # Return ASCII captions without a possible boundary as they are
+    if caption.isascii() and not ASCII_SENTENCE_BOUNDARY.search(caption):
+        return [caption] if caption else []
+
+    # Split the caption and drop empty segments
+    return [s for s in FAST_SENTENCE_BOUNDARY.split(caption) if s]
+
+
 def split_sentence(caption):
-    """Tokenizes sentences using NLTK's Punkt tokenizer.
+    """Tokenizes sentences using the selected sentence splitter, by default
+    NLTK's Punkt tokenizer.
+
+    The tokenizer is initialized once per process. To use trained parameters,
+    call load_sentence_tokenizer() before splitting any sentences. To use
+    the regular expression splitter, call set_sentence_splitter().
 
     Args:
         caption: A string containing UTF-8 encoded text.
@@ -102,103 +632,1551 @@ def split_sentence(caption):
     Returns:
         A list of tokens (sentences).
     """
+    # Use the regular expression splitter, if selected
+    if sentence_splitter == 'regex':
+        return split_sentence_regex(caption)
 
-    # Initialize the sentence tokenizer
-    tokenizer = PunktSentenceTokenizer()
+    # Initialize the sentence tokenizer on first use
+    if sentence_tokenizer is None:
+        load_sentence_tokenizer()
 
-    # Tokenize the caption
-    sent_tokens = tokenizer.tokenize(caption)
+    # Tokenize the caption and return a list of tokens (sentences)
+    return sentence_tokenizer.tokenize(caption)
 
-    # Return a list of tokens (sentences)
-    return sent_tokens
 
+def split_caption(caption, caption_level=None):
+    """Splits a caption into sentences, unless the caption is classified as a
+    whole.
 
-def detect_ft(caption, preprocessing):
-    """Identifies the language of a text using fastText.
+    Punkt only breaks sentences at full stops, question marks and exclamation
+    marks. Captions without such a mark followed by more text therefore
+    consist of a single sentence, which is returned without calling the
+    tokenizer. This gives the same sentences as split_sentence(). If the
+    regular expression splitter is selected, its own boundaries are checked
+    instead.
+
+    The calls are counted in splitter_calls, see splitter_report().
 
     Args:
         caption: A string containing UTF-8 encoded text.
+        caption_level: If set, captions without a possible sentence boundary
+                       and captions shorter than this number of characters
+                       are classified as a whole without calling the
+                       tokenizer. If None, all captions are split.
+
+    Returns:
+        A list of tokens (sentences).
+    """
+    # Select the pattern for possible boundaries of the selected splitter
+    boundary = (FAST_SENTENCE_BOUNDARY if sentence_splitter == 'regex'
+                else SENTENCE_BOUNDARY)
+
+    # Check if the caption can be classified as a whole
+    if caption_level is not None and (len(caption) < caption_level or
+                                      not boundary.search(caption.strip())):
+        splitter_calls['skipped'] += 1
+
+        # Remove whitespace, as done by the selected splitter
+        caption = (caption.strip() if sentence_splitter == 'regex'
+                   else caption.rstrip())
+        return [caption] if caption else []
+
+    # Otherwise split the caption into sentences
+    splitter_calls['split'] += 1
+    return split_sentence(caption)
+
+
+def splitter_report():
+    """Summarizes the number of captions split into sentences and the number
+    of calls to the sentence tokenizer saved by classifying captions as a
+    whole, see split_caption().
+
+    Returns:
+        A string with the counts.
+    """
+    # Calculate the share of calls saved
+    total = splitter_calls['split'] + splitter_calls['skipped']
+    return ('{} captions split into sentences, {} classified as a whole, '
+            'saving {:.1%} of sentence tokenizer calls'
+            .format(splitter_calls['split'], splitter_calls['skipped'],
+                    splitter_calls['skipped'] / max(total, 1)))
+
+
+def prepare_captions(captions, preprocessing, caption_level=None):
+    """Preprocesses and sentence-splits a sequence of captions.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
         preprocessing: A string indicating the selected preprocessing strategy.
                        Valid values include: 'no_preprocessing'
                        (no preprocessing),  'rm_all' (remove all hashtags) and
                        'rm_trail' (remove trailing hashtags).
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
 
     Returns:
-        Saves the prediction into a column named 'langid' in the pandas
-        DataFrame as a list of three tuples. The three tuple consists of an
-        ISO-639 code, its associated probability and character length of the
-        string input to fastText, e.g. ('en', 0.99999, 21).
+        A tuple of two lists. The first list contains the sentences of all
+        captions flattened into a single list. The second list contains a
+        (start, stop) tuple for each caption, which gives the position of its
+        sentences in the first list, or None if the caption has no text left
+        to classify.
     """
-    # If the caption is None, return None
-    if caption == 'None' or caption is None:
-        return
+    # Set up lists for the flattened sentences and the span of each caption
+    sentences, spans = [], []
 
-    # Preprocess the caption
-    caption = preprocess_caption(caption, preprocessing)
+    # Loop over the captions
+    for caption in captions:
 
-    # Perform sentence splitting for any remaining text
-    if len(caption) == 0:
-        return None
+        # If the caption is None or missing, e.g. NaN in a CSV file, there is
+        # nothing to classify
+        if caption == 'None' or not isinstance(caption, str):
+            spans.append(None)
+            continue
+
+        # Preprocess the caption
+        caption = preprocess_caption(caption, preprocessing)
+
+        # Skip captions that are empty after preprocessing
+        if len(caption) == 0:
+            spans.append(None)
+            continue
 
-    else:
         # Get sentences
-        sentences = split_sentence(caption)
+        caption_sentences = split_caption(caption, caption_level)
 
-        # Calculate the character length of each sentence
-        char_len = [len(s) for s in sentences]
+        # Store the position of the sentences in the flattened list
+        spans.append((len(sentences), len(sentences) + len(caption_sentences)))
+        sentences.extend(caption_sentences)
 
-        # Make predictions
-        predictions = ft_model.predict_proba(sentences, k=1, normalized=True)
+    # Return the flattened sentences and their spans
+    return sentences, spans
 
-        # Get the predicted languages and their probabilities
-        languages = [[elem[0] for elem in p] for p in predictions]
-        probabilities = [[elem[1] for elem in p] for p in predictions]
 
-        # Return languages and probabilities
-        return list(zip(*languages, *probabilities, char_len))
+def prepare_captions_strategies(captions, modes=PREPROCESSING_STRATEGIES,
+                                caption_level=None):
+    """Preprocesses and sentence-splits a sequence of captions using several
+    preprocessing strategies at once.
 
+    The steps shared by the strategies are applied only once to each caption.
+    If several strategies produce the same text, the text is split only once
+    and its sentences are shared by the strategies.
 
-def detect_li(caption, preprocessing):
-    """Identifies the language of a text using langid.py.
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        modes: A list of preprocessing strategies, see preprocess_caption().
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A tuple consisting of a list of sentences and a dictionary, which maps
+        each strategy to a list of spans in the format returned by
+        prepare_captions().
+    """
+    # Set up lists for the flattened sentences and the spans of each strategy
+    sentences, spans = [], {mode: [] for mode in modes}
+
+    # Loop over the captions
+    for caption in captions:
+
+        # If the caption is None or missing, there is nothing to classify
+        if caption == 'None' or not isinstance(caption, str):
+            for mode in modes:
+                spans[mode].append(None)
+            continue
+
+        # Set up a dictionary for the spans of texts already split
+        split = {}
+
+        # Preprocess the caption using each strategy
+        for mode, text in preprocess_caption_strategies(caption,
+                                                        modes).items():
+
+            # Split texts that have not been split for another strategy
+            if text and text not in split:
+                caption_sentences = split_caption(text, caption_level)
+                split[text] = (len(sentences),
+                               len(sentences) + len(caption_sentences))
+                sentences.extend(caption_sentences)
+
+            # Store the span, skipping captions that are empty after
+            # preprocessing
+            spans[mode].append(split[text] if text else None)
+
+    # Return the flattened sentences and their spans
+    return sentences, spans
+
+
+def assemble_predictions(sentences, spans, languages, probabilities):
+    """Maps sentence-level predictions back to the captions they came from.
 
     Args:
-        caption: A string containing UTF-8 encoded text.
-        preprocessing: A string indicating the selected preprocessing strategy.
-                       Valid values include: 'no_preprocessing'
-                       (no preprocessing),  'rm_all' (remove all hashtags) and
-                       'rm_trail' (remove trailing hashtags).
+        sentences: A list of sentences returned by prepare_captions().
+        spans: A list of spans returned by prepare_captions().
+        languages: A list of ISO-639 codes, one for each sentence.
+        probabilities: A list of probabilities, one for each sentence.
 
     Returns:
-        Saves the prediction into a column named 'langid' in the pandas
-        DataFrame as a list of three tuples. The three tuple consists of an
-        ISO-639 code, its associated probability and character length of the
-        string input to fastText, e.g. ('en', 0.99999, 21).
+        A list with a prediction for each caption. A prediction is either None
+        or a list of three tuples, e.g. [('en', 0.99999, 21)], as returned by
+        detect_ft() and detect_li().
     """
-    # If the caption is None, return None
-    if caption == 'None' or caption is None:
-        return
+    # Set up a list to hold the predictions for each caption
+    predictions = []
+
+    # Loop over the spans
+    for span in spans:
+
+        # Captions without text have no predictions
+        if span is None:
+            predictions.append(None)
+            continue
 
-    # Preprocess the caption
-    caption = preprocess_caption(caption, preprocessing)
+        # Zip the languages, probabilities and character lengths of each
+        # sentence in the caption into three tuples
+        start, stop = span
+        predictions.append(list(zip(languages[start:stop],
+                                    probabilities[start:stop],
+                                    [len(s) for s in sentences[start:stop]])))
 
-    # Perform sentence splitting for any remaining text
-    if len(caption) == 0:
-        return None
+    # Return the predictions
+    return predictions
 
+
+def open_cache(path, backend, preprocessing, max_entries=10000000):
+    """Opens a persistent prediction cache for a language identification model.
+
+    Args:
+        path: Path to the SQLite database holding the cache.
+        backend: The language identification model: valid values include
+                 'fasttext' and 'langid'.
+        preprocessing: A string indicating the selected preprocessing strategy.
+        max_entries: The maximum number of predictions kept in the cache.
+
+    Returns:
+        A PredictionCache, whose predictions are tied to the current version
+        of the model.
+    """
+    # Hash the fastText model file or the serialized langid.py model
+    if backend == 'fasttext':
+        model_hash = hash_file(ft_model_path)
     else:
-        # Get sentences
-        sentences = split_sentence(caption)
+        from langid.langid import model
+        model_hash = hash_string(model)
 
-        # Calculate the character length of each sentence
-        char_len = [len(s) for s in sentences]
+    # Return the cache
+    return PredictionCache(path, backend, model_hash, preprocessing,
+                           max_entries)
+
+
+def predict_with_cache(sentences, predict, cache=None, **kwargs):
+    """Predicts the language of sentences, retrieving cached predictions and
+    adding new predictions to the cache.
+
+    Each unique sentence is only passed to the model once.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        predict: The function used for making predictions, e.g. predict_ft().
+        cache: A PredictionCache. If None, all sentences are passed directly
+               to the predict function.
+        **kwargs: Keyword arguments passed to the predict function.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities.
+    """
+    # Make predictions directly if no cache has been defined
+    if cache is None:
+        return predict(sentences, **kwargs)
+
+    # Get the unique sentences while retaining their order
+    unique = list(dict.fromkeys(sentences))
+
+    # Retrieve the cached predictions
+    predictions = cache.lookup(unique)
+
+    # Make predictions for the sentences not found in the cache and add them
+    # to the cache
+    missing = [s for s in unique if s not in predictions]
+    languages, probabilities = predict(missing, **kwargs)
+    cache.store(missing, languages, probabilities)
+    predictions.update(zip(missing, zip(languages, probabilities)))
+
+    # Return languages and probabilities for each sentence
+    return ([predictions[s][0] for s in sentences],
+            [predictions[s][1] for s in sentences])
+
+
+def detect_scripts(sentences, threshold=0.9):
+    """Identifies sentences written in a script used by a single language.
+
+    The function counts the letters of each script in all sentences at once
+    using NumPy. Characters without a script, such as digits, punctuation and
+    emoji, are ignored.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        threshold: The minimum share of letters that must belong to a script
+                   for the sentence to be assigned to its language.
+
+    Returns:
+        A tuple of two lists, which contain an ISO-639 code and the share of
+        letters in the corresponding script for each sentence. Both values are
+        None for sentences that could not be assigned to a language.
+    """
+    # Get the number of sentences and categories
+    n, k = len(sentences), len(SCRIPT_LANGUAGES) + 2
+
+    # Return empty lists if there are no sentences
+    if n == 0:
+        return [], []
+
+    # Convert all sentences into a single array of code points and get the
+    # index of the sentence that each code point belongs to
+    code_points = np.frombuffer(''.join(sentences).encode('utf-32-le'),
+                                dtype='<u4')
+    lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=n)
+    index = np.repeat(np.arange(n), lengths)
+
+    # Look up the category of each code point
+    categories = SCRIPT_CATEGORIES[np.searchsorted(SCRIPT_EDGES, code_points,
+                                                   side='right') - 1]
+
+    # Count the code points in each category for each sentence
+    histogram = np.bincount(index * k + categories,
+                            minlength=n * k).reshape(n, k)
+
+    # Count the letters, ignoring characters without a script
+    letters = histogram.sum(axis=1) - histogram[:, 1]
+
+    # Get the language with most letters and calculate its share of letters
+    best = histogram[:, 2:].argmax(axis=1)
+    share = histogram[np.arange(n), best + 2] / np.maximum(letters, 1)
+
+    # Assign languages to sentences that exceed the threshold
+    assigned = (letters > 0) & (share >= threshold)
+    languages = [SCRIPT_LANGUAGES[b] if a else None
+                 for a, b in zip(assigned, best)]
+    probabilities = [float(p) if a else None
+                     for a, p in zip(assigned, share)]
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def assign_without_model(sentences, threshold=None, min_chars=None):
+    """Assigns languages to sentences based on their script and marks short
+    sentences as undetermined, without calling a language identification
+    model.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        threshold: The minimum share of letters in a single-language script,
+                   see detect_scripts(). If None, no languages are assigned
+                   based on scripts.
+        min_chars: The minimum number of characters in a sentence passed to
+                   a model. Shorter sentences are recorded as undetermined
+                   ('und') with probability 0.0. If None, no sentences are
+                   skipped.
+
+    Returns:
+        A tuple of two lists, which contain an ISO-639 code and a probability
+        for each sentence. Both values are None for sentences that must be
+        passed to a model.
+    """
+    # Assign languages based on scripts
+    if threshold is not None:
+        languages, probabilities = detect_scripts(sentences, threshold)
+    else:
+        languages, probabilities = [None] * len(sentences), \
+            [None] * len(sentences)
+
+    # Mark sentences that are too short to be kept in the analyses as
+    # undetermined, as their predictions would be discarded anyway
+    if min_chars:
+        for i, sentence in enumerate(sentences):
+            if len(sentence) < min_chars:
+                languages[i], probabilities[i] = 'und', 0.0
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def predict_with_scripts(sentences, predict, threshold=None, min_chars=None):
+    """Assigns languages to sentences based on their script and skips short
+    sentences, passing only the remaining sentences to a language
+    identification model.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        predict: A function that takes a list of sentences and returns their
+                 languages and probabilities, e.g. predict_ft().
+        threshold: The minimum share of letters in a single-language script,
+                   see detect_scripts(). If None, no languages are assigned
+                   based on scripts.
+        min_chars: The minimum number of characters in a sentence passed to
+                   the predict function. Shorter sentences are recorded as
+                   undetermined ('und') with probability 0.0. If None, no
+                   sentences are skipped.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities. For sentences assigned using their script, the
+        probability is the share of letters in the script.
+    """
+    # Pass all sentences to the model if the cascade is not used
+    if threshold is None and not min_chars:
+        return predict(sentences)
+
+    # Assign languages based on scripts and skip short sentences
+    languages, probabilities = assign_without_model(sentences, threshold,
+                                                    min_chars)
+
+    # Get the sentences that could not be assigned
+    missing = [i for i, lang in enumerate(languages) if lang is None]
+
+    # Make predictions for the remaining sentences using the model
+    predictions = predict([sentences[i] for i in missing])
+
+    # Merge the predictions
+    for i, lang, prob in zip(missing, *predictions):
+        languages[i], probabilities[i] = lang, prob
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def predict_ft(sentences, batch_size=None):
+    """Predicts the language of sentences using fastText.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        batch_size: An integer defining the maximum number of sentences passed
+                    to fastText at once. If None, all sentences are passed in
+                    a single call.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities.
+    """
+    # Set up lists for languages and probabilities
+    languages, probabilities = [], []
+
+    # Pass all sentences at once if no batch size has been defined
+    if not batch_size:
+        batch_size = max(len(sentences), 1)
+
+    # Get the model
+    ft_model = get_ft_model()
+
+    # Loop over the sentences in batches
+    for i in range(0, len(sentences), batch_size):
 
         # Make predictions
-        predictions = [li_model.classify(sent) for sent in sentences]
-            
+        predictions = ft_model.predict_proba(sentences[i:i + batch_size], k=1,
+                                             normalized=True)
+
         # Get the predicted languages and their probabilities
-        languages = [p[0] for p in predictions]
-        probabilities = [p[1] for p in predictions]
+        languages.extend(p[0][0] for p in predictions)
+        probabilities.extend(p[0][1] for p in predictions)
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def detect_ft(caption, preprocessing, cache=None, script_threshold=None,
+              min_chars=None, caption_level=None):
+    """Identifies the language of a text using fastText.
+
+    Args:
+        caption: A string containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        cache: An optional PredictionCache returned by open_cache().
+        script_threshold: If set, sentences in which this share of letters
+                          belongs to a script used by a single language are
+                          assigned to that language without calling fastText,
+                          see detect_scripts().
+        min_chars: If set, sentences shorter than this number of characters
+                   are recorded as undetermined without calling fastText, see
+                   predict_with_scripts().
+        caption_level: If set, captions without a possible sentence boundary
+                       and captions shorter than this number of characters
+                       are classified as a whole without splitting them into
+                       sentences, see split_caption().
+
+    Returns:
+        Saves the prediction into a column named 'langid' in the pandas
+        DataFrame as a list of three tuples. The three tuple consists of an
+        ISO-639 code, its associated probability and character length of the
+        string input to fastText, e.g. ('en', 0.99999, 21). Each sentence of
+        the caption has its own tuple, see README.md for how this differs from
+        earlier versions.
+    """
+    # Classify the caption as a batch of one
+    return detect_ft_batch([caption], preprocessing, cache=cache,
+                           script_threshold=script_threshold,
+                           min_chars=min_chars,
+                           caption_level=caption_level)[0]
+
+
+def detect_ft_batch(captions, preprocessing, batch_size=None, cache=None,
+                    script_threshold=None, min_chars=None,
+                    caption_level=None):
+    """Identifies the language of multiple texts using fastText.
+
+    Unlike detect_ft(), which calls fastText separately for each caption, this
+    function preprocesses and splits all captions first and then passes the
+    sentences to fastText in large batches.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        batch_size: An integer defining the maximum number of sentences passed
+                    to fastText at once.
+        cache: An optional PredictionCache returned by open_cache().
+        script_threshold: An optional threshold for assigning languages based
+                          on scripts, see detect_scripts().
+        min_chars: An optional minimum number of characters in sentences
+                   passed to the model, see predict_with_scripts().
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A list with a prediction for each caption in the format returned by
+        detect_ft().
+    """
+    # Preprocess the captions and get their sentences
+    sentences, spans = prepare_captions(captions, preprocessing,
+                                        caption_level)
+
+    # Make predictions, passing only sentences that cannot be identified using
+    # their script to fastText or the cache
+    languages, probabilities = predict_with_scripts(
+        sentences, partial(predict_with_cache, predict=predict_ft, cache=cache,
+                           batch_size=batch_size), script_threshold, min_chars)
+
+    # Return the predictions for each caption
+    return assemble_predictions(sentences, spans, languages, probabilities)
+
+
+def detect_ft_strategies(captions, modes=PREPROCESSING_STRATEGIES,
+                         batch_size=None, cache=None, script_threshold=None,
+                         min_chars=None, caption_level=None):
+    """Identifies the language of multiple texts using fastText and several
+    preprocessing strategies at once.
+
+    The texts are preprocessed using all strategies in a single pass, after
+    which the sentences of all strategies are passed to fastText together.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        modes: A list of preprocessing strategies, see preprocess_caption().
+        batch_size: An integer defining the maximum number of sentences passed
+                    to fastText at once.
+        cache: An optional PredictionCache returned by open_cache().
+        script_threshold: An optional threshold for assigning languages based
+                          on scripts, see detect_scripts().
+        min_chars: An optional minimum number of characters in sentences
+                   passed to the model, see predict_with_scripts().
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A dictionary mapping each strategy to a list with a prediction for
+        each caption in the format returned by detect_ft().
+    """
+    # Preprocess the captions and get their sentences for all strategies
+    sentences, spans = prepare_captions_strategies(captions, modes,
+                                                   caption_level)
+
+    # Make predictions for the sentences of all strategies at once
+    languages, probabilities = predict_with_scripts(
+        sentences, partial(predict_with_cache, predict=predict_ft, cache=cache,
+                           batch_size=batch_size), script_threshold, min_chars)
+
+    # Return the predictions for each strategy
+    return {mode: assemble_predictions(sentences, spans[mode], languages,
+                                       probabilities)
+            for mode in modes}
+
+
+def count_sentences(predictions):
+    """Counts the number of sentences classified for a set of captions.
+
+    Args:
+        predictions: An iterable of predictions returned by detect_ft() or
+                     detect_li().
+
+    Returns:
+        An integer giving the total number of sentences.
+    """
+    return sum(len(p) for p in predictions if p)
+
+
+def predict_li(sentences):
+    """Predicts the language of sentences using langid.py.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities.
+    """
+    # Get the model
+    li_model = get_li_model()
+
+    # Make predictions
+    predictions = [li_model.classify(sent) for sent in sentences]
+
+    # Get the predicted languages and their probabilities
+    languages = [p[0] for p in predictions]
+    probabilities = [p[1] for p in predictions]
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def get_li_arrays():
+    """Converts the parameters of the langid.py model into NumPy arrays for
+    the vectorized engine on first use, see predict_li_vectorized().
+
+    Returns:
+        A dictionary of NumPy arrays, which contains the transitions of the
+        byte n-gram automaton, the features produced in each state of the
+        automaton in compressed sparse row format and the class
+        log-probabilities of the model.
+    """
+    global li_arrays
+
+    # Convert the parameters if this has not been done yet
+    if li_arrays is None:
+        li_model = get_li_model()
+
+        # Get the features produced when entering each state of the automaton
+        n_states = len(li_model.tk_nextmove) >> 8
+        outputs = [li_model.tk_output.get(s, ()) for s in range(n_states)]
+
+        # Store the arrays
+        li_arrays = {
+            'nextmove': np.frombuffer(li_model.tk_nextmove,
+                                      dtype=np.uint16).astype(np.intp),
+            'output_counts': np.fromiter(map(len, outputs), dtype=np.intp,
+                                         count=n_states),
+            'output_features': np.fromiter(
+                (f for o in outputs for f in o), dtype=np.intp),
+            'nb_ptc': np.asarray(li_model.nb_ptc, dtype=np.float64),
+            'nb_pc': np.asarray(li_model.nb_pc, dtype=np.float64),
+            'classes': np.asarray(li_model.nb_classes)}
+        li_arrays['output_offsets'] = np.cumsum(
+            li_arrays['output_counts']) - li_arrays['output_counts']
+
+    # Return the arrays
+    return li_arrays
+
+
+def count_li_features(sentences):
+    """Extracts the byte n-gram features of langid.py for multiple sentences
+    at once.
+
+    The automaton that langid.py runs over the bytes of each sentence is run
+    over all sentences in parallel: at each step, the next byte of every
+    sentence that is still long enough is fed to the automaton using a single
+    NumPy operation.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+
+    Returns:
+        A tuple of three NumPy arrays giving the sentence, the feature and the
+        number of occurrences for each feature found in the sentences. A
+        sentence and feature may occur more than once, in which case the
+        counts must be added up.
+    """
+    arrays = get_li_arrays()
+
+    # Encode the sentences and sort them from the longest to the shortest, so
+    # that the sentences still being read at each step are at the top
+    encoded = [s.encode('utf8') for s in sentences]
+    lengths = np.fromiter(map(len, encoded), dtype=np.intp,
+                          count=len(encoded))
+    order = np.argsort(-lengths, kind='stable')
+    lengths = lengths[order]
+
+    # Set up a matrix with the bytes of each sentence on a row, padded with
+    # zeros and stored column by column, and get the number of sentences
+    # still being read at each step
+    data = np.frombuffer(b''.join(encoded[i] for i in order), dtype=np.uint8)
+    columns = np.arange(len(data)) - np.repeat(np.cumsum(lengths) - lengths,
+                                               lengths)
+    matrix = np.zeros((len(encoded), lengths[0] if len(encoded) else 0),
+                      dtype=np.uint8, order='F')
+    matrix[np.repeat(np.arange(len(encoded)), lengths), columns] = data
+    active = np.searchsorted(-lengths, -np.arange(matrix.shape[1]),
+                             side='left')
+
+    # Run the automaton over the bytes, recording the states entered by each
+    # sentence
+    states = np.zeros(len(encoded), dtype=np.intp)
+    visits = np.empty(len(data), dtype=np.intp)
+    position = 0
+    for step, n in enumerate(active):
+        states[:n] = arrays['nextmove'][(states[:n] << 8) + matrix[:n, step]]
+        visits[position:position + n] = states[:n] + \
+            np.arange(n) * len(arrays['output_counts'])
+        position += n
+
+    # Count the visits to states that produce features for each sentence
+    visits = visits[arrays['output_counts'][visits % len(
+        arrays['output_counts'])] > 0]
+    visits, counts = np.unique(visits, return_counts=True)
+    rows, states = np.divmod(visits, len(arrays['output_counts']))
+
+    # Expand each state into the features it produces
+    n_outputs = arrays['output_counts'][states]
+    features = arrays['output_features'][
+        np.repeat(arrays['output_offsets'][states], n_outputs) +
+        np.arange(n_outputs.sum()) -
+        np.repeat(np.cumsum(n_outputs) - n_outputs, n_outputs)]
+
+    # Return the original position of each sentence, the features and counts
+    return (order[np.repeat(rows, n_outputs)], features,
+            np.repeat(counts, n_outputs))
+
+
+def predict_li_vectorized(sentences, batch_size=1000):
+    """Predicts the language of sentences using the langid.py model, scoring
+    batches of sentences using matrix operations.
+
+    The features of a batch are collected into a sparse matrix of counts,
+    which is multiplied with the log-probabilities of the features in each
+    language. The results match predict_li() up to floating point rounding,
+    as the sums are computed in a different order. If SciPy is not installed,
+    the counts are collected into a dense matrix instead.
+
+    Args:
+        sentences: A list of strings containing UTF-8 encoded text.
+        batch_size: An integer defining the maximum number of sentences scored
+                    at once.
+
+    Returns:
+        A tuple of two lists, which contain the predicted ISO-639 codes and
+        their probabilities.
+    """
+    arrays = get_li_arrays()
+
+    # Use a sparse matrix for the counts if SciPy is available. Otherwise
+    # limit the size of the batches, as the dense matrix of counts takes up
+    # about 60 MB for 1000 sentences.
+    try:
+        from scipy.sparse import csr_matrix
+    except ImportError:
+        csr_matrix = None
+        batch_size = min(batch_size, 1000)
+
+    # Set up lists for languages and probabilities
+    languages, probabilities = [], []
+
+    # Loop over the sentences in batches
+    for i in range(0, len(sentences), batch_size):
+        batch = sentences[i:i + batch_size]
+        shape = (len(batch), len(arrays['nb_ptc']))
+
+        # Count the features of each sentence
+        rows, features, counts = count_li_features(batch)
+
+        # Calculate the log-probability of each sentence in each language
+        if csr_matrix is not None:
+            scores = csr_matrix((counts.astype(np.float64), (rows, features)),
+                                shape=shape) @ arrays['nb_ptc']
+        else:
+            scores = np.bincount(rows * shape[1] + features, weights=counts,
+                                 minlength=shape[0] * shape[1])\
+                .reshape(shape) @ arrays['nb_ptc']
+        scores += arrays['nb_pc']
+
+        # Get the most probable language and normalize its probability in the
+        # same way as langid.py
+        best = scores.argmax(axis=1)
+        with np.errstate(over='ignore'):
+            probs = 1 / np.exp(scores - scores[np.arange(len(batch)), best,
+                                               None]).sum(axis=1)
+
+        # Store the languages and probabilities
+        languages.extend(arrays['classes'][best].tolist())
+        probabilities.extend(probs.tolist())
+
+    # Return languages and probabilities
+    return languages, probabilities
+
+
+def detect_li(caption, preprocessing, cache=None, script_threshold=None,
+              min_chars=None, caption_level=None):
+    """Identifies the language of a text using langid.py.
+
+    Args:
+        caption: A string containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        cache: An optional PredictionCache returned by open_cache().
+        script_threshold: If set, sentences in which this share of letters
+                          belongs to a script used by a single language are
+                          assigned to that language without calling langid.py,
+                          see detect_scripts().
+        min_chars: If set, sentences shorter than this number of characters
+                   are recorded as undetermined without calling langid.py, see
+                   predict_with_scripts().
+        caption_level: If set, captions without a possible sentence boundary
+                       and captions shorter than this number of characters
+                       are classified as a whole without splitting them into
+                       sentences, see split_caption().
+
+    Returns:
+        Saves the prediction into a column named 'langid' in the pandas
+        DataFrame as a list of three tuples. The three tuple consists of an
+        ISO-639 code, its associated probability and character length of the
+        string input to fastText, e.g. ('en', 0.99999, 21).
+    """
+    # Classify the caption as a batch of one
+    return detect_li_batch([caption], preprocessing, cache=cache,
+                           script_threshold=script_threshold,
+                           min_chars=min_chars,
+                           caption_level=caption_level)[0]
+
+
+def detect_li_batch(captions, preprocessing, cache=None,
+                    script_threshold=None, min_chars=None, batch_size=None,
+                    caption_level=None):
+    """Identifies the language of multiple texts using langid.py.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        cache: An optional PredictionCache returned by open_cache().
+        script_threshold: An optional threshold for assigning languages based
+                          on scripts, see detect_scripts().
+        min_chars: An optional minimum number of characters in sentences
+                   passed to the model, see predict_with_scripts().
+        batch_size: If set, the sentences are scored in batches of this size
+                    using predict_li_vectorized() instead of one at a time.
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A list with a prediction for each caption in the format returned by
+        detect_li().
+    """
+    # Preprocess the captions and get their sentences
+    sentences, spans = prepare_captions(captions, preprocessing,
+                                        caption_level)
+
+    # Select the function for making predictions
+    if batch_size is not None:
+        predict = partial(predict_li_vectorized, batch_size=batch_size)
+    else:
+        predict = predict_li
+
+    # Make predictions
+    languages, probabilities = predict_with_scripts(
+        sentences, partial(predict_with_cache, predict=predict, cache=cache),
+        script_threshold, min_chars)
+
+    # Return the predictions for each caption
+    return assemble_predictions(sentences, spans, languages, probabilities)
+
+
+def detect_dual_batch(captions, preprocessing, batch_size=None, ft_cache=None,
+                      li_cache=None, script_threshold=None, min_chars=None,
+                      caption_level=None):
+    """Identifies the language of multiple texts using both fastText and
+    langid.py, preprocessing and splitting the texts into sentences only once.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        batch_size: An integer defining the maximum number of sentences passed
+                    to fastText at once.
+        ft_cache: An optional PredictionCache for fastText.
+        li_cache: An optional PredictionCache for langid.py.
+        script_threshold: An optional threshold for assigning languages based
+                          on scripts, see detect_scripts().
+        min_chars: An optional minimum number of characters in sentences
+                   passed to the model, see predict_with_scripts().
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A tuple of three lists, each with an entry for each caption. The first
+        two lists contain the predictions of fastText and langid.py in the
+        format returned by detect_ft() and detect_li(). The third list contains
+        a list indicating whether the models agree on the language of each
+        sentence, or None if the caption has no text to classify. Sentences
+        assigned a language without calling the models, see
+        assign_without_model(), are marked None instead of a boolean.
+    """
+    # Preprocess the captions and get their sentences
+    sentences, spans = prepare_captions(captions, preprocessing,
+                                        caption_level)
+
+    # Assign languages based on scripts and skip short sentences once for
+    # both models
+    languages, probabilities = assign_without_model(sentences,
+                                                    script_threshold,
+                                                    min_chars)
+
+    # Get the sentences left to the models
+    missing = [i for i, lang in enumerate(languages) if lang is None]
+    remaining = [sentences[i] for i in missing]
+
+    # Make predictions for the same sentences using both models
+    ft_predictions = predict_with_cache(remaining, predict_ft, ft_cache,
+                                        batch_size=batch_size)
+    li_predictions = predict_with_cache(remaining, predict_li, li_cache)
+
+    # Merge the predictions of each model with the assigned languages
+    ft_languages, ft_probabilities = list(languages), list(probabilities)
+    li_languages, li_probabilities = list(languages), list(probabilities)
+    for i, ft_lang, ft_prob, li_lang, li_prob in zip(
+            missing, *ft_predictions, *li_predictions):
+        ft_languages[i], ft_probabilities[i] = ft_lang, ft_prob
+        li_languages[i], li_probabilities[i] = li_lang, li_prob
+
+    # Check if the models agree on the language of each sentence classified
+    # by both models
+    agreement = [None] * len(sentences)
+    for i in missing:
+        agreement[i] = ft_languages[i] == li_languages[i]
+
+    # Return the predictions and agreement for each caption
+    return (assemble_predictions(sentences, spans, ft_languages,
+                                 ft_probabilities),
+            assemble_predictions(sentences, spans, li_languages,
+                                 li_probabilities),
+            [None if span is None else agreement[span[0]:span[1]]
+             for span in spans])
+
+
+def detect_cascade_batch(captions, preprocessing, threshold, batch_size=None,
+                         ft_cache=None, li_cache=None, workers=None,
+                         script_threshold=None, min_chars=None,
+                         caption_level=None):
+    """Identifies the language of multiple texts using fastText and re-scores
+    the sentences for which fastText is unsure using langid.py.
+
+    All sentences are first passed to fastText in batches. Only sentences
+    whose fastText probability falls below the threshold are then passed to
+    langid.py, whose prediction replaces that of fastText. Sentences recorded
+    as undetermined because of their length are not re-scored.
+
+    Args:
+        captions: An iterable of strings containing UTF-8 encoded text.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       Valid values include: 'no_preprocessing'
+                       (no preprocessing),  'rm_all' (remove all hashtags) and
+                       'rm_trail' (remove trailing hashtags).
+        threshold: The fastText probability below which sentences are
+                   re-scored using langid.py, e.g. 0.4 for the threshold -ft
+                   of the scripts in ../plots.
+        batch_size: An integer defining the maximum number of sentences passed
+                    to fastText at once.
+        ft_cache: An optional PredictionCache for fastText.
+        li_cache: An optional PredictionCache for langid.py.
+        workers: An integer defining the number of processes used for
+                 re-scoring sentences using the vectorized langid.py engine,
+                 see predict_li_parallel().
+        script_threshold: An optional threshold for assigning languages based
+                          on scripts, see detect_scripts().
+        min_chars: An optional minimum number of characters in sentences
+                   passed to the models, see predict_with_scripts().
+        caption_level: An optional threshold for classifying captions as a
+                       whole without splitting them into sentences, see
+                       split_caption().
+
+    Returns:
+        A tuple of three lists, each with an entry for each caption. The first
+        list contains the final predictions and the second list the
+        predictions of fastText, both in the format returned by detect_ft().
+        The third list contains a list of booleans indicating whether each
+        sentence was re-scored using langid.py, or None if the caption has no
+        text to classify.
+    """
+    # Preprocess the captions and get their sentences
+    sentences, spans = prepare_captions(captions, preprocessing,
+                                        caption_level)
+
+    # Make predictions for all sentences using fastText
+    ft_languages, ft_probabilities = predict_with_scripts(
+        sentences, partial(predict_with_cache, predict=predict_ft,
+                           cache=ft_cache, batch_size=batch_size),
+        script_threshold, min_chars)
+
+    # Get the sentences for which fastText is unsure, skipping those marked
+    # as undetermined
+    rescored = [prob < threshold and lang != 'und'
+                for lang, prob in zip(ft_languages, ft_probabilities)]
+    uncertain = [i for i, r in enumerate(rescored) if r]
+
+    # Re-score the uncertain sentences using langid.py, importing the pool of
+    # processes here as the module depends on this one
+    from parallel_detection import predict_li_parallel
+    li_languages, li_probabilities = predict_with_cache(
+        [sentences[i] for i in uncertain],
+        partial(predict_li_parallel, workers=workers), li_cache)
+
+    # Replace the predictions of fastText with those of langid.py
+    languages, probabilities = list(ft_languages), list(ft_probabilities)
+    for i, li_lang, li_prob in zip(uncertain, li_languages, li_probabilities):
+        languages[i], probabilities[i] = li_lang, li_prob
+
+    # Return the final and fastText predictions and the re-scored sentences
+    # for each caption
+    return (assemble_predictions(sentences, spans, languages, probabilities),
+            assemble_predictions(sentences, spans, ft_languages,
+                                 ft_probabilities),
+            [None if span is None else rescored[span[0]:span[1]]
+             for span in spans])
+
+
+def checkpoint_keys(input_df):
+    """Determines the keys used for matching rows to checkpointed predictions.
+
+    Args:
+        input_df: A pandas DataFrame.
+
+    Returns:
+        A list of keys, which are taken from the column 'photo_id' if it
+        exists and contains unique values. Otherwise the keys are row
+        positions.
+    """
+    # Use photo identifiers if they uniquely identify the rows
+    if 'photo_id' in input_df.columns and input_df['photo_id'].is_unique:
+        return input_df['photo_id'].tolist()
+
+    # Otherwise fall back to row positions
+    return list(range(len(input_df)))
+
+
+def checkpoint_manifest(texts, keys, options):
+    """Describes a run saving checkpoints, so that a resumed run can check
+    that it processes the same input in the same way.
+
+    Args:
+        texts: A pandas Series containing the texts to process.
+        keys: A list of row keys returned by checkpoint_keys().
+        options: A dictionary of the options that affect the predictions,
+                 e.g. the path to the input file and the preprocessing
+                 strategy. The values must be serializable to JSON.
+
+    Returns:
+        A dictionary containing the options, the number of rows and a hash
+        of the keys and texts of the rows.
+    """
+    # Hash the keys and texts, which detects changes to the input even if the
+    # keys are row positions
+    content = hash_string('\x00'.join('{}\x01{}'.format(k, t)
+                                      for k, t in zip(keys, texts)))
+
+    # Return the options with the description of the input
+    return dict(options, rows=len(keys), input_hash=content)
+
+
+def load_checkpoints(directory):
+    """Loads the predictions saved in a checkpoint directory.
+
+    Args:
+        directory: Path to the directory containing checkpoints saved by
+                   classify_with_checkpoints().
+
+    Returns:
+        A dictionary mapping row keys to predictions.
+    """
+    # Set up a dictionary for the predictions
+    predictions = {}
+
+    # Loop over the checkpoints in the order they were saved
+    for path in sorted(glob.glob(os.path.join(directory, 'part-*.pkl'))):
+        part = pd.read_pickle(path)
+        predictions.update(zip(part['key'], part['langid']))
+
+    # Return the predictions
+    return predictions
+
+
+def check_manifest(directory, manifest):
+    """Checks that the checkpoints in a directory were saved by a run with the
+    same input and options before they are resumed.
+
+    Args:
+        directory: Path to the directory containing checkpoints saved by
+                   classify_with_checkpoints().
+        manifest: A dictionary returned by checkpoint_manifest() for the
+                  current run.
+
+    Raises:
+        ValueError: If the checkpoints have no manifest or their manifest
+                    differs from the current run.
+    """
+    # Nothing to check if no checkpoints have been saved yet
+    if not glob.glob(os.path.join(directory, 'part-*.pkl')):
+        return
+
+    # Load the manifest saved with the checkpoints
+    path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(path):
+        raise ValueError('Cannot resume from the checkpoints in {}, which '
+                         'have no manifest'.format(directory))
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+
+    # Compare the manifests, listing the entries that differ
+    different = sorted(k for k in set(saved) | set(manifest)
+                       if saved.get(k) != manifest.get(k))
+    if different:
+        raise ValueError('Cannot resume from the checkpoints in {}, which '
+                         'were saved with a different {}'
+                         .format(directory, ', '.join(different)))
+
+
+def classify_with_checkpoints(texts, keys, classify, directory, every,
+                              resume=False, options=None):
+    """Identifies the language of texts, saving the predictions to disk after
+    every block of rows so that an interrupted run can be resumed.
+
+    A manifest describing the input and the options is saved with the
+    checkpoints, see checkpoint_manifest(). Resuming from checkpoints whose
+    manifest differs from the current run raises a ValueError.
+
+    Args:
+        texts: A pandas Series containing the texts to process.
+        keys: A list of row keys returned by checkpoint_keys().
+        classify: A function that takes a pandas Series of texts and returns
+                  a list or Series of predictions.
+        directory: Path to the directory in which the checkpoints are saved.
+        every: The number of rows classified between checkpoints.
+        resume: If True, rows found in existing checkpoints are not classified
+                again. If False, existing checkpoints are removed.
+        options: An optional dictionary of the options that affect the
+                 predictions, which is saved in the manifest.
+
+    Returns:
+        A list with a prediction for each text, merged from all checkpoints.
+    """
+    # Describe the current run
+    manifest = checkpoint_manifest(texts, keys, options or {})
+
+    # Create the checkpoint directory
+    os.makedirs(directory, exist_ok=True)
+
+    # Check that existing checkpoints match the current run if the run is
+    # resumed, otherwise remove them
+    if resume:
+        check_manifest(directory, manifest)
+    else:
+        for path in glob.glob(os.path.join(directory, 'part-*.pkl')):
+            os.remove(path)
+
+    # Save the manifest of the current run
+    with open(os.path.join(directory, 'manifest.json'), 'w',
+              encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Load the predictions from existing checkpoints
+    done = load_checkpoints(directory)
+
+    # Get the positions of rows that have not been classified yet
+    todo = [i for i, key in enumerate(keys) if key not in done]
+
+    # Inform the user
+    print('[INFO] Found {} classified rows in checkpoints, {} rows left'
+          .format(len(keys) - len(todo), len(todo)))
+
+    # Continue numbering the checkpoints from the last one saved
+    part = len(glob.glob(os.path.join(directory, 'part-*.pkl')))
+
+    # Loop over the remaining rows in blocks
+    for i in range(0, len(todo), every):
+        block = todo[i:i + every]
+
+        # Classify the block of texts
+        predictions = list(classify(texts.iloc[block]))
+
+        # Save the predictions under a temporary name and rename the file
+        # once complete, so that an interruption cannot leave a partially
+        # written checkpoint behind
+        path = os.path.join(directory, 'part-{:06d}.pkl'.format(part))
+        pd.DataFrame({'key': [keys[j] for j in block],
+                      'langid': predictions}).to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        part += 1
+
+        # Add the predictions to those already done
+        done.update(zip((keys[j] for j in block), predictions))
+
+        # Inform the user
+        print('[INFO] Checkpoint saved: {} of {} rows classified'
+              .format(len(keys) - len(todo) + i + len(block), len(keys)))
+
+    # Return the predictions in the order of the input
+    return [done[key] for key in keys]
+
+
+def content_hashes(texts, preprocessing):
+    """Calculates a hash for each text, which is used for detecting texts that
+    have changed since they were classified.
+
+    Args:
+        texts: An iterable of texts.
+        preprocessing: A string indicating the selected preprocessing strategy.
+                       The strategy is included in the hash, so that texts are
+                       classified again if the strategy changes.
+
+    Returns:
+        A list of hexadecimal digests.
+    """
+    return [hash_string('{}\x00{}'.format(preprocessing, t)) for t in texts]
+
+
+def update_predictions(input_df, previous_df, column, preprocessing,
+                       classify):
+    """Classifies only the rows of a DataFrame that are new or whose text has
+    changed since a previous run, and merges the results with the output of
+    the previous run.
+
+    The rows are matched using the column 'photo_id'. The hash of each text is
+    stored in the column 'langid_hash' of the output, see content_hashes().
+    If the previous output has no hashes, all rows of the input are treated
+    as changed.
+
+    Args:
+        input_df: A pandas DataFrame with new and updated rows.
+        previous_df: A pandas DataFrame with the output of a previous run.
+        column: The name of the column containing the texts to process.
+        preprocessing: A string indicating the selected preprocessing strategy.
+        classify: A function that takes a pandas Series of texts and returns a
+                  dictionary mapping the names of output columns to pandas
+                  Series with a prediction for each text.
+
+    Returns:
+        A tuple consisting of the merged DataFrame, which contains the rows of
+        the previous output that are not found in the input followed by the
+        rows of the input, and the dictionary returned by classify() for the
+        new and changed rows.
+    """
+    # Check that the rows can be matched
+    for name, df in [('input', input_df), ('previous output', previous_df)]:
+        if 'photo_id' not in df.columns or not df['photo_id'].is_unique:
+            raise ValueError('The {} must contain unique identifiers in the '
+                             'column photo_id'.format(name))
+
+    # Hash the texts of the input
+    input_df = input_df.copy()
+    input_df['langid_hash'] = content_hashes(input_df[column], preprocessing)
+
+    # Find the rows that are new or whose text has changed. If the previous
+    # output has no hashes, the strategy used for classifying its texts is
+    # unknown and all rows of the input are classified again.
+    if 'langid_hash' in previous_df.columns:
+        previous_hashes = pd.Series(previous_df['langid_hash'].values,
+                                    index=previous_df['photo_id'])
+        stale = (input_df['photo_id'].map(previous_hashes) !=
+                 input_df['langid_hash']).tolist()
+    else:
+        print('[INFO] The previous output has no column langid_hash, '
+              'classifying all rows of the input again')
+        stale = [True] * len(input_df)
+
+    # Classify the new and changed rows
+    predictions = classify(input_df.loc[stale, column])
+
+    # Combine the new predictions with the predictions for unchanged rows,
+    # which are copied from the previous output
+    for col, new in predictions.items():
+        if col not in previous_df.columns:
+            raise ValueError('The column {} is missing from the previous '
+                             'output'.format(col))
+        old = dict(zip(previous_df['photo_id'], previous_df[col]))
+        new = iter(new)
+        input_df[col] = pd.Series([next(new) if s else old[p] for s, p in
+                                   zip(stale, input_df['photo_id'])],
+                                  index=input_df.index, dtype=object)
+
+    # Add the rows of the previous output that are not found in the input
+    merged = pd.concat([previous_df[~previous_df['photo_id'].isin(
+        input_df['photo_id'])], input_df], ignore_index=True)
+
+    # Return the merged DataFrame and the new predictions
+    return merged, predictions
+
+
+def table_format(path):
+    """Determines the format of a table from its file extension.
+
+    Args:
+        path: Path to a file.
+
+    Returns:
+        A string indicating the format: 'parquet', 'jsonl' or 'csv'.
+    """
+    # Check the file extension
+    if path.endswith('.parquet'):
+        return 'parquet'
+
+    if path.endswith(('.jsonl', '.json')):
+        return 'jsonl'
+
+    if path.endswith('.csv'):
+        return 'csv'
+
+    # Raise an error for unsupported formats, e.g. pickles
+    raise ValueError("Cannot read or write {} in chunks: supported formats "
+                     "include Parquet (.parquet), JSON lines (.jsonl) and CSV "
+                     "(.csv).".format(path))
+
+
+def read_chunks(path, chunksize):
+    """Reads a table from disk in chunks of rows.
+
+    Args:
+        path: Path to a Parquet, JSON lines or CSV file.
+        chunksize: The number of rows in each chunk.
+
+    Returns:
+        A generator yielding pandas DataFrames with at most chunksize rows.
+    """
+    # Determine the format of the input file
+    fmt = table_format(path)
+
+    # Read Parquet files in batches of rows using pyarrow
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+    # Read JSON lines without inferring data types, so that e.g. identifiers
+    # consisting of digits remain strings
+    if fmt == 'jsonl':
+        for chunk in pd.read_json(path, lines=True, chunksize=chunksize,
+                                  dtype=False):
+            yield chunk
+
+    # Read CSV files
+    if fmt == 'csv':
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield chunk
+
+
+class ChunkWriter(object):
+    """Appends pandas DataFrames to a table on disk one chunk at a time.
+
+    The format of the table is determined by the file extension, see
+    table_format(). Any existing file is overwritten by the first chunk. In
+    Parquet files, each chunk is written as a separate row group and the
+    predictions in the column 'langid' are stored as a list of structs with
+    the fields 'language', 'probability' and 'char_len'. Use read_table() to
+    read the table back with the predictions as lists of tuples.
+
+    Args:
+        path: Path to the output file.
+    """
+
+    # Define the Parquet type for columns holding predictions
+    prediction_fields = [('language', 'string'), ('probability', 'float64'),
+                         ('char_len', 'int64')]
+
+    def __init__(self, path):
+
+        # Assign arguments to attributes
+        self.path = path
+        self.format = table_format(path)
+
+        # The Parquet writer is opened once the schema of the first chunk is
+        # known
+        self.writer = None
+
+        # Set up a counter for the chunks written
+        self.chunks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, chunk, columns=('langid',), flags=()):
+        """Appends a chunk to the table.
+
+        Args:
+            chunk: A pandas DataFrame.
+            columns: The names of columns holding predictions, i.e. lists of
+                     (language, probability, character length) tuples.
+            flags: The names of columns holding lists of booleans, e.g. one
+                   for each sentence.
+        """
+        # Write Parquet files using pyarrow
+        if self.format == 'parquet':
+            self.write_parquet(chunk, columns, flags)
+
+        # Write JSON lines, overwriting any existing file on the first chunk.
+        # Probabilities are written with the maximum precision of 15 digits.
+        if self.format == 'jsonl':
+            with open(self.path, 'a' if self.chunks else 'w',
+                      encoding='utf-8') as f:
+                records = chunk.to_json(orient='records', lines=True,
+                                        date_format='iso', force_ascii=False,
+                                        double_precision=15)
+                f.write(records if records.endswith('\n') else records + '\n')
+
+        # Write CSV files, including the header only in the first chunk
+        if self.format == 'csv':
+            chunk.to_csv(self.path, mode='a' if self.chunks else 'w',
+                         header=not self.chunks, index=False)
+
+        # Update the counter
+        self.chunks += 1
+
+    def write_parquet(self, chunk, columns, flags=()):
+        """Appends a chunk to a Parquet file as a row group.
+
+        Args:
+            chunk: A pandas DataFrame.
+            columns: The names of columns holding predictions.
+            flags: The names of columns holding lists of booleans.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Convert the prediction tuples into dictionaries, which pyarrow
+        # stores as structs
+        chunk = chunk.copy()
+        names = [f[0] for f in self.prediction_fields]
+        for col in columns:
+            chunk[col] = [None if p is None else [dict(zip(names, t))
+                                                  for t in p]
+                          for p in chunk[col]]
+
+        # Open the writer on the first chunk, fixing the type of prediction
+        # and flag columns, as it cannot be inferred from chunks without
+        # predictions
+        if self.writer is None:
+            schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+            prediction_type = pa.list_(pa.struct(
+                [(n, pa.type_for_alias(t))
+                 for n, t in self.prediction_fields]))
+            for col in columns:
+                schema = schema.set(schema.get_field_index(col),
+                                    pa.field(col, prediction_type))
+            for col in flags:
+                schema = schema.set(schema.get_field_index(col),
+                                    pa.field(col, pa.list_(pa.bool_())))
+            self.writer = pq.ParquetWriter(self.path, schema)
+
+        # Convert the chunk into a table using the schema and write it to disk
+        self.writer.write_table(pa.Table.from_pandas(
+            chunk, schema=self.writer.schema, preserve_index=False))
+
+    def close(self):
+        """Closes the Parquet writer, if one has been opened."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def decode_column(values, fmt, kind=tuple):
+    """Converts the values of a column of predictions or flags read from a
+    table written by ChunkWriter back into the lists of tuples or booleans
+    stored in pickled DataFrames.
+
+    In CSV files, the values are stored as their string representation, in
+    JSON lines as lists of lists and in Parquet files as lists of structs.
+
+    Args:
+        values: An iterable of values read from the table.
+        fmt: The format of the table returned by table_format().
+        kind: tuple for columns holding predictions, or bool for columns
+              holding flags.
+
+    Returns:
+        A list with a list of tuples or booleans for each row, or None for
+        rows without predictions.
+    """
+    # Set up a list for the converted values
+    decoded = []
+
+    for value in values:
+
+        # Keep rows without predictions missing, which are read as None from
+        # Parquet and JSON lines and as NaN from CSV files
+        if value is None or isinstance(value, float):
+            decoded.append(None)
+            continue
+
+        # Evaluate the string representation written to CSV files
+        if fmt == 'csv':
+            value = ast.literal_eval(value)
+
+        # Convert the structs read from Parquet files into tuples
+        if fmt == 'parquet' and kind is tuple:
+            value = [(v['language'], v['probability'], v['char_len'])
+                     for v in value]
+
+        # Convert the elements into tuples or booleans, keeping the flags of
+        # sentences that were not compared missing
+        decoded.append([tuple(v) if kind is tuple else
+                        None if v is None else bool(v) for v in value])
+
+    # Return the converted values
+    return decoded
+
+
+def read_table(path, columns=('langid',), flags=(), chunksize=100000):
+    """Reads a table written by ChunkWriter into a single DataFrame in the
+    format used by pickled outputs, e.g. for the scripts in ../plots and
+    ../stats.
+
+    Args:
+        path: Path to a Parquet, JSON lines or CSV file.
+        columns: The names of columns holding predictions.
+        flags: The names of columns holding lists of booleans.
+        chunksize: The number of rows read at a time.
+
+    Returns:
+        A pandas DataFrame in which the predictions are lists of
+        (language, probability, character length) tuples.
+    """
+    # Determine the format of the table
+    fmt = table_format(path)
 
-        # Return languages and probabilities
-        return list(zip(languages, probabilities, char_len))
+    # Read the table in chunks, converting the predictions and flags
+    chunks = []
+    for chunk in read_chunks(path, chunksize):
+        for col in columns:
+            chunk[col] = pd.Series(decode_column(chunk[col], fmt),
+                                   index=chunk.index, dtype=object)
+        for col in flags:
+            chunk[col] = pd.Series(decode_column(chunk[col], fmt, bool),
+                                   index=chunk.index, dtype=object)
+        chunks.append(chunk)
 
+    # Return the chunks as a single DataFrame
+    return pd.concat(chunks, ignore_index=True)
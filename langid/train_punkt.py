@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import preprocess_caption, train_sentence_tokenizer
+import argparse
+import pandas as pd
+
+"""
+This script trains the parameters of the Punkt sentence tokenizer on a sample
+of texts stored in a pandas DataFrame and saves them to disk. The parameters
+can be then passed to run_fasttext.py and run_langid.py using the argument
+-sp/--sentence_params, which saves retraining the tokenizer on every run.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 train_punkt.py -i input.pkl -o punkt_params.pkl -p 'rm_all'
+
+Returns:
+    A pickled PunktParameters object containing the abbreviations, collocations
+    and sentence starters learned from the data.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=True,
+                help="Path to the file in which the parameters are saved.")
+
+# Define the preprocessing strategy
+ap.add_argument("-p", "--preprocessing", required=True,
+                help="Preprocessing strategy applied to the texts before "
+                     "training: valid values include 'no_preprocessing', "
+                     "'rm_all' and 'rm_trail'. Use the same strategy as for "
+                     "language identification.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define the sample size
+ap.add_argument("-n", "--sample_size", required=False, type=int,
+                default=100000,
+                help="Number of texts sampled for training. Defaults to "
+                     "100000.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Assign arguments to variables
+prep = args['preprocessing']
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Load the input DataFrame and drop missing texts
+input_df = pd.read_pickle(args['input'])
+texts = input_df.loc[input_df[inputcol].notnull() &
+                     (input_df[inputcol] != 'None'), inputcol]
+
+# Draw a sample of texts, if the data is larger than the sample size
+if len(texts) > args['sample_size']:
+    texts = texts.sample(n=args['sample_size'], random_state=42)
+
+# Inform the user
+print('[INFO] Training Punkt parameters on {} texts ...'.format(len(texts)))
+
+# Preprocess the texts, train the parameters and save them to disk
+params = train_sentence_tokenizer((preprocess_caption(t, prep) for t in texts),
+                                  args['output'])
+
+# Print status
+print('[INFO] Learned {} abbreviations, {} collocations and {} sentence '
+      'starters'.format(len(params.abbrev_types), len(params.collocations),
+                        len(params.sent_starters)))
+print('[INFO] ... Done!')
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from supporting_functions import preprocess_caption
+from hashtag_segmentation import train_word_frequencies
+import argparse
+import pandas as pd
+
+"""
+This script counts the frequencies of words in a sample of texts stored in a
+pandas DataFrame and saves them to disk. The frequencies can be then passed to
+run_fasttext.py and run_langid.py using the argument
+-hs/--hashtag_segmentation, which splits concatenated hashtags into words,
+e.g. '#helsinkibynight' into 'helsinki by night', when using the 'rm_trail'
+preprocessing strategy.
+
+The words are counted in the text of the captions, excluding hashtags,
+mentions and URLs, so that the frequencies reflect the languages and
+vocabulary of the data.
+
+Usage:
+    Execute the script by running the following command:
+
+    python3 train_word_frequencies.py -i input.pkl -o word_frequencies.pkl
+
+Returns:
+    A pickled dictionary mapping each word to its number of occurrences.
+"""
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to the pandas DataFrame with the texts to process. "
+                     "The texts are expected to be found in a column named "
+                     "'text'.")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=True,
+                help="Path to the file in which the frequencies are saved.")
+
+# Define input column manually
+ap.add_argument("-c", "--column", required=False,
+                help="The name of the column containing the texts to process.")
+
+# Define the sample size
+ap.add_argument("-n", "--sample_size", required=False, type=int,
+                default=1000000,
+                help="Number of texts sampled for counting the words. "
+                     "Defaults to 1000000.")
+
+# Define the minimum number of occurrences
+ap.add_argument("-m", "--min_count", required=False, type=int, default=2,
+                help="Minimum number of occurrences of a word. Defaults to 2.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# Check if DataFrame input column has been set manually
+if args['column'] is not None:
+    inputcol = args['column']
+else:
+    inputcol = 'text'
+
+# Load the input DataFrame and drop missing texts
+input_df = pd.read_pickle(args['input'])
+texts = input_df.loc[input_df[inputcol].notnull() &
+                     (input_df[inputcol] != 'None'), inputcol]
+
+# Draw a sample of texts, if the data is larger than the sample size
+if len(texts) > args['sample_size']:
+    texts = texts.sample(n=args['sample_size'], random_state=42)
+
+# Inform the user
+print('[INFO] Counting words in {} texts ...'.format(len(texts)))
+
+# Remove emoji, mentions, hashtags and URLs, so that only the words in the
+# text of the captions are counted
+texts = [preprocess_caption(t, 'rm_all') for t in texts]
+
+# Count the words and save their frequencies to disk
+frequencies = train_word_frequencies(texts, args['output'], args['min_count'])
+
+# Print status
+print('[INFO] Saved the frequencies of {} words'.format(len(frequencies)))
+print('[INFO] ... Done!')
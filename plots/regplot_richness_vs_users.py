@@ -13,13 +13,17 @@ Arguments:
     -df/--dataframe: Path to the pandas DataFrame containing the data.
     -ft/--fthresh: fastText confidence threshold for including the data.
     -ct/--cthresh: Character length thredshold for including the data.
+    -ar/--arrays: Path to the predictions saved in columnar format.
+    -dd/--dedupe: Keep only one post in each cluster of near-duplicates.
     -b/--n_boot: Number of bootstrapped samples to draw from the data.
 
 Returns:
     The plot, saved into the file regplot_rich_vs_users.pdf.
 """
 
-from supporting_functions import diversity, extract_predictions
+from supporting_functions import deduplicate, diversity, \
+    extract_predictions
+from prediction_arrays import load_prediction_arrays
 from labellines import labelLines
 import argparse
 import datetime
@@ -44,6 +48,18 @@ ap.add_argument("-ct", "--cthresh", required=False, type=int,
                 help="Character length threshold for including data into the "
                      "plot. The value must be an integer.")
 
+ap.add_argument("-ar", "--arrays", required=False,
+                help="Path to the predictions saved in columnar format using "
+                     "the argument -ar/--arrays of the language "
+                     "identification scripts. If provided, these are used "
+                     "instead of the column 'langid'.")
+
+ap.add_argument("-dd", "--dedupe", action='store_true',
+                help="Keep only the first post in each cluster of "
+                     "near-duplicate captions grouped by the language "
+                     "identification scripts using the argument "
+                     "-dd/--dedupe.")
+
 ap.add_argument("-b", "--n_boot", required=True, type=int,
                 help="Number of bootstrapped samples to draw from the data.")
 
@@ -79,8 +95,18 @@ if args['cthresh']:
 # Load dataframe
 input_df = pd.read_pickle(path_to_df)
 
+# Drop near-duplicate posts, if requested
+if args['dedupe']:
+    input_df = deduplicate(input_df)
+
+# Load the predictions in columnar format, if provided
+if args['arrays']:
+    arrays = load_prediction_arrays(args['arrays'])
+else:
+    arrays = None
+
 # Extract predictions from the input DataFrame
-posts = extract_predictions(input_df)
+posts = extract_predictions(input_df, arrays)
 
 # If thresholds have been defined, drop the predictions below the threshold
 if args['fthresh']:
@@ -5,9 +5,18 @@ This file contains supporting functions for diversity analyses and plotting.
 """
 
 import numpy as np
+import os
 import pandas as pd
 import pytz
 import skbio.diversity.alpha as sk
+import sys
+
+# The predictions saved in columnar format are read using the module that
+# defines the format in ../langid. Importing this file also makes the module
+# importable for the scripts in this directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'langid'))
+from prediction_arrays import extract_sentences  # noqa: E402
 
 
 def diversity(languages, measurement):
@@ -173,7 +182,30 @@ def extract_weekly_predictions(grouped_weeks, languages, bundle=False):
     return sort(weeks)
 
 
-def extract_predictions(input_df):
+def deduplicate(input_df):
+    """
+    This function keeps only the first post in each cluster of near-duplicate
+    captions, e.g. templated captions posted by spam accounts, which have been
+    grouped by the language identification scripts using the argument
+    -dd/--dedupe.
+
+    Parameters:
+        input_df: a pandas DataFrame with the position of the first post in
+        the cluster of each post in the column 'cluster_id'
+
+    Returns:
+        A pandas DataFrame with a single post from each cluster.
+    """
+    # Check that the clusters have been assigned
+    if 'cluster_id' not in input_df.columns:
+        raise KeyError("The column 'cluster_id' was not found; run the "
+                       "language identification with -dd/--dedupe first")
+
+    # Keep the first post in each cluster
+    return input_df.drop_duplicates(subset='cluster_id')
+
+
+def extract_predictions(input_df, arrays=None):
     """
     This function extracts the output of a language identification framework
     from a pandas DataFrame, returning a new DataFrame with the predicted
@@ -184,11 +216,26 @@ def extract_predictions(input_df):
     Parameters:
         input_df: a pandas DataFrame containing predictions for the language of
         the caption in the column 'predictions'
+        arrays: optional predictions in columnar format, i.e. the tuple
+        returned by load_prediction_arrays(), which are matched to the rows of
+        input_df using the column 'photo_id'. If provided, the column 'langid' is not
+        used.
 
     Returns:
         A Pandas DataFrame with the predicted language of each sentence in the
         captions of the original DataFrame.
     """
+    # If the predictions have been loaded in columnar format, extract them
+    # without looping over the rows
+    if arrays is not None:
+
+        # Get the predictions for each sentence and the photo, user and time
+        # of the post it belongs to, using the same columns as below
+        sentences = extract_sentences(
+            *arrays, input_df,
+            columns=['photo_id', 'user_id', 'time_created_local'])
+        return sentences.astype({'photo_id': str, 'user_id': float})
+
     # Calculate the number of rows required for the output dataframe by applying
     # the count_preds function to each cell
     rows_needed = sum(input_df['langid'].apply(lambda x: len(x)))
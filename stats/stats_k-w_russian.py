@@ -14,12 +14,14 @@ Arguments:
     -df/--dataframe: Path to the pandas DataFrame containing the data.
     -ft/--fthresh: fastText confidence threshold for including the data.
     -ct/--cthresh: Character length thredshold for including the data.
+    -ar/--arrays: Path to the predictions saved in columnar format.
 
 Output:
     Kruskal-Wallis H-statistic printed on standard output.
 """
 
 from supporting_functions import extract_predictions
+from prediction_arrays import load_prediction_arrays
 from scipy.stats import kruskal
 import argparse
 import pandas as pd
@@ -40,6 +42,12 @@ ap.add_argument("-ct", "--cthresh", required=False, type=int,
                 help="Character length threshold for including data into the "
                      "plot. The value must be an integer.")
 
+ap.add_argument("-ar", "--arrays", required=False,
+                help="Path to the predictions saved in columnar format using "
+                     "the argument -ar/--arrays of the language "
+                     "identification scripts. If provided, these are used "
+                     "instead of the column 'langid'.")
+
 
 # Initialize seaborn for prettier plots.
 sns.set()
@@ -62,8 +70,14 @@ if args['cthresh']:
 # Load DataFrame
 df = pd.read_pickle(path_to_df)
 
+# Load the predictions in columnar format, if provided
+if args['arrays']:
+    arrays = load_prediction_arrays(args['arrays'])
+else:
+    arrays = None
+
 # Extract predictions from the input DataFrame
-posts = extract_predictions(df)
+posts = extract_predictions(df, arrays)
 len_orig = len(posts)
 
 # Print status
@@ -16,6 +16,9 @@ Arguments:
                    the captions to be included in the topic model.
     -c/--country: The origin country for the users whose captions are included
                   in the topic model.
+    -ar/--arrays: Path to the predictions saved in columnar format using the
+                  argument -ar/--arrays of the language identification scripts.
+                  If provided, these are used instead of the column 'langid'.
    
 Returns:
     A LaTeX table containing topics and their coherence scores.
@@ -31,9 +34,17 @@ import argparse
 import emoji
 import gensim
 import numpy as np
+import os
 import pandas as pd
 import re
 import string
+import sys
+
+# The predictions saved in columnar format are read using the module that
+# defines the format in ../langid
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'langid'))
+from prediction_arrays import load_prediction_arrays, match_rows  # noqa: E402
 
 
 # Set up the argument parser
@@ -47,6 +58,8 @@ ap.add_argument("-l", "--language", required=True,
                      "modelling.")
 ap.add_argument("-c", "--country", required=True,
                 help="Name of the country ...")
+ap.add_argument("-ar", "--arrays", required=False,
+                help="Path to the predictions saved in columnar format.")
 
 # Parse arguments
 args = vars(ap.parse_args())
@@ -84,21 +97,44 @@ excl = set(string.punctuation)
 # Set up a placeholder list for sentences preprocessed for topic modelling
 sents = []
 
+# If the predictions have been saved in columnar format, find the captions
+# without codeswitching and written in the chosen language using the arrays
+if args['arrays']:
+
+    # Load the arrays for the predictions and the photo identifiers
+    arrays, keys = load_prediction_arrays(args['arrays'])
+
+    # Match the captions with the rows of the input DataFrame and check which
+    # contain sentences only in the chosen language
+    monolingual = pd.Series(
+        match_rows(arrays, keys, input_df['photo_id']).monolingual(language),
+        index=input_df.index)
+
 # Begin looping over the input DataFrame
 for ix, row in input_df.iterrows():
 
-    # Assign the predictions into a variable
-    predictions = row['langid']
+    # Check the result looked up from the arrays, if available
+    if args['arrays']:
+        selected = monolingual[ix]
+
+    else:
+        # Assign the predictions into a variable
+        predictions = row['langid']
+
+        # Set up a list to hold all predictions for a single caption
+        preds_list = [p[0] for p in predictions]
 
-    # Set up a list to hold all predictions for a single caption
-    preds_list = [p[0] for p in predictions]
+        # Reduce the set to a list
+        preds_list = set(preds_list)
 
-    # Reduce the set to a list
-    preds_list = set(preds_list)
+        # Check for captions without codeswitching and written in the language
+        # chosen for topic modelling
+        selected = (len(preds_list) == 1 and
+                    list(preds_list)[0] == args['language'])
 
     # Filter the result for captions without codeswitching and written in the
     # language chosen for topic modelling
-    if len(preds_list) == 1 and list(preds_list)[0] == args['language']:
+    if selected:
 
         # Assign caption to variable
         caption = row['text']
@@ -7,17 +7,37 @@ identification.
 Usage:
     Execute the script from the command line using the following command:
 
-    python3 get_langid_models.py
+    python3 get_fasttext_model.py
+
+    To download the compressed model, which is much smaller and takes up less
+    memory at a small cost in accuracy, run:
+
+    python3 get_fasttext_model.py -c
 
 Returns:
-    Downloads the model and saves it to ../langid/models/lid.176.bin. This
-    allows you to perform language identification using fastText. For more
-    details see ../langid.
+    Downloads the model and saves it to ../langid/models/lid.176.bin, or to
+    ../langid/models/lid.176.ftz for the compressed model. This allows you to
+    perform language identification using fastText. For more details see
+    ../langid.
 """
 
+import argparse
 import urllib.request
 import os
 
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define whether to download the compressed model
+ap.add_argument("-c", "--compressed", action='store_true',
+                help="Download the compressed model lid.176.ftz instead of "
+                     "the full model lid.176.bin. Use the compressed model "
+                     "by passing -fm models/lid.176.ftz to the language "
+                     "identification scripts.")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
 # Set root directory
 rootdir = os.path.dirname(os.path.dirname(__file__))
 
@@ -31,14 +51,18 @@ os.makedirs(target_path, exist_ok=True)
 # Print status when target directory has been created
 print('[INFO] Path created!')
 
+# Define the name of the model file
+MODEL_FILE = 'lid.176.ftz' if args['compressed'] else 'lid.176.bin'
+
 # Define model URL
-MODEL_URL = "https://s3-us-west-1.amazonaws.com/fasttext-vectors/" \
-            "supervised_models/lid.176.bin"
+MODEL_URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/" \
+            + MODEL_FILE
 
 # Print status and download model
-print('[INFO] Note: Downloading the model can take up to 10 minutes')
+if not args['compressed']:
+    print('[INFO] Note: Downloading the model can take up to 10 minutes')
 print('[INFO] Downloading model...')
-urllib.request.urlretrieve(MODEL_URL, os.path.join(target_path, 'lid.176.bin'))
+urllib.request.urlretrieve(MODEL_URL, os.path.join(target_path, MODEL_FILE))
 
 # Print status when complete
 print('[INFO] ... Done!')